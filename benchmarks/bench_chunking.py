@@ -0,0 +1,86 @@
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+import argparse
+import time
+import tracemalloc
+
+from hyperrag.operate import chunking_by_token_size
+from hyperrag.utils import decode_tokens_by_tiktoken, encode_string_by_tiktoken
+
+
+def chunking_by_decode(content, overlap_token_size=128, max_token_size=1024):
+    # The previous implementation: decode a fresh token slice for every window.
+    tokens = encode_string_by_tiktoken(content)
+    results = []
+    for index, start in enumerate(
+        range(0, len(tokens), max_token_size - overlap_token_size)
+    ):
+        chunk_content = decode_tokens_by_tiktoken(tokens[start : start + max_token_size])
+        results.append(
+            {
+                "tokens": len(tokens[start : start + max_token_size]),
+                "content": chunk_content.strip(),
+                "chunk_order_index": index,
+            }
+        )
+    return results
+
+
+def consume(chunks):
+    count = 0
+    for _ in chunks:
+        count += 1
+    return count
+
+
+def measure(label, fn):
+    start = time.perf_counter()
+    count = fn()
+    elapsed = time.perf_counter() - start
+    # Memory is traced in a second run, tracing slows allocation-heavy code.
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<28s} {elapsed:8.3f} s   peak {peak / 2**20:9.1f} MiB   {count} chunks")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark token-based chunking.")
+    parser.add_argument(
+        "--input",
+        default=str(Path(__file__).resolve().parent.parent / "examples" / "mock_data.txt"),
+    )
+    parser.add_argument("--size-mb", type=float, default=20, help="document size to build by repeating the input")
+    parser.add_argument("--chunk-token-size", type=int, default=1200)
+    parser.add_argument("--overlap-token-size", type=int, default=100)
+    args = parser.parse_args()
+
+    text = Path(args.input).read_text(encoding="utf-8")
+    target = int(args.size_mb * 2**20)
+    document = (text * (target // len(text) + 1))[:target]
+    print(f"document: {len(document) / 2**20:.1f} MiB")
+
+    sizes = dict(
+        overlap_token_size=args.overlap_token_size,
+        max_token_size=args.chunk_token_size,
+    )
+    assert [c["content"] for c in chunking_by_decode(document[:200000], **sizes)] == [
+        c["content"] for c in chunking_by_token_size(document[:200000], **sizes)
+    ]
+
+    baseline = measure("decode(tokens) per chunk", lambda: len(chunking_by_decode(document, **sizes)))
+    offsets = measure("offset slices (list)", lambda: len(chunking_by_token_size(document, **sizes)))
+    lazy = measure(
+        "offset slices (generator)",
+        lambda: consume(chunking_by_token_size(document, as_generator=True, **sizes)),
+    )
+    print(f"speed-up: {baseline / offsets:.1f}x (list), {baseline / lazy:.1f}x (generator)")
+
+
+if __name__ == "__main__":
+    main()
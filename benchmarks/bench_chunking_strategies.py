@@ -0,0 +1,66 @@
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+import argparse
+
+from hyperrag.operate import (
+    build_entity_extraction_prompts,
+    chunk_document,
+    chunking_by_markdown_headings,
+    chunking_by_paragraphs,
+    chunking_by_sentences,
+    chunking_by_token_size,
+)
+from hyperrag.utils import count_tokens
+
+STRATEGIES = {
+    "token": chunking_by_token_size,
+    "sentence": chunking_by_sentences,
+    "paragraph": chunking_by_paragraphs,
+    "markdown": chunking_by_markdown_headings,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare chunk counts and extraction cost of the chunking strategies."
+    )
+    parser.add_argument(
+        "--input",
+        default=str(Path(__file__).resolve().parent.parent / "examples" / "mock_data.txt"),
+    )
+    parser.add_argument("--chunk-token-size", type=int, default=1200)
+    parser.add_argument("--overlap-token-size", type=int, default=100)
+    parser.add_argument("--max-gleaning", type=int, default=1)
+    args = parser.parse_args()
+
+    text = Path(args.input).read_text(encoding="utf-8")
+    print(
+        f"{args.input}: {count_tokens(text)} tokens, "
+        f"chunk_token_size={args.chunk_token_size}, overlap={args.overlap_token_size}"
+    )
+    print(
+        f"{'strategy':<10s} {'chunks':>7s} {'chunk tokens':>13s} {'prompt tokens':>14s} "
+        f"{'calls (max)':>12s} {'saved':>7s}"
+    )
+    baseline = None
+    for name, func in STRATEGIES.items():
+        chunks = chunk_document(
+            "doc", text, args.overlap_token_size, args.chunk_token_size, chunking_func=func
+        )
+        prompts = build_entity_extraction_prompts(chunks, {})
+        chunk_tokens = sum(count_tokens(c["content"]) for c in chunks.values())
+        prompt_tokens = sum(count_tokens(p["prompt"]) for p in prompts)
+        # one extraction call per chunk, plus a continue and an if-loop call per gleaning round
+        max_calls = len(chunks) * (1 + 2 * args.max_gleaning)
+        baseline = baseline or max_calls
+        print(
+            f"{name:<10s} {len(chunks):>7d} {chunk_tokens:>13d} {prompt_tokens:>14d} "
+            f"{max_calls:>12d} {1 - max_calls / baseline:>7.1%}"
+        )
+
+
+if __name__ == "__main__":
+    main()
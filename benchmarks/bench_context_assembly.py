@@ -0,0 +1,140 @@
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+import argparse
+import random
+import time
+
+from hyperrag.operate import _make_query_context, _render_query_context
+from hyperrag.utils import (
+    count_tokens,
+    encode_string_by_tiktoken,
+    truncate_list_by_token_size,
+)
+
+
+def truncate_by_encoding(list_data, key, max_token_size):
+    # The previous implementation: re-tokenize every item on every query.
+    if max_token_size <= 0:
+        return []
+    tokens = 0
+    for i, data in enumerate(list_data):
+        tokens += len(encode_string_by_tiktoken(key(data)))
+        if tokens > max_token_size:
+            return list_data[:i]
+    return list_data
+
+
+def make_records(num_entities, num_hyperedges, num_chunks, seed=0):
+    rng = random.Random(seed)
+    words = [f"word{i}" for i in range(5000)]
+
+    def text(n_words):
+        return " ".join(rng.choice(words) for _ in range(n_words))
+
+    entities = []
+    for i in range(num_entities):
+        description = text(rng.randint(20, 120))
+        entities.append(
+            {
+                "entity_name": f"ENTITY_{i}",
+                "entity_type": "CONCEPT",
+                "description": description,
+                "description_tokens": count_tokens(description),
+                "additional_properties": text(10),
+                "rank": rng.randint(1, 50),
+            }
+        )
+    hyperedges = []
+    for i in range(num_hyperedges):
+        description = text(rng.randint(30, 200))
+        hyperedges.append(
+            {
+                "id_set": tuple(f"ENTITY_{rng.randrange(num_entities)}" for _ in range(3)),
+                "description": description,
+                "description_tokens": count_tokens(description),
+                "keywords": text(5),
+                "weight": rng.random() * 10,
+                "rank": rng.randint(1, 50),
+            }
+        )
+    chunks = []
+    for i in range(num_chunks):
+        content = text(rng.randint(400, 700))
+        chunks.append({"content": content, "tokens": count_tokens(content)})
+    return entities, hyperedges, chunks
+
+
+def assemble(entities, hyperedges, chunks, budgets, truncate, use_counts, render=True):
+    def counts(field):
+        return {"count_key": (lambda x: x.get(field))} if use_counts else {}
+
+    entities = truncate(
+        entities, key=lambda x: x["description"], max_token_size=budgets[0],
+        **counts("description_tokens"),
+    )
+    hyperedges = truncate(
+        hyperedges, key=lambda x: x["description"], max_token_size=budgets[1],
+        **counts("description_tokens"),
+    )
+    chunks = truncate(
+        chunks, key=lambda x: x["content"], max_token_size=budgets[2],
+        **counts("tokens"),
+    )
+    if not render:
+        return entities, hyperedges, chunks
+    return _render_query_context(
+        _make_query_context(entities, hyperedges, chunks, "id_set")
+    )
+
+
+def run(label, fn, repeat):
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    elapsed = (time.perf_counter() - start) / repeat
+    print(f"{label:<40s} {elapsed * 1000:9.3f} ms / query")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark query context assembly (truncation + rendering)."
+    )
+    parser.add_argument("--entities", type=int, default=2000)
+    parser.add_argument("--hyperedges", type=int, default=2000)
+    parser.add_argument("--chunks", type=int, default=200)
+    parser.add_argument("--entity-budget", type=int, default=4000)
+    parser.add_argument("--relation-budget", type=int, default=16000)
+    parser.add_argument("--text-budget", type=int, default=16000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    entities, hyperedges, chunks = make_records(args.entities, args.hyperedges, args.chunks)
+    budgets = (args.entity_budget, args.relation_budget, args.text_budget)
+
+    variants = [
+        ("re-tokenize every item", truncate_by_encoding, False),
+        ("count_tokens (memoised)", truncate_list_by_token_size, False),
+        ("stored counts", truncate_list_by_token_size, True),
+    ]
+    for render in (False, True):
+        print("truncation + rendering" if render else "truncation only")
+        timings = [
+            run(
+                f"  {label}",
+                lambda: assemble(entities, hyperedges, chunks, budgets, truncate, use_counts, render),
+                args.repeat,
+            )
+            for label, truncate, use_counts in variants
+        ]
+        print(
+            "  speed-up vs re-tokenizing: "
+            + ", ".join(f"{timings[0] / t:.1f}x" for t in timings[1:])
+        )
+
+if __name__ == "__main__":
+    main()
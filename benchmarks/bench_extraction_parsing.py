@@ -0,0 +1,151 @@
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+import argparse
+import asyncio
+import random
+import re
+import time
+from collections import defaultdict
+
+from hyperrag.operate import (
+    _handle_single_entity_extraction,
+    _handle_single_relationship_extraction_high,
+    _handle_single_relationship_extraction_low,
+    _parse_extraction_result,
+    _prepare_entity_extraction_templates,
+)
+
+
+def legacy_split(content, markers):
+    # The previous split_string_by_multi_markers, joining the pattern per call.
+    results = re.split("|".join(re.escape(marker) for marker in markers), content)
+    return [r.strip() for r in results if r.strip()]
+
+
+async def legacy_parse(final_result, chunk_key, context_base):
+    # The previous per-record loop of _process_single_content, awaiting a
+    # coroutine for every handler.
+    async def entity(attributes, key):
+        return _handle_single_entity_extraction(attributes, key)
+
+    async def low(attributes, key):
+        return _handle_single_relationship_extraction_low(attributes, key)
+
+    async def high(attributes, key):
+        return _handle_single_relationship_extraction_high(attributes, key)
+
+    records = legacy_split(
+        final_result,
+        [context_base["record_delimiter"], context_base["completion_delimiter"]],
+    )
+    maybe_nodes = defaultdict(list)
+    maybe_edges = defaultdict(list)
+    maybe_edges_low = defaultdict(list)
+    maybe_edges_high = defaultdict(list)
+    for record in records:
+        record = re.search(r"\((.*)\)", record)
+        if record is None:
+            continue
+        record_attributes = legacy_split(record.group(1), [context_base["tuple_delimiter"]])
+        if_entities = await entity(record_attributes, chunk_key)
+        if if_entities is not None:
+            maybe_nodes[if_entities["entity_name"]].append(if_entities)
+            continue
+        if_relation = await low(record_attributes, chunk_key)
+        if if_relation is not None:
+            maybe_edges[tuple(if_relation["entityN"])].append(if_relation)
+            maybe_edges_low[tuple(if_relation["entityN"])].append(if_relation)
+        if_relation = await high(record_attributes, chunk_key)
+        if if_relation is not None:
+            maybe_edges[tuple(if_relation["entityN"])].append(if_relation)
+            maybe_edges_high[tuple(if_relation["entityN"])].append(if_relation)
+    return maybe_nodes, maybe_edges, maybe_edges_low, maybe_edges_high
+
+
+def synthetic_output(rng, records, context_base):
+    d = context_base["tuple_delimiter"]
+    names = [f"entity_{i}" for i in range(records)]
+    lines = []
+    for i in range(records):
+        kind = rng.random()
+        if kind < 0.5:
+            lines.append(
+                f'("Entity"{d}{names[i]}{d}esql_concept{d}Description of {names[i]} &amp; its use in '
+                f'ES|QL pipelines.{d}/docs/esql/{i}{d}syntax:FROM logs, version:8.{i % 16})'
+            )
+        elif kind < 0.8:
+            a, b = rng.sample(names, 2)
+            lines.append(
+                f'("Low-order Hyperedge"{d}{a}{d}{b}{d}{a} feeds {b} in a query.{d}'
+                f"pipeline,ordering{d}{rng.randint(1, 9)}{d}/docs/esql/{i})"
+            )
+        elif kind < 0.95:
+            members = rng.sample(names, 4)
+            lines.append(
+                f'("High-order Hyperedge"{d}{d.join(members)}{d}Members form a workflow.{d}'
+                f"workflow{d}setup,query,analysis{d}{rng.randint(1, 9)}{d}/docs/esql/{i})"
+            )
+        else:
+            lines.append(f"malformed line {i} without parentheses")
+    return context_base["record_delimiter"].join(lines) + context_base["completion_delimiter"]
+
+
+def measure(label, fn, total_records, total_bytes):
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    print(
+        f"{label:<26s} {elapsed:8.3f} s   {total_records / elapsed:12,.0f} records/s"
+        f"   {total_bytes / elapsed / 2**20:8.1f} MiB/s"
+    )
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark parsing of entity extraction output.")
+    parser.add_argument("--outputs", type=int, default=2000, help="number of LLM answers")
+    parser.add_argument("--records", type=int, default=60, help="records per answer")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    context_base = _prepare_entity_extraction_templates({})["context_base"]
+    rng = random.Random(args.seed)
+    outputs = [
+        (f"chunk-{i}", synthetic_output(rng, args.records, context_base))
+        for i in range(args.outputs)
+    ]
+    total_records = args.outputs * args.records
+    total_bytes = sum(len(o.encode("utf-8")) for _, o in outputs)
+    print(f"{args.outputs} answers, {total_records} records, {total_bytes / 2**20:.1f} MiB")
+
+    loop = asyncio.new_event_loop()
+    for key, output in outputs[:50]:
+        expected = loop.run_until_complete(legacy_parse(output, key, context_base))
+        assert [dict(r) for r in expected] == [
+            dict(r) for r in _parse_extraction_result(output, key, context_base)
+        ]
+
+    async def parse_all_legacy():
+        # one running loop for all answers, as inside extract_entities
+        for key, output in outputs:
+            await legacy_parse(output, key, context_base)
+
+    baseline = measure(
+        "per-record coroutines",
+        lambda: loop.run_until_complete(parse_all_legacy()),
+        total_records,
+        total_bytes,
+    )
+    def parse_all_compiled():
+        for key, output in outputs:
+            _parse_extraction_result(output, key, context_base)
+
+    compiled = measure("compiled single pass", parse_all_compiled, total_records, total_bytes)
+    print(f"speedup: {baseline / compiled:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
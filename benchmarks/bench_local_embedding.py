@@ -0,0 +1,150 @@
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+import argparse
+import asyncio
+import json
+import re
+import struct
+import tempfile
+import time
+
+import numpy as np
+
+from hyperrag.llm import LocalEmbeddingModel
+
+
+def write_random_model(model_dir: Path, text: str, seed: int):
+    # all-MiniLM-L6-v2 shapes with random weights: the cost of a forward pass
+    # only depends on the shapes, so no download is needed to measure it
+    rng = np.random.default_rng(seed)
+    hidden, layers, intermediate = 384, 6, 1536
+    words = sorted(set(re.findall(r"[a-z0-9]+", text.lower())))
+    vocab = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + words[:30000]
+    vocab += [f"##{c}" for c in "abcdefghijklmnopqrstuvwxyz0123456789"]
+    vocab += list("!\"#$%&'()*+,-./:;<=>?@[\\]^_`{|}~")
+    (model_dir / "vocab.txt").write_text("\n".join(vocab) + "\n", encoding="utf-8")
+    (model_dir / "config.json").write_text(
+        json.dumps(
+            {
+                "hidden_size": hidden,
+                "num_attention_heads": 12,
+                "num_hidden_layers": layers,
+                "intermediate_size": intermediate,
+                "layer_norm_eps": 1e-12,
+            }
+        )
+    )
+    shapes = {
+        "embeddings.word_embeddings.weight": (len(vocab), hidden),
+        "embeddings.position_embeddings.weight": (512, hidden),
+        "embeddings.token_type_embeddings.weight": (2, hidden),
+        "embeddings.LayerNorm.weight": (hidden,),
+        "embeddings.LayerNorm.bias": (hidden,),
+    }
+    for i in range(layers):
+        p = f"encoder.layer.{i}."
+        for name, (rows, cols) in {
+            "attention.self.query": (hidden, hidden),
+            "attention.self.key": (hidden, hidden),
+            "attention.self.value": (hidden, hidden),
+            "attention.output.dense": (hidden, hidden),
+            "intermediate.dense": (intermediate, hidden),
+            "output.dense": (hidden, intermediate),
+        }.items():
+            shapes[p + name + ".weight"] = (rows, cols)
+            shapes[p + name + ".bias"] = (rows,)
+        for name in ("attention.output.LayerNorm", "output.LayerNorm"):
+            shapes[p + name + ".weight"] = (hidden,)
+            shapes[p + name + ".bias"] = (hidden,)
+    header, blobs, offset = {}, [], 0
+    for name, shape in shapes.items():
+        blob = (rng.standard_normal(shape, dtype=np.float32) * 0.05).tobytes()
+        header[name] = {"dtype": "F32", "shape": list(shape), "data_offsets": [offset, offset + len(blob)]}
+        blobs.append(blob)
+        offset += len(blob)
+    header = json.dumps(header).encode()
+    with open(model_dir / "model.safetensors", "wb") as f:
+        f.write(struct.pack("<Q", len(header)))
+        f.write(header)
+        f.writelines(blobs)
+
+
+def sample_texts(text: str, count: int, words: int, seed: int) -> list[str]:
+    tokens = text.split()
+    rng = np.random.default_rng(seed)
+    starts = rng.integers(0, max(len(tokens) - words, 1), size=count)
+    return [" ".join(tokens[s : s + words]) for s in starts]
+
+
+async def concurrent_calls(model: LocalEmbeddingModel, texts: list[str], call_size: int) -> float:
+    func = model.embedding_func
+    start = time.perf_counter()
+    await asyncio.gather(
+        *[func(texts[i : i + call_size]) for i in range(0, len(texts), call_size)]
+    )
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure local CPU embedding throughput against the batch size."
+    )
+    parser.add_argument(
+        "--model",
+        default=None,
+        help="checkpoint directory; a random all-MiniLM-L6-v2 shaped model by default",
+    )
+    parser.add_argument("--backend", default="auto")
+    parser.add_argument(
+        "--input",
+        default=str(Path(__file__).resolve().parent.parent / "examples" / "mock_data.txt"),
+    )
+    parser.add_argument("--texts", type=int, default=128)
+    parser.add_argument("--words", type=int, default=48, help="words per text")
+    parser.add_argument("--batch-sizes", default="1,4,16,32,64,128")
+    parser.add_argument("--max-batch-tokens", type=int, default=1024)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    text = Path(args.input).read_text(encoding="utf-8")
+    texts = sample_texts(text, args.texts, args.words, args.seed)
+    batch_sizes = [int(b) for b in args.batch_sizes.split(",")]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        model_path = args.model
+        if model_path is None:
+            write_random_model(Path(tmp), text, args.seed)
+            model_path = tmp
+        model = LocalEmbeddingModel(
+            model_path, backend=args.backend, max_batch_tokens=args.max_batch_tokens
+        )
+        model.encode(texts[:2])  # load and warm up
+        print(f"{model_path}: {model.backend} backend, {args.texts} texts of {args.words} words")
+
+        print(f"\n{'batch size':>10s} {'texts/s':>10s}   (one encode() per batch)")
+        for batch_size in batch_sizes:
+            start = time.perf_counter()
+            for i in range(0, len(texts), batch_size):
+                model.encode(texts[i : i + batch_size])
+            elapsed = time.perf_counter() - start
+            print(f"{batch_size:>10d} {len(texts) / elapsed:>10.1f}")
+
+        # concurrent embedding_func calls as issued by queries (1 text per call)
+        # and by vector upserts (embedding_batch_num=32 texts per call)
+        print(f"\n{'call size':>10s} {'max batch':>10s} {'texts/s':>10s} {'batches':>8s}")
+        for call_size in (1, 32):
+            for max_batch_size in (1, 64):
+                model.max_batch_size = max_batch_size
+                model.stats.clear()
+                elapsed = asyncio.run(concurrent_calls(model, texts, call_size))
+                print(
+                    f"{call_size:>10d} {max_batch_size:>10d} "
+                    f"{len(texts) / elapsed:>10.1f} {model.stats['batches']:>8d}"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,20 @@
 from dataclasses import dataclass, field
 from typing import TypedDict, Union, Literal, Generic, TypeVar, Any, Tuple, List, Set, Optional, Dict
 
-from .utils import EmbeddingFunc
+from .utils import EmbeddingFunc, deduplicate_by_key
 
 TextChunkSchema = TypedDict(
     "TextChunkSchema",
-    {"tokens": int, "content": str, "full_doc_id": str, "chunk_order_index": int},
+    {
+        "tokens": int,
+        "content": str,
+        "full_doc_id": str,
+        "chunk_order_index": int,
+        # position of ``content`` in the full document
+        "char_start": int,
+        "char_end": int,
+    },
+    total=False,
 )
 
 T = TypeVar("T")
@@ -13,7 +22,7 @@ T = TypeVar("T")
 
 @dataclass
 class QueryParam:
-    mode: Literal["hyper", "hyper-lite", "graph", "naive", "llm"] = "hyper-query"
+    mode: Literal["hyper", "hyper-lite", "graph", "naive", "llm", "community"] = "hyper-query"
     only_need_context: bool = False
     response_type: str = "Multiple Paragraphs"
     # Number of top-k items to retrieve; corresponds to entities in "local" mode and relationships in "global" mode.
@@ -26,6 +35,59 @@ class QueryParam:
     max_token_for_relation_context: int = 1600
     # return type
     return_type: Literal["json", "text"] = "text"
+    # Maximum number of incident hyperedges expanded per vertex, 0 means no cap.
+    max_hyperedges_per_vertex: int = 64
+    # How incident hyperedges are picked when a vertex exceeds the cap.
+    hyperedge_sampling: Literal["top_weight", "weighted_reservoir", "degree_normalized"] = "top_weight"
+    # Number of hops expanded from the matched vertices, 1 keeps first-order neighbours only.
+    max_hops: int = 1
+    # Number of vertices kept in the frontier after each extra hop.
+    hop_budget: int = 20
+    # Score decay applied per extra hop.
+    hop_decay: float = 0.5
+    # How vertices and hyperedges are ranked: raw degree or personalised PageRank from the vector hits.
+    ranking: Literal["degree", "ppr"] = "degree"
+    # Restart probability of the personalised PageRank walk.
+    ppr_alpha: float = 0.15
+    # Maximum number of personalised PageRank iterations.
+    ppr_max_iter: int = 30
+    # How query keywords are obtained: an LLM call, a local lexical extractor, or
+    # retrieval on the lexical keywords while the LLM call is still in flight.
+    keyword_extractor: Literal["llm", "lexical", "speculative"] = "llm"
+    # Seconds the speculative mode waits for the LLM keywords once the lexical retrieval is ready, None waits indefinitely.
+    keyword_timeout: Optional[float] = 2.0
+
+
+@dataclass
+class QueryContext:
+    """Retrieved entities, hyperedges and text units of a query.
+
+    Items are keyed by ``entity_name``, the sorted ``entity_set`` and ``content``
+    respectively, so contexts from several retrieval stages can be merged once
+    and rendered to prompt text at the end.
+    """
+
+    entities: List[dict] = field(default_factory=list)
+    hyperedges: List[dict] = field(default_factory=list)
+    text_units: List[dict] = field(default_factory=list)
+
+    def merge(self, other: "QueryContext") -> "QueryContext":
+        """Return a new context with the items of ``other`` appended after ours."""
+        return QueryContext(
+            entities=deduplicate_by_key(self.entities + other.entities, "entity_name"),
+            hyperedges=deduplicate_by_key(self.hyperedges + other.hyperedges, "entity_set"),
+            text_units=deduplicate_by_key(self.text_units + other.text_units, "content"),
+        )
+
+    def is_empty(self) -> bool:
+        return not (self.entities or self.hyperedges or self.text_units)
+
+    def to_dict(self) -> dict:
+        return {
+            "entities": [{"id": i, **n} for i, n in enumerate(self.entities)],
+            "hyperedges": [{"id": i, **e} for i, e in enumerate(self.hyperedges)],
+            "text_units": [{"id": i, **t} for i, t in enumerate(self.text_units)],
+        }
 
 
 @dataclass
@@ -50,12 +112,18 @@ class BaseVectorStorage(StorageNameSpace):
     async def query(self, query: str, top_k: int) -> list[dict]:
         raise NotImplementedError
 
+    async def query_by_embedding(self, embedding, top_k: int) -> list[dict]:
+        raise NotImplementedError
+
     async def upsert(self, data: dict[str, dict]):
         """Use 'content' field from value for embedding, use key as id.
         If embedding_func is None, use 'embedding' field from value
         """
         raise NotImplementedError
 
+    async def delete(self, ids: list[str]):
+        raise NotImplementedError
+
 
 @dataclass
 class BaseKVStorage(Generic[T], StorageNameSpace):
@@ -130,6 +198,21 @@ class BaseHypergraphStorage(StorageNameSpace):
     async def get_nbr_e_of_vertex(self, e_tuple: Union[List, Set, Tuple]) -> list:
         raise NotImplementedError
 
+    async def get_nbr_e_of_vertex_sampled(
+        self, v_id: Any, max_num: int, strategy: str = "top_weight"
+    ) -> list:
+        raise NotImplementedError
+
+    async def get_incidence_index(self):
+        raise NotImplementedError
+
+    async def get_version(self) -> int:
+        """
+            Counter bumped on every vertex or hyperedge edit, used to invalidate
+            cached query results. Storages that do not track edits return 0.
+        """
+        return 0
+
     async def get_nbr_v_of_hyperedge(self, v_id: Any, exclude_self=True) -> list:
         raise NotImplementedError
 
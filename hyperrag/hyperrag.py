@@ -1,21 +1,34 @@
 import os
 import json
+import pickle
 import asyncio
+import weakref
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from copy import deepcopy
 from dataclasses import asdict, dataclass, field
 from datetime import datetime
 from functools import partial
-from typing import Mapping, Sequence, Type, cast
+from typing import Literal, Mapping, Optional, Sequence, Type, cast
 
 from .operate import (
+    chunk_document,
     chunking_by_token_size,
+    hash_documents,
     build_entity_extraction_prompts,
     extract_entities,
-    hyper_query_lite,
-    hyper_query,
-    naive_query,
-    graph_query,
-    llm_query,
+    build_communities,
+    community_retrieve,
+    hyper_lite_retrieve,
+    hyper_retrieve,
+    naive_retrieve,
+    graph_retrieve,
+    llm_retrieve,
+    summarize_pending_records,
+    generate_response,
+    generate_response_stream,
 )
+from .prompt import PROMPTS
 from .llm import (
     gpt_4o_mini_complete,
     openai_embedding,
@@ -30,10 +43,14 @@ from .storage import (
 
 from .utils import (
     EmbeddingFunc,
+    LRUCache,
+    MinHashLSH,
     RegexTokenizer,
+    SemanticCache,
     Tokenizer,
-    compute_mdhash_id,
+    compute_args_hash,
     limit_async_func_call,
+    normalize_query,
     convert_response_to_json,
     format_elasticsearch_document,
     logger,
@@ -76,13 +93,49 @@ class HyperRAG:
     chunk_overlap_token_size: int = 100
     tiktoken_model_name: str = "gpt-4o-mini"
     tokenizer: Tokenizer = field(default_factory=RegexTokenizer)
+    # chunking_by_token_size, chunking_by_sentences, chunking_by_paragraphs,
+    # chunking_by_markdown_headings or any function with the same signature
+    chunking_func: callable = chunking_by_token_size
+    # where document hashing and chunking run during insert: inline on the event
+    # loop, or per document in a thread or process pool; the process pool needs a
+    # picklable (module-level) chunking_func and tokenizer
+    chunking_executor: Literal["none", "thread", "process"] = "none"
+    chunking_max_workers: Optional[int] = None
 
     # entity extraction
     entity_extract_max_gleaning: int = 1
+    # pack consecutive small chunks into one extraction prompt, 0 disables
+    entity_extract_batch_token_size: int = 0
+    entity_extract_batch_max_chunks: int = 8
+    # "adaptive" skips gleaning rounds that are unlikely to find new entities
+    entity_extract_gleaning_policy: Literal["always", "adaptive"] = "always"
+    entity_extract_gleaning_min_tokens: int = 100
+    entity_extract_gleaning_min_yield: float = 0.5
+    # "json" asks for a JSON-schema answer (response_format) instead of delimited records
+    entity_extraction_format: Literal["delimited", "json"] = "delimited"
+    # stream extraction answers and merge their records while other chunks are extracted
+    entity_extract_streaming: bool = False
     entity_summary_to_max_tokens: int = 500
     entity_additional_properties_to_max_tokens: int = 250
     relation_summary_to_max_tokens: int = 750
     relation_keywords_to_max_tokens: int = 100
+    # "deferred" stores merged descriptions raw and summarizes them on first retrieval
+    summary_mode: Literal["eager", "deferred"] = "eager"
+    # summarize pending descriptions in the background after each insert
+    deferred_summary_worker: bool = False
+    deferred_summary_worker_batch: int = 16
+    # summaries per LLM call when merging descriptions, 1 disables batching
+    summary_batch_size: int = 1
+    summary_batch_max_tokens: int = 8000
+    # reuse extraction results for chunks that nearly duplicate an extracted one
+    enable_near_duplicate_detection: bool = False
+    near_duplicate_threshold: float = 0.9
+
+    # community summaries for global queries
+    enable_community_summary: bool = False
+    community_min_size: int = 3
+    community_max_iterations: int = 10
+    community_report_max_tokens: int = 500
 
     embedding_func: EmbeddingFunc = field(default_factory=lambda: openai_embedding)
     embedding_batch_num: int = 32
@@ -103,6 +156,14 @@ class HyperRAG:
     hypergraph_storage_cls: Type[BaseHypergraphStorage] = HypergraphStorage
     enable_llm_cache: bool = True
 
+    # query results, keyed by normalized query + QueryParam + index version
+    enable_query_cache: bool = True
+    query_cache_max_size: int = 128
+    # paraphrased questions, matched by embedding similarity
+    enable_semantic_query_cache: bool = False
+    semantic_query_cache_threshold: float = 0.95
+    semantic_query_cache_max_size: int = 256
+
     # extension
     addon_params: dict = field(default_factory=dict)
     convert_response_to_json_func: callable = convert_response_to_json
@@ -130,6 +191,16 @@ class HyperRAG:
             namespace="text_chunks", global_config=asdict(self)
         )
 
+        self.chunk_signatures = (
+            self.key_string_value_json_storage_cls(
+                namespace="chunk_signatures", global_config=asdict(self)
+            )
+            if self.enable_near_duplicate_detection
+            else None
+        )
+        self._near_duplicate_index = None
+        self._extraction_stats = Counter()
+
         self.llm_response_cache = (
             self.key_string_value_json_storage_cls(
                 namespace="llm_response_cache", global_config=asdict(self)
@@ -166,6 +237,24 @@ class HyperRAG:
             embedding_func=self.embedding_func,
         )
 
+        self.community_reports = (
+            self.key_string_value_json_storage_cls(
+                namespace="community_reports", global_config=asdict(self)
+            )
+            if self.enable_community_summary
+            else None
+        )
+        self.communities_vdb = (
+            self.vector_db_storage_cls(
+                namespace="communities",
+                global_config=asdict(self),
+                embedding_func=self.embedding_func,
+                meta_fields={"title"},
+            )
+            if self.enable_community_summary
+            else None
+        )
+
         self.llm_model_func = limit_async_func_call(self.llm_model_max_async)(
             partial(
                 self.llm_model_func,
@@ -174,6 +263,15 @@ class HyperRAG:
             )
         )
 
+        self._summary_worker = None
+        self._chunking_pool = None
+        self._index_version = 0
+        self._query_cache = LRUCache(max_size=self.query_cache_max_size)
+        self._semantic_query_cache = SemanticCache(
+            max_size=self.semantic_query_cache_max_size,
+            threshold=self.semantic_query_cache_threshold,
+        )
+
     def insert(self, string_or_strings, *, preview_only: bool = False):
         loop = always_get_an_event_loop()
         return loop.run_until_complete(
@@ -225,9 +323,17 @@ class HyperRAG:
             if isinstance(string_or_strings, str):
                 string_or_strings = [string_or_strings]
 
+            string_or_strings = list(string_or_strings)
+            doc_batches = [
+                string_or_strings[i : i + 64]
+                for i in range(0, len(string_or_strings), 64)
+            ]
             new_docs = {
-                compute_mdhash_id(c.strip(), prefix="doc-"): {"content": c.strip()}
-                for c in string_or_strings
+                doc_key: {"content": content}
+                for batch in await self._run_preprocessing(
+                    hash_documents, [(batch,) for batch in doc_batches]
+                )
+                for doc_key, content in batch
             }
             _add_doc_keys = await self.full_docs.filter_keys(list(new_docs.keys()))
             new_docs = {k: v for k, v in new_docs.items() if k in _add_doc_keys}
@@ -238,19 +344,20 @@ class HyperRAG:
             logger.info(f"[New Docs] inserting {len(new_docs)} docs")
 
             inserting_chunks = {}
-            for doc_key, doc in new_docs.items():
-                chunks = {
-                    compute_mdhash_id(dp["content"], prefix="chunk-"): {
-                        **dp,
-                        "full_doc_id": doc_key,
-                    }
-                    for dp in chunking_by_token_size(
+            for chunks in await self._run_preprocessing(
+                chunk_document,
+                [
+                    (
+                        doc_key,
                         doc["content"],
-                        overlap_token_size=self.chunk_overlap_token_size,
-                        max_token_size=self.chunk_token_size,
-                        tiktoken_model=self.tiktoken_model_name,
+                        self.chunk_overlap_token_size,
+                        self.chunk_token_size,
+                        self.tokenizer if self.chunking_executor == "process" else None,
+                        self.chunking_func,
                     )
-                }
+                    for doc_key, doc in new_docs.items()
+                ],
+            ):
                 inserting_chunks.update(chunks)
             _add_chunk_keys = await self.text_chunks.filter_keys(
                 list(inserting_chunks.keys())
@@ -291,6 +398,9 @@ class HyperRAG:
                 entity_vdb=self.entities_vdb,
                 relationships_vdb=self.relationships_vdb,
                 global_config=asdict(self),
+                chunk_signatures=self.chunk_signatures,
+                near_duplicate_index=await self._get_near_duplicate_index(),
+                stats=self._extraction_stats,
             )
             if maybe_new_kg is None:
                 logger.warning("No new entities and relationships found")
@@ -299,18 +409,167 @@ class HyperRAG:
             self.chunk_entity_relation_hypergraph = maybe_new_kg
             await self.full_docs.upsert(new_docs)
             await self.text_chunks.upsert(inserting_chunks)
+            # ----------------------------------------------------------------------------
+            if self.enable_community_summary:
+                logger.info("[Community Summary]...")
+                await build_communities(
+                    self.chunk_entity_relation_hypergraph,
+                    self.community_reports,
+                    self.communities_vdb,
+                    asdict(self),
+                )
         finally:
             await self._insert_done()
+            if self.summary_mode == "deferred" and self.deferred_summary_worker:
+                self._start_summary_worker()
+
+    def summarize_pending(self) -> int:
+        loop = always_get_an_event_loop()
+        return loop.run_until_complete(self.asummarize_pending())
+
+    async def asummarize_pending(self) -> int:
+        """Summarize every description left raw by ``summary_mode="deferred"``."""
+        count = await summarize_pending_records(
+            self.chunk_entity_relation_hypergraph, asdict(self)
+        )
+        logger.info(f"[Deferred Summary] summarized {count} records")
+        await self._summary_done()
+        return count
+
+    def _start_summary_worker(self):
+        if self._summary_worker is None or self._summary_worker.done():
+            self._summary_worker = asyncio.ensure_future(self._run_summary_worker())
+
+    async def _run_summary_worker(self):
+        # small slices with a pause in between keep the LLM slots free for queries
+        hypergraph = self.chunk_entity_relation_hypergraph
+        global_config = asdict(self)
+        vertex_ids = list(await hypergraph.get_all_vertices())
+        hyperedge_ids = list(await hypergraph.get_all_hyperedges())
+        size = self.deferred_summary_worker_batch
+        count = 0
+        try:
+            for i in range(0, len(vertex_ids), size):
+                count += await summarize_pending_records(
+                    hypergraph, global_config, vertex_ids[i : i + size], []
+                )
+                await asyncio.sleep(0.1)
+            for i in range(0, len(hyperedge_ids), size):
+                count += await summarize_pending_records(
+                    hypergraph, global_config, [], hyperedge_ids[i : i + size]
+                )
+                await asyncio.sleep(0.1)
+        except Exception as e:
+            logger.warning(f"[Deferred Summary] worker stopped: {e}")
+        logger.info(f"[Deferred Summary] worker summarized {count} records")
+        await self._summary_done()
+
+    async def _summary_done(self):
+        await asyncio.gather(
+            *[
+                cast(StorageNameSpace, storage_inst).index_done_callback()
+                for storage_inst in [
+                    self.chunk_entity_relation_hypergraph,
+                    self.llm_response_cache,
+                ]
+                if storage_inst is not None
+            ]
+        )
+
+    async def _get_near_duplicate_index(self) -> Optional[MinHashLSH]:
+        """Build the LSH index from the persisted chunk signatures on first use."""
+        if self.chunk_signatures is None:
+            return None
+        if self._near_duplicate_index is None:
+            index = MinHashLSH(threshold=self.near_duplicate_threshold)
+            keys = await self.chunk_signatures.all_keys()
+            records = await self.chunk_signatures.get_by_ids(keys, fields={"signature"})
+            for key, record in zip(keys, records):
+                if record is not None:
+                    index.insert(key, record["signature"])
+            self._near_duplicate_index = index
+        return self._near_duplicate_index
+
+    def near_duplicate_stats(self) -> dict:
+        return {
+            "chunks": self._extraction_stats["chunks"],
+            "near_duplicate_chunks": self._extraction_stats["near_duplicate_chunks"],
+            "llm_calls_saved": self._extraction_stats["llm_calls_saved"],
+            "indexed_chunks": len(self._near_duplicate_index or ()),
+        }
+
+    def summary_stats(self) -> dict:
+        items = self._extraction_stats["summary_items"]
+        calls = self._extraction_stats["summary_llm_calls"]
+        return {
+            "summary_items": items,
+            "summary_llm_calls": calls,
+            "summary_llm_calls_saved": items - calls,
+        }
+
+    def gleaning_stats(self) -> dict:
+        rounds = self._extraction_stats["gleaning_rounds"]
+        return {
+            "gleaning_rounds": rounds,
+            "gleaning_calls_saved": self._extraction_stats["gleaning_calls_saved"],
+            "gleaned_entities": self._extraction_stats["gleaned_entities"],
+            "entities_per_glean": round(
+                self._extraction_stats["gleaned_entities"] / max(rounds, 1), 4
+            ),
+        }
+
+    async def _run_preprocessing(self, func, args_list: list[tuple]) -> list:
+        """Run ``func(*args)`` for each argument tuple on the configured executor."""
+        if self.chunking_executor == "none":
+            return [func(*args) for args in args_list]
+        executor = self._preprocessing_executor()
+        loop = asyncio.get_running_loop()
+        return await asyncio.gather(
+            *[loop.run_in_executor(executor, func, *args) for args in args_list]
+        )
+
+    def _preprocessing_executor(self):
+        # one pool per instance, so process workers are spawned once, not per insert
+        if self._chunking_pool is not None:
+            return self._chunking_pool
+        if self.chunking_executor == "thread":
+            executor_cls = ThreadPoolExecutor
+        elif self.chunking_executor == "process":
+            executor_cls = ProcessPoolExecutor
+            for name in ("chunking_func", "tokenizer"):
+                try:
+                    pickle.dumps(getattr(self, name))
+                except Exception as e:
+                    raise ValueError(
+                        f'chunking_executor="process" needs a picklable {name}: {e}'
+                    ) from e
+        else:
+            raise ValueError(f"Unknown chunking executor {self.chunking_executor}")
+        self._chunking_pool = executor_cls(max_workers=self.chunking_max_workers)
+        weakref.finalize(self, self._chunking_pool.shutdown, wait=False)
+        return self._chunking_pool
+
+    def close(self):
+        """Release the chunking worker pool; the next insert starts a new one."""
+        if self._chunking_pool is not None:
+            self._chunking_pool.shutdown(wait=False)
+            self._chunking_pool = None
 
     async def _insert_done(self):
+        self._index_version += 1
+        self._query_cache.clear()
+        self._semantic_query_cache.clear()
         tasks = []
         for storage_inst in [
             self.full_docs,
             self.text_chunks,
+            self.chunk_signatures,
             self.llm_response_cache,
             self.entities_vdb,
             self.relationships_vdb,
             self.chunks_vdb,
+            self.community_reports,
+            self.communities_vdb,
             self.chunk_entity_relation_hypergraph,
         ]:
             if storage_inst is None:
@@ -323,9 +582,129 @@ class HyperRAG:
         return loop.run_until_complete(self.aquery(query, param))
 
     async def aquery(self, query: str, param: QueryParam = QueryParam()):
-        
+        """
+        Retrieval contexts are cached per normalized query, parameters and index
+        version, and with ``enable_semantic_query_cache`` also matched against
+        paraphrases of past questions. With ``enable_llm_cache`` the generated
+        answer is cached too, otherwise a hit skips straight to generation.
+        """
+        entry, cached = await self._lookup_retrieval(query, param)
+        retrieval = entry["retrieval"]
+        if retrieval is None:
+            response = PROMPTS["fail_response"]
+        elif param.only_need_context:
+            response = retrieval["context"]
+        elif "response" in entry:
+            response = deepcopy(entry["response"])
+        else:
+            response = await generate_response(
+                query, retrieval, param, asdict(self)
+            )
+            if cached and self.enable_llm_cache:
+                entry["response"] = deepcopy(response)
+        await self._query_done()
+        return response
+
+    async def aquery_stream(self, query: str, param: QueryParam = QueryParam()):
+        """
+        Async generator version of ``aquery``. The first item is a dict with the
+        retrieval metadata (the structured context that ``return_type="json"``
+        would return, without the response); every following item is a chunk
+        of the answer text.
+        """
+        entry, cached = await self._lookup_retrieval(query, param)
+        retrieval = entry["retrieval"]
+        # a client that stops reading early closes the generator: still run the done hooks
+        try:
+            if retrieval is None:
+                yield {}
+                yield PROMPTS["fail_response"]
+            elif param.only_need_context:
+                yield dict(retrieval["context_json"])
+                yield retrieval["context"]
+            elif "response" in entry:
+                yield dict(retrieval["context_json"])
+                response = entry["response"]
+                yield response["response"] if isinstance(response, dict) else response
+            else:
+                yield dict(retrieval["context_json"])
+                contents = []
+                async for delta in generate_response_stream(
+                    query, retrieval, param, asdict(self)
+                ):
+                    contents.append(delta)
+                    yield delta
+                if cached and self.enable_llm_cache:
+                    response = "".join(contents)
+                    if param.return_type == "json":
+                        response = {**retrieval["context_json"], "response": response}
+                    entry["response"] = response
+        finally:
+            await self._query_done()
+
+    async def _lookup_retrieval(self, query: str, param: QueryParam):
+        """
+        Return the cache entry holding the retrieval for this query, running
+        the retrieval on a miss, and whether the entry lives in a query cache.
+        """
+        cache_key = None
+        entry = None
+        index_version = (
+            self._index_version,
+            await self.chunk_entity_relation_hypergraph.get_version(),
+        )
+        if self.enable_query_cache:
+            cache_key = compute_args_hash(
+                normalize_query(query), asdict(param), index_version
+            )
+            entry = self._query_cache.get(cache_key)
+            if entry is not None:
+                logger.info(f"Query cache hit for mode {param.mode}")
+
+        semantic_scope = None
+        query_embedding = None
+        if entry is None and self.enable_semantic_query_cache:
+            semantic_scope = compute_args_hash(asdict(param), index_version)
+            query_embedding = (await self.embedding_func([query]))[0]
+            entry = self._semantic_query_cache.get(
+                semantic_scope, query_embedding, label=param.mode
+            )
+            if entry is not None:
+                logger.info(f"Semantic query cache hit for mode {param.mode}")
+                if cache_key is not None:
+                    self._query_cache.put(cache_key, entry)
+
+        if entry is None:
+            entry = {"retrieval": await self._retrieve(query, param)}
+            # deferred summaries written back during the retrieval bump the
+            # hypergraph version; key the entry by the version that includes them
+            index_version = (
+                self._index_version,
+                await self.chunk_entity_relation_hypergraph.get_version(),
+            )
+            if cache_key is not None:
+                cache_key = compute_args_hash(
+                    normalize_query(query), asdict(param), index_version
+                )
+                self._query_cache.put(cache_key, entry)
+            if semantic_scope is not None:
+                semantic_scope = compute_args_hash(asdict(param), index_version)
+                self._semantic_query_cache.put(semantic_scope, query_embedding, entry)
+        return entry, cache_key is not None or semantic_scope is not None
+
+    def query_cache_stats(self) -> dict:
+        return {
+            "exact": {
+                "hits": self._query_cache.hits,
+                "misses": self._query_cache.misses,
+                "size": len(self._query_cache),
+            },
+            "semantic": self._semantic_query_cache.stats(),
+        }
+
+    async def _retrieve(self, query: str, param: QueryParam):
         if param.mode == "hyper":
-            response = await hyper_query(
+            return await hyper_retrieve(
                 query,
                 self.chunk_entity_relation_hypergraph,
                 self.entities_vdb,
@@ -335,7 +714,7 @@ class HyperRAG:
                 asdict(self),
             )
         elif param.mode == "hyper-lite":
-            response = await hyper_query_lite(
+            return await hyper_lite_retrieve(
                 query,
                 self.chunk_entity_relation_hypergraph,
                 self.entities_vdb,
@@ -344,7 +723,7 @@ class HyperRAG:
                 asdict(self),
             )
         elif param.mode == "graph":
-            response = await graph_query(
+            return await graph_retrieve(
                 query,
                 self.chunk_entity_relation_hypergraph,
                 self.entities_vdb,
@@ -354,7 +733,7 @@ class HyperRAG:
                 asdict(self),
             )
         elif param.mode == "naive":
-            response = await naive_query(
+            return await naive_retrieve(
                 query,
                 self.chunks_vdb,
                 self.text_chunks,
@@ -362,15 +741,33 @@ class HyperRAG:
                 asdict(self),
             )
         elif param.mode == "llm":
-            response = await llm_query(
+            return await llm_retrieve(
                 query,
                 param,
                 asdict(self),
             )
+        elif param.mode == "community":
+            retrieval = await community_retrieve(
+                query,
+                self.communities_vdb,
+                self.community_reports,
+                param,
+                asdict(self),
+            )
+            if retrieval is None:
+                logger.info("No community report matched, falling back to hyper mode")
+                retrieval = await hyper_retrieve(
+                    query,
+                    self.chunk_entity_relation_hypergraph,
+                    self.entities_vdb,
+                    self.relationships_vdb,
+                    self.text_chunks,
+                    param,
+                    asdict(self),
+                )
+            return retrieval
         else:
             raise ValueError(f"Unknown mode {param.mode}")
-        await self._query_done()
-        return response
 
     async def _query_done(self):
         tasks = []
@@ -1,5 +1,14 @@
 import os
 import copy
+import asyncio
+import importlib.util
+import re
+import threading
+import time
+import unicodedata
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from functools import lru_cache
 import json
 import aioboto3
@@ -18,15 +27,16 @@ import base64
 import struct
 
 from tenacity import (
+    RetryError,
     retry,
     stop_after_attempt,
     wait_exponential,
     retry_if_exception_type,
 )
 from pydantic import BaseModel, Field
-from typing import List, Dict, Callable, Any
+from typing import List, Dict, Callable, Any, Optional
 from .base import BaseKVStorage
-from .utils import compute_args_hash, wrap_embedding_func_with_attrs
+from .utils import EmbeddingFunc, compute_args_hash, wrap_embedding_func_with_attrs
 
 os.environ["TOKENIZERS_PARALLELISM"] = "false"
 
@@ -57,16 +67,31 @@ async def openai_complete_if_cache(
         messages.append({"role": "system", "content": system_prompt})
     messages.extend(history_messages)
     messages.append({"role": "user", "content": prompt})
+    stream = kwargs.get("stream", False)
     if hashing_kv is not None:
         args_hash = compute_args_hash(model, messages)
         if_cache_return = await hashing_kv.get_by_id(args_hash)
         if if_cache_return is not None:
+            if stream:
+                return _iterate_cached(if_cache_return["return"])
             return if_cache_return["return"]
 
     response = await openai_async_client.chat.completions.create(
         model=model, messages=messages, **kwargs
     )
 
+    if stream:
+        return _iterate_stream(
+            response,
+            on_complete=(
+                (lambda content: hashing_kv.upsert(
+                    {args_hash: {"return": content, "model": model}}
+                ))
+                if hashing_kv is not None
+                else None
+            ),
+        )
+
     if hashing_kv is not None:
         await hashing_kv.upsert(
             {args_hash: {"return": response.choices[0].message.content, "model": model}}
@@ -74,6 +99,30 @@ async def openai_complete_if_cache(
     return response.choices[0].message.content
 
 
+async def _iterate_cached(content: str):
+    yield content
+
+
+async def _iterate_stream(response, on_complete: Callable = None):
+    """Yield the text deltas of a streamed chat completion, then cache the full text."""
+    contents = []
+    try:
+        async for chunk in response:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                contents.append(delta)
+                yield delta
+    finally:
+        # closing the response stops the generation of a stream left early
+        close = getattr(response, "close", None)
+        if close is not None:
+            await close()
+    if on_complete is not None:
+        await on_complete("".join(contents))
+
+
 @retry(
     stop=stop_after_attempt(3),
     wait=wait_exponential(multiplier=1, min=4, max=10),
@@ -106,16 +155,31 @@ async def azure_openai_complete_if_cache(
     messages.extend(history_messages)
     if prompt is not None:
         messages.append({"role": "user", "content": prompt})
+    stream = kwargs.get("stream", False)
     if hashing_kv is not None:
         args_hash = compute_args_hash(model, messages)
         if_cache_return = await hashing_kv.get_by_id(args_hash)
         if if_cache_return is not None:
+            if stream:
+                return _iterate_cached(if_cache_return["return"])
             return if_cache_return["return"]
 
     response = await openai_async_client.chat.completions.create(
         model=model, messages=messages, **kwargs
     )
 
+    if stream:
+        return _iterate_stream(
+            response,
+            on_complete=(
+                (lambda content: hashing_kv.upsert(
+                    {args_hash: {"return": content, "model": model}}
+                ))
+                if hashing_kv is not None
+                else None
+            ),
+        )
+
     if hashing_kv is not None:
         await hashing_kv.upsert(
             {args_hash: {"return": response.choices[0].message.content, "model": model}}
@@ -184,13 +248,48 @@ async def bedrock_complete_if_cache(
                 kwargs.pop(param)
             )
 
+    # Converse has no JSON mode, force a tool call whose input follows the schema
+    response_format = kwargs.pop("response_format", None)
+    if response_format is not None and response_format.get("type") == "json_schema":
+        tool = response_format["json_schema"]
+        args["toolConfig"] = {
+            "tools": [
+                {"toolSpec": {"name": tool["name"], "inputSchema": {"json": tool["schema"]}}}
+            ],
+            "toolChoice": {"tool": {"name": tool["name"]}},
+        }
+
     hashing_kv: BaseKVStorage = kwargs.pop("hashing_kv", None)
+    stream = kwargs.pop("stream", False)
     if hashing_kv is not None:
         args_hash = compute_args_hash(model, messages)
         if_cache_return = await hashing_kv.get_by_id(args_hash)
         if if_cache_return is not None:
+            if stream:
+                return _iterate_cached(if_cache_return["return"])
             return if_cache_return["return"]
 
+    if stream:
+        # the client stays open until the stream is read or closed
+        client = aioboto3.Session().client("bedrock-runtime")
+        bedrock_async_client = await client.__aenter__()
+        try:
+            response = await bedrock_async_client.converse_stream(**args, **kwargs)
+        except Exception as e:
+            await client.__aexit__(None, None, None)
+            raise BedrockError(e)
+        return _iterate_bedrock_stream(
+            response,
+            client,
+            on_complete=(
+                (lambda content: hashing_kv.upsert(
+                    {args_hash: {"return": content, "model": model}}
+                ))
+                if hashing_kv is not None
+                else None
+            ),
+        )
+
     # Call model via Converse API
     session = aioboto3.Session()
     async with session.client("bedrock-runtime") as bedrock_async_client:
@@ -199,17 +298,34 @@ async def bedrock_complete_if_cache(
         except Exception as e:
             raise BedrockError(e)
 
+        content = _bedrock_output_text(response)
         if hashing_kv is not None:
-            await hashing_kv.upsert(
-                {
-                    args_hash: {
-                        "return": response["output"]["message"]["content"][0]["text"],
-                        "model": model,
-                    }
-                }
-            )
+            await hashing_kv.upsert({args_hash: {"return": content, "model": model}})
+
+        return content
+
+
+def _bedrock_output_text(response) -> str:
+    for block in response["output"]["message"]["content"]:
+        if "toolUse" in block:
+            return json.dumps(block["toolUse"]["input"], ensure_ascii=False)
+    return response["output"]["message"]["content"][0]["text"]
 
-        return response["output"]["message"]["content"][0]["text"]
+
+async def _iterate_bedrock_stream(response, client, on_complete: Callable = None):
+    """Yield the text (or forced tool input) deltas of a ConverseStream answer, then cache the full text."""
+    contents = []
+    try:
+        async for event in response["stream"]:
+            delta = event.get("contentBlockDelta", {}).get("delta", {})
+            text = delta.get("text") or delta.get("toolUse", {}).get("input")
+            if text:
+                contents.append(text)
+                yield text
+    finally:
+        await client.__aexit__(None, None, None)
+    if on_complete is not None:
+        await on_complete("".join(contents))
 
 
 async def gpt_4o_complete(
@@ -434,6 +550,7 @@ class Model(BaseModel):
             The function should take any argument and return a string.
         kwargs (Dict[str, Any]): A dictionary that contains the arguments to pass to the callable function.
             This could include parameters such as the model name, API key, etc.
+        max_concurrency (Optional[int]): The maximum number of calls in flight on this model. None means unlimited.
 
     Example usage:
         Model(gen_func=openai_complete_if_cache, kwargs={"model": "gpt-4", "api_key": os.environ["OPENAI_API_KEY_1"]})
@@ -450,18 +567,99 @@ class Model(BaseModel):
         ...,
         description="The arguments to pass to the callable function. Eg. the api key, model name, etc",
     )
+    max_concurrency: Optional[int] = Field(
+        None,
+        description="The maximum number of calls in flight on this model, eg. the concurrency limit of its api key",
+    )
 
     class Config:
         arbitrary_types_allowed = True
 
 
+@dataclass
+class _ModelHealth:
+    in_flight: int = 0
+    latency: Optional[float] = None  # EWMA of successful call latency, in seconds
+    error_rate: float = 0.0  # EWMA of failed calls (429, 5xx, connection errors)
+    consecutive_failures: int = 0
+    ejected_until: float = 0.0
+    calls: int = 0
+    failures: int = 0
+
+
+def _status_code(error: Exception) -> Optional[int]:
+    status = getattr(error, "status_code", None) or getattr(error, "status", None)
+    if status is None:
+        response = getattr(error, "response", None)
+        status = getattr(response, "status_code", None) or getattr(response, "status", None)
+    return status if isinstance(status, int) else None
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def _is_model_failure(error: Exception) -> bool:
+    """Whether the error is specific to the model (and another one may succeed)."""
+    status = _status_code(error)
+    if status is None:
+        return isinstance(
+            error,
+            (
+                APIConnectionError,
+                Timeout,
+                BedrockError,
+                asyncio.TimeoutError,
+                aiohttp.ClientError,
+                ConnectionError,
+                TimeoutError,
+            ),
+        )
+    return status >= 500 or status in (401, 403, 404, 408, 409, 429)
+
+
+def _unwrap_retry_error(error: Exception) -> Exception:
+    # the gen_funcs retry transient errors with tenacity; classify the last one
+    if isinstance(error, RetryError) and error.last_attempt.failed:
+        return error.last_attempt.exception()
+    return error
+
+
+def _single_attempt(gen_func: Callable) -> Callable:
+    # let MultiModel own the retries (on another model) of tenacity-wrapped gen_funcs
+    retry_with = getattr(gen_func, "retry_with", None)
+    if retry_with is None:
+        return gen_func
+    return retry_with(stop=stop_after_attempt(1), reraise=True)
+
+
 class MultiModel:
     """
     Distributes the load across multiple language models. Useful for circumventing low rate limits with certain api providers especially if you are on the free tier.
     Could also be used for spliting across diffrent models or providers.
 
+    Each call goes to the available model with the lowest expected wait: its calls in
+    flight times its EWMA latency, inflated by its recent rate of 429/5xx/connection
+    errors. Models at their ``max_concurrency`` are skipped (the call waits when all of
+    them are full). A model that fails ``failure_threshold`` times in a row, or answers
+    429 with a Retry-After header, is ejected for ``cooldown`` seconds (or the
+    Retry-After delay); then a single probe call decides whether it comes back. A call
+    that fails on one model is retried on another, up to ``max_attempts`` times; once
+    every model failed, the next pass starts after a backoff. Tenacity-wrapped gen_funcs
+    such as ``openai_complete_if_cache`` are called for a single attempt, so that the
+    router, not the inner backoff, decides where a failed call goes next.
+
     Attributes:
         models (List[Model]): A list of language models to be used.
+        latency_decay (float): The weight of the newest call in the latency and error EWMAs.
+        failure_threshold (int): Consecutive failures after which a model is ejected.
+        cooldown (float): Seconds for which a failing model is ejected.
+        max_attempts (Optional[int]): Attempts per call, each on a model not yet tried in the current
+            pass over the models. All models, and at least 3 attempts, by default.
 
     Usage example:
         ```python
@@ -469,8 +667,8 @@ class MultiModel:
             Model(gen_func=openai_complete_if_cache, kwargs={"model": "gpt-4", "api_key": os.environ["OPENAI_API_KEY_1"]}),
             Model(gen_func=openai_complete_if_cache, kwargs={"model": "gpt-4", "api_key": os.environ["OPENAI_API_KEY_2"]}),
             Model(gen_func=openai_complete_if_cache, kwargs={"model": "gpt-4", "api_key": os.environ["OPENAI_API_KEY_3"]}),
-            Model(gen_func=openai_complete_if_cache, kwargs={"model": "gpt-4", "api_key": os.environ["OPENAI_API_KEY_4"]}),
-            Model(gen_func=openai_complete_if_cache, kwargs={"model": "gpt-4", "api_key": os.environ["OPENAI_API_KEY_5"]}),
+            Model(gen_func=openai_complete_if_cache, kwargs={"model": "gpt-4", "api_key": os.environ["OPENAI_API_KEY_4"]}, max_concurrency=4),
+            Model(gen_func=openai_complete_if_cache, kwargs={"model": "gpt-4", "api_key": os.environ["OPENAI_API_KEY_5"]}, max_concurrency=4),
         ]
         multi_model = MultiModel(models)
         rag = LightRAG(
@@ -480,28 +678,754 @@ class MultiModel:
         ```
     """
 
-    def __init__(self, models: List[Model]):
+    def __init__(
+        self,
+        models: List[Model],
+        latency_decay: float = 0.2,
+        failure_threshold: int = 3,
+        cooldown: float = 30.0,
+        max_attempts: Optional[int] = None,
+        waiting_time: float = 0.005,
+    ):
         self._models = models
+        self._gen_funcs = [_single_attempt(model.gen_func) for model in models]
         self._current_model = 0
-
-    def _next_model(self):
-        self._current_model = (self._current_model + 1) % len(self._models)
-        return self._models[self._current_model]
+        self._health = [_ModelHealth() for _ in models]
+        self.latency_decay = latency_decay
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.max_attempts = max_attempts or max(len(models), 3)
+        self.waiting_time = waiting_time
+
+    def _expected_wait(self, index: int, default_latency: float) -> float:
+        health = self._health[index]
+        latency = default_latency if health.latency is None else health.latency
+        return (health.in_flight + 1) * latency / max(1.0 - health.error_rate, 0.05)
+
+    def _next_model(self, exclude=()) -> Optional[int]:
+        """Index of the model to call next, or None while all candidates are busy."""
+        now = time.monotonic()
+        candidates = []
+        for offset in range(len(self._models)):
+            # start after the last pick so ties rotate as in plain round robin
+            index = (self._current_model + 1 + offset) % len(self._models)
+            health = self._health[index]
+            limit = self._models[index].max_concurrency
+            if index in exclude or health.ejected_until > now:
+                continue
+            if health.ejected_until and health.in_flight:
+                continue  # ejection expired: one probe call at a time
+            if limit is not None and health.in_flight >= limit:
+                continue
+            candidates.append(index)
+        if not candidates:
+            return None
+        known = [h.latency for h in self._health if h.latency is not None]
+        default_latency = min(known) if known else 1.0  # optimistic for untried models
+        index = min(candidates, key=lambda i: self._expected_wait(i, default_latency))
+        self._current_model = index
+        return index
+
+    async def _acquire(self, exclude) -> int:
+        while True:
+            index = self._next_model(exclude)
+            if index is not None:
+                self._health[index].in_flight += 1
+                self._health[index].calls += 1
+                return index
+            now = time.monotonic()
+            remaining = [i for i in range(len(self._models)) if i not in exclude]
+            if all(self._health[i].ejected_until > now for i in remaining):
+                # every model is ejected: probe the one that comes back first
+                index = min(remaining, key=lambda i: self._health[i].ejected_until)
+                self._health[index].ejected_until = now
+                continue
+            await asyncio.sleep(self.waiting_time)
+
+    def _record_success(self, index: int, latency: float):
+        health = self._health[index]
+        decay = self.latency_decay
+        health.latency = latency if health.latency is None else (1 - decay) * health.latency + decay * latency
+        health.error_rate *= 1 - decay
+        health.consecutive_failures = 0
+        health.ejected_until = 0.0
+
+    def _record_failure(self, index: int, error: Exception):
+        health = self._health[index]
+        health.error_rate = (1 - self.latency_decay) * health.error_rate + self.latency_decay
+        health.consecutive_failures += 1
+        health.failures += 1
+        retry_after = _retry_after(error) if _status_code(error) == 429 else None
+        if retry_after is not None:
+            health.ejected_until = time.monotonic() + retry_after
+        elif health.consecutive_failures >= self.failure_threshold or health.ejected_until:
+            # a failed probe ejects the model again right away
+            health.ejected_until = time.monotonic() + self.cooldown
+
+    async def _hold_while_streaming(self, index: int, stream, start: float):
+        # a streamed answer occupies its model until it is read or closed
+        try:
+            async for item in stream:
+                yield item
+        except Exception as e:
+            error = _unwrap_retry_error(e)
+            if _is_model_failure(error):
+                self._record_failure(index, error)
+            raise
+        else:
+            self._record_success(index, time.monotonic() - start)
+        finally:
+            self._health[index].in_flight -= 1
+            await stream.aclose()
+
+    def stats(self) -> List[Dict[str, Any]]:
+        """The live routing signals of each model, in the order of ``models``."""
+        now = time.monotonic()
+        return [
+            dict(
+                in_flight=h.in_flight,
+                latency=h.latency,
+                error_rate=h.error_rate,
+                ejected=h.ejected_until > now,
+                calls=h.calls,
+                failures=h.failures,
+            )
+            for h in self._health
+        ]
 
     async def llm_model_func(
         self, prompt, system_prompt=None, history_messages=[], **kwargs
     ) -> str:
         kwargs.pop("model", None)  # stop from overwriting the custom model name
-        next_model = self._next_model()
-        args = dict(
-            prompt=prompt,
-            system_prompt=system_prompt,
-            history_messages=history_messages,
-            **kwargs,
-            **next_model.kwargs,
+        tried = set()
+        attempts = 0
+        while True:
+            if len(tried) == len(self._models):
+                # every model failed once: back off, then start another pass
+                await asyncio.sleep(min(4 * 2 ** (attempts // len(self._models) - 1), 10))
+                tried.clear()
+            index = await self._acquire(tried)
+            tried.add(index)
+            attempts += 1
+            next_model = self._models[index]
+            args = dict(
+                prompt=prompt,
+                system_prompt=system_prompt,
+                history_messages=history_messages,
+                **kwargs,
+                **next_model.kwargs,
+            )
+            start = time.monotonic()
+            try:
+                result = await self._gen_funcs[index](**args)
+            except Exception as e:
+                self._health[index].in_flight -= 1
+                error = _unwrap_retry_error(e)
+                if not _is_model_failure(error):
+                    raise
+                self._record_failure(index, error)
+                if attempts >= self.max_attempts:
+                    raise
+                continue
+            if hasattr(result, "aclose"):
+                return self._hold_while_streaming(index, result, start)
+            self._health[index].in_flight -= 1
+            self._record_success(index, time.monotonic() - start)
+            return result
+
+
+@lru_cache(maxsize=1)
+def initialize_hf_model(model_name):
+    # transformers (and torch) are only needed for local models
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+
+    hf_tokenizer = AutoTokenizer.from_pretrained(model_name, trust_remote_code=True)
+    hf_model = AutoModelForCausalLM.from_pretrained(
+        model_name, device_map="auto", trust_remote_code=True
+    )
+    if hf_tokenizer.pad_token is None:
+        hf_tokenizer.pad_token = hf_tokenizer.eos_token
+    # generated tokens follow the prompts directly when padding on the left
+    hf_tokenizer.padding_side = "left"
+    return hf_model, hf_tokenizer
+
+
+@dataclass
+class _BatchRequest:
+    text: str
+    tokens: int
+    max_new_tokens: int
+    future: asyncio.Future
+
+
+class LocalBatchedModel:
+    """
+    Serves ``llm_model_func`` calls from a local Hugging Face causal LM, for
+    hosts without access to an API. The prompts of concurrent calls are
+    queued and run through one padded ``generate`` pass per batch, in a
+    worker thread so the event loop keeps scheduling.
+
+    A batch takes the waiting requests in arrival order up to
+    ``max_batch_size`` requests and ``max_batch_tokens`` padded tokens: the
+    number of requests times the longest prompt plus the largest
+    ``max_new_tokens``. Requests arriving while a batch runs form the next one.
+
+    Attributes:
+        model_name (str): A Hugging Face model id or local path.
+        max_batch_size (int): The maximum number of prompts per forward pass.
+        max_batch_tokens (int): The token budget of a batch, bounding its memory.
+        max_new_tokens (int): The generation limit of calls without ``max_tokens``.
+        batch_wait (float): Seconds to wait for more calls before running a partial batch.
+        stats (Counter): The number of ``requests`` served and ``batches`` run.
+
+    Usage example:
+        ```python
+        local_model = LocalBatchedModel("Qwen/Qwen2.5-1.5B-Instruct", max_batch_size=16)
+        rag = HyperRAG(
+            llm_model_func=local_model.llm_model_func,
+            llm_model_max_async=16,
+            / ..other args
+            )
+        ```
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        max_batch_size: int = 8,
+        max_batch_tokens: int = 16384,
+        max_new_tokens: int = 1024,
+        batch_wait: float = 0.01,
+        **generate_kwargs,
+    ):
+        self.model_name = model_name
+        self.max_batch_size = max_batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.max_new_tokens = max_new_tokens
+        self.batch_wait = batch_wait
+        self.generate_kwargs = generate_kwargs
+        self.stats = Counter()
+        self._load_lock = threading.Lock()
+        self._waiting = deque()
+        self._wakeup = None
+        self._worker = None
+        self._loop = None
+
+    def _load(self):
+        # concurrent first calls must not load the model twice
+        with self._load_lock:
+            return initialize_hf_model(self.model_name)
+
+    @staticmethod
+    def _templated(tokenizer) -> bool:
+        # a rendered chat template already holds BOS and the other special tokens
+        return bool(getattr(tokenizer, "chat_template", None))
+
+    def _format_prompt(self, tokenizer, messages: list[dict]) -> str:
+        if self._templated(tokenizer):
+            return tokenizer.apply_chat_template(
+                messages, tokenize=False, add_generation_prompt=True
+            )
+        return "\n".join(f"{m['role']}: {m['content']}" for m in messages) + "\nassistant: "
+
+    def _generate(self, texts: list[str], max_new_tokens: list[int]) -> list[str]:
+        import torch
+
+        model, tokenizer = self._load()
+        inputs = tokenizer(
+            texts,
+            return_tensors="pt",
+            padding=True,
+            add_special_tokens=not self._templated(tokenizer),
+        ).to(model.device)
+        with torch.no_grad():
+            output = model.generate(
+                **inputs,
+                max_new_tokens=max(max_new_tokens),
+                pad_token_id=tokenizer.pad_token_id,
+                **self.generate_kwargs,
+            )
+        new_tokens = output[:, inputs["input_ids"].shape[1] :]
+        return [
+            tokenizer.decode(tokens[:limit], skip_special_tokens=True)
+            for tokens, limit in zip(new_tokens, max_new_tokens)
+        ]
+
+    def _take_batch(self) -> list[_BatchRequest]:
+        # left-padded generate() holds every row at the longest prompt plus
+        # the largest max_new_tokens, so the budget counts the padded size
+        batch, prompt_tokens, new_tokens = [], 0, 0
+        while self._waiting and len(batch) < self.max_batch_size:
+            request = self._waiting[0]
+            padded_prompt = max(prompt_tokens, request.tokens)
+            padded_new = max(new_tokens, request.max_new_tokens)
+            if batch and (len(batch) + 1) * (padded_prompt + padded_new) > self.max_batch_tokens:
+                break
+            batch.append(self._waiting.popleft())
+            prompt_tokens, new_tokens = padded_prompt, padded_new
+        return batch
+
+    async def _serve(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            if not self._waiting:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            if len(self._waiting) < self.max_batch_size:
+                # give the other concurrent calls a moment to join
+                await asyncio.sleep(self.batch_wait)
+            await self._run_batch(loop, self._take_batch())
+
+    async def _run_batch(self, loop, batch: list[_BatchRequest]):
+        self.stats["batches"] += 1
+        try:
+            outputs = await loop.run_in_executor(
+                None,
+                self._generate,
+                [r.text for r in batch],
+                [r.max_new_tokens for r in batch],
+            )
+        except Exception as e:
+            if len(batch) > 1:
+                # one failing prompt (or an out-of-memory batch) must not fail the others
+                for request in batch:
+                    await self._run_batch(loop, [request])
+                return
+            if not batch[0].future.done():
+                batch[0].future.set_exception(e)
+            return
+        for request, output in zip(batch, outputs):
+            if not request.future.done():
+                request.future.set_result(output)
+
+    async def _submit(self, messages: list[dict], max_new_tokens: int) -> str:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # a new event loop (e.g. another insert() call) needs its own worker
+            self._loop, self._waiting = loop, deque()
+            self._wakeup = asyncio.Event()
+            self._worker = loop.create_task(self._serve())
+        _, tokenizer = await loop.run_in_executor(None, self._load)
+        text = self._format_prompt(tokenizer, messages)
+        self.stats["requests"] += 1
+        request = _BatchRequest(
+            text=text,
+            tokens=len(
+                tokenizer(text, add_special_tokens=not self._templated(tokenizer))["input_ids"]
+            ),
+            max_new_tokens=max_new_tokens,
+            future=loop.create_future(),
+        )
+        self._waiting.append(request)
+        self._wakeup.set()
+        return await request.future
+
+    async def llm_model_func(
+        self, prompt, system_prompt=None, history_messages=[], **kwargs
+    ) -> str:
+        hashing_kv: BaseKVStorage = kwargs.pop("hashing_kv", None)
+        messages = []
+        if system_prompt is not None:
+            messages.append({"role": "system", "content": system_prompt})
+        messages.extend(history_messages)
+        messages.append({"role": "user", "content": prompt})
+        if hashing_kv is not None:
+            args_hash = compute_args_hash(self.model_name, messages)
+            if_cache_return = await hashing_kv.get_by_id(args_hash)
+            if if_cache_return is not None:
+                return if_cache_return["return"]
+
+        response = await self._submit(
+            messages, kwargs.get("max_tokens") or self.max_new_tokens
+        )
+        if hashing_kv is not None:
+            await hashing_kv.upsert(
+                {args_hash: {"return": response, "model": self.model_name}}
+            )
+        return response
+
+
+_SAFETENSORS_FLOATS = {"F64": np.float64, "F32": np.float32, "F16": np.float16, "BF16": np.uint16}
+
+
+def _load_safetensors(path: str) -> dict[str, np.ndarray]:
+    """Read the float tensors of a safetensors file as float32, with NumPy alone."""
+    with open(path, "rb") as f:
+        (header_size,) = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(header_size))
+        buffer = f.read()
+    tensors = {}
+    for name, info in header.items():
+        if name == "__metadata__" or info["dtype"] not in _SAFETENSORS_FLOATS:
+            continue
+        start, end = info["data_offsets"]
+        array = np.frombuffer(buffer[start:end], dtype=_SAFETENSORS_FLOATS[info["dtype"]])
+        if info["dtype"] == "BF16":
+            array = (array.astype(np.uint32) << 16).view(np.float32)
+        tensors[name] = array.astype(np.float32).reshape(info["shape"])
+    return tensors
+
+
+# BERT's basic tokenizer: runs of letters and digits, every other character alone
+_WORDPIECE_WORD = re.compile(r"[^\W_\u3040-\u30ff\u4e00-\u9fff]+|\S")
+
+
+class _WordPieceTokenizer:
+    """The WordPiece tokenizer of BERT checkpoints, read from their ``vocab.txt``."""
+
+    def __init__(self, vocab_path: str, lowercase: bool = True, max_length: int = 512):
+        with open(vocab_path, encoding="utf-8") as f:
+            self.vocab = {line.rstrip("\n"): i for i, line in enumerate(f)}
+        self.lowercase = lowercase
+        self.max_length = max_length
+        self.cls, self.sep, self.unk = (self.vocab[t] for t in ("[CLS]", "[SEP]", "[UNK]"))
+        self.pad = self.vocab.get("[PAD]", 0)
+        self._pieces = {}
+
+    def _word_ids(self, word: str) -> list[int]:
+        ids = self._pieces.get(word)
+        if ids is not None:
+            return ids
+        ids, start = [], 0
+        while start < len(word):
+            end = len(word)
+            while end > start:
+                piece = word[start:end] if start == 0 else "##" + word[start:end]
+                if piece in self.vocab:
+                    break
+                end -= 1
+            if end == start or len(word) > 100:
+                ids = [self.unk]
+                break
+            ids.append(self.vocab[piece])
+            start = end
+        if len(self._pieces) < 200_000:
+            self._pieces[word] = ids
+        return ids
+
+    def encode(self, text: str) -> list[int]:
+        if self.lowercase:
+            text = unicodedata.normalize("NFD", text.lower())
+            text = "".join(c for c in text if unicodedata.category(c) != "Mn")
+        ids = [self.cls]
+        for word in _WORDPIECE_WORD.findall(text):
+            ids.extend(self._word_ids(word))
+            if len(ids) >= self.max_length - 1:
+                break
+        return ids[: self.max_length - 1] + [self.sep]
+
+
+class _NumpyBertEncoder:
+    """
+    Forward pass of a BERT-style encoder (e.g. all-MiniLM-L6-v2) in NumPy,
+    from the ``config.json`` and ``model.safetensors`` of a checkpoint.
+    GELU uses its tanh approximation.
+    """
+
+    def __init__(self, model_dir: str):
+        with open(os.path.join(model_dir, "config.json"), encoding="utf-8") as f:
+            config = json.load(f)
+        weights = _load_safetensors(os.path.join(model_dir, "model.safetensors"))
+        # names may carry a prefix such as "bert."
+        anchor = "embeddings.word_embeddings.weight"
+        prefix = next(n for n in weights if n.endswith(anchor))[: -len(anchor)]
+        w = {n[len(prefix) :]: v for n, v in weights.items() if n.startswith(prefix)}
+
+        self.heads = config["num_attention_heads"]
+        self.eps = config.get("layer_norm_eps", 1e-12)
+        self.embeddings = (
+            w["embeddings.word_embeddings.weight"],
+            w["embeddings.position_embeddings.weight"],
+            w["embeddings.token_type_embeddings.weight"][0],
         )
+        self.embeddings_norm = (w["embeddings.LayerNorm.weight"], w["embeddings.LayerNorm.bias"])
+        self.layers = []
+        for i in range(config["num_hidden_layers"]):
+            p = f"encoder.layer.{i}."
+
+            def linear(name):
+                return np.ascontiguousarray(w[p + name + ".weight"].T), w[p + name + ".bias"]
+
+            q, k, v = (linear(f"attention.self.{n}") for n in ("query", "key", "value"))
+            self.layers.append(
+                dict(
+                    # one matmul for the query, key and value projections
+                    qkv=(np.hstack([q[0], k[0], v[0]]), np.concatenate([q[1], k[1], v[1]])),
+                    attention_output=linear("attention.output.dense"),
+                    attention_norm=(
+                        w[p + "attention.output.LayerNorm.weight"],
+                        w[p + "attention.output.LayerNorm.bias"],
+                    ),
+                    intermediate=linear("intermediate.dense"),
+                    output=linear("output.dense"),
+                    output_norm=(w[p + "output.LayerNorm.weight"], w[p + "output.LayerNorm.bias"]),
+                )
+            )
+
+    def _norm(self, x: np.ndarray, params) -> np.ndarray:
+        x = x - x.mean(-1, keepdims=True)
+        return x / np.sqrt((x * x).mean(-1, keepdims=True) + self.eps) * params[0] + params[1]
+
+    def __call__(self, input_ids: np.ndarray, attention_mask: np.ndarray) -> np.ndarray:
+        batch, length = input_ids.shape
+        words, positions, token_type = self.embeddings
+        x = self._norm(words[input_ids] + positions[:length] + token_type, self.embeddings_norm)
+        hidden = x.shape[-1]
+        head_dim = hidden // self.heads
+        mask = np.where(attention_mask[:, None, None, :] > 0, 0.0, -1e9).astype(np.float32)
+        for layer in self.layers:
+            qkv = x @ layer["qkv"][0] + layer["qkv"][1]
+            q, k, v = qkv.reshape(batch, length, 3, self.heads, head_dim).transpose(2, 0, 3, 1, 4)
+            scores = q @ k.transpose(0, 1, 3, 2) * head_dim**-0.5 + mask
+            scores = np.exp(scores - scores.max(-1, keepdims=True))
+            scores /= scores.sum(-1, keepdims=True)
+            context = (scores @ v).transpose(0, 2, 1, 3).reshape(batch, length, hidden)
+            out, bias = layer["attention_output"]
+            x = self._norm(x + context @ out + bias, layer["attention_norm"])
+            h = x @ layer["intermediate"][0] + layer["intermediate"][1]
+            h = 0.5 * h * (1.0 + np.tanh(0.7978845608 * (h + 0.044715 * h * h * h)))
+            out, bias = layer["output"]
+            x = self._norm(x + h @ out + bias, layer["output_norm"])
+        return x
+
+
+@dataclass
+class _EmbeddingRequest:
+    texts: list[str]
+    future: asyncio.Future
+
+
+class LocalEmbeddingModel:
+    """
+    Embeds texts on the CPU with a local sentence-embedding model, for hosts
+    without network access. ``embedding_func`` is an ``EmbeddingFunc`` for
+    ``HyperRAG(embedding_func=...)``.
+
+    Concurrent calls, such as the ``embedding_batch_num`` batches of a vector
+    upsert or the single-text calls of queries, are queued and coalesced into
+    batches of up to ``max_batch_size`` texts. The batches run in a thread
+    pool of ``max_workers`` threads, so the event loop is never blocked.
+    Within a batch, texts are sorted by length and run in forward passes of
+    at most ``max_batch_tokens`` padded tokens, which keeps padding low and
+    the activations in cache.
+
+    ``model_path`` is a checkpoint directory. With ``backend="onnx"`` it holds
+    ``model.onnx`` (or ``onnx/model.onnx``) and ``tokenizer.json``, and needs
+    ``onnxruntime`` and ``tokenizers``. With ``backend="numpy"`` it holds a
+    BERT-style ``config.json``, ``model.safetensors`` and ``vocab.txt``, and
+    needs nothing beyond NumPy. ``"auto"`` uses ONNX when both the file and
+    ``onnxruntime`` are available.
+
+    Usage example:
+        ```python
+        local_embedding = LocalEmbeddingModel("models/all-MiniLM-L6-v2")
+        rag = HyperRAG(
+            embedding_func=local_embedding.embedding_func,
+            / ..other args
+            )
+        ```
+    """
 
-        return await next_model.gen_func(**args)
+    def __init__(
+        self,
+        model_path: str,
+        backend: str = "auto",
+        embedding_dim: int = None,
+        max_token_size: int = 512,
+        pooling: str = "mean",
+        max_batch_size: int = 64,
+        max_batch_tokens: int = 1024,
+        batch_wait: float = 0.005,
+        max_workers: int = 1,
+    ):
+        self.model_path = model_path
+        onnx_path = next(
+            (
+                os.path.join(model_path, name)
+                for name in ("model.onnx", os.path.join("onnx", "model.onnx"))
+                if os.path.exists(os.path.join(model_path, name))
+            ),
+            None,
+        )
+        if backend == "auto":
+            backend = (
+                "onnx"
+                if onnx_path and importlib.util.find_spec("onnxruntime") is not None
+                else "numpy"
+            )
+        if backend not in ("onnx", "numpy"):
+            raise ValueError(f"Embedding backend '{backend}' is not supported!")
+        self.backend = backend
+        self._onnx_path = onnx_path
+        if embedding_dim is None:
+            with open(os.path.join(model_path, "config.json"), encoding="utf-8") as f:
+                embedding_dim = json.load(f)["hidden_size"]
+        self.embedding_dim = embedding_dim
+        self.max_token_size = max_token_size
+        self.pooling = pooling
+        self.max_batch_size = max_batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.batch_wait = batch_wait
+        self.max_workers = max_workers
+        self.stats = Counter()
+        self._encoder = None
+        self._load_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._loop = None
+
+    @property
+    def embedding_func(self) -> EmbeddingFunc:
+        return EmbeddingFunc(
+            embedding_dim=self.embedding_dim,
+            max_token_size=self.max_token_size,
+            func=self.embed,
+        )
+
+    def _load(self):
+        with self._load_lock:
+            if self._encoder is None:
+                self._encoder = (
+                    self._load_onnx() if self.backend == "onnx" else self._load_numpy()
+                )
+            return self._encoder
+
+    def _load_onnx(self):
+        import onnxruntime
+        from tokenizers import Tokenizer
+
+        tokenizer = Tokenizer.from_file(os.path.join(self.model_path, "tokenizer.json"))
+        tokenizer.enable_truncation(max_length=self.max_token_size)
+        tokenizer.no_padding()
+        options = onnxruntime.SessionOptions()
+        # the worker threads share the cores
+        options.intra_op_num_threads = max((os.cpu_count() or 1) // self.max_workers, 1)
+        session = onnxruntime.InferenceSession(
+            self._onnx_path, options, providers=["CPUExecutionProvider"]
+        )
+        input_names = {i.name for i in session.get_inputs()}
+
+        def tokenize(texts):
+            return [e.ids for e in tokenizer.encode_batch(texts)]
+
+        def forward(input_ids, attention_mask):
+            feed = {"input_ids": input_ids, "attention_mask": attention_mask}
+            if "token_type_ids" in input_names:
+                feed["token_type_ids"] = np.zeros_like(input_ids)
+            return session.run(None, feed)[0]
+
+        return tokenize, forward, tokenizer.token_to_id("[PAD]") or 0
+
+    def _load_numpy(self):
+        with open(os.path.join(self.model_path, "config.json"), encoding="utf-8") as f:
+            config = json.load(f)
+        tokenizer = _WordPieceTokenizer(
+            os.path.join(self.model_path, "vocab.txt"),
+            config.get("do_lower_case", True),
+            min(self.max_token_size, config.get("max_position_embeddings", self.max_token_size)),
+        )
+        encoder = _NumpyBertEncoder(self.model_path)
+
+        def tokenize(texts):
+            return [tokenizer.encode(text) for text in texts]
+
+        return tokenize, encoder, tokenizer.pad
+
+    def encode(self, texts: list[str]) -> np.ndarray:
+        """Embed one batch synchronously, pooled and L2-normalised."""
+        tokenize, forward, pad = self._load()
+        rows = tokenize(texts)
+        order = sorted(range(len(rows)), key=lambda i: len(rows[i]))
+        embeddings = np.zeros((len(rows), self.embedding_dim), dtype=np.float32)
+        start = 0
+        while start < len(order):
+            # rows are sorted, so the last one sets the padded width
+            end = start + 1
+            while (
+                end < len(order)
+                and len(rows[order[end]]) * (end - start + 1) <= self.max_batch_tokens
+            ):
+                end += 1
+            index = order[start:end]
+            input_ids = np.full((len(index), len(rows[index[-1]])), pad, dtype=np.int64)
+            attention_mask = np.zeros(input_ids.shape, dtype=np.int64)
+            for i, row in enumerate(index):
+                input_ids[i, : len(rows[row])] = rows[row]
+                attention_mask[i, : len(rows[row])] = 1
+            states = forward(input_ids, attention_mask)
+            if states.ndim == 3:
+                if self.pooling == "cls":
+                    states = states[:, 0]
+                else:
+                    mask = attention_mask[..., None].astype(states.dtype)
+                    states = (states * mask).sum(1) / np.maximum(mask.sum(1), 1e-9)
+            embeddings[index] = states
+            start = end
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return embeddings / np.maximum(norms, 1e-12)
+
+    def _take_batch(self) -> list[_EmbeddingRequest]:
+        batch, count = [], 0
+        while self._waiting and (
+            not batch or count + len(self._waiting[0].texts) <= self.max_batch_size
+        ):
+            request = self._waiting.popleft()
+            batch.append(request)
+            count += len(request.texts)
+        self._waiting_texts -= count
+        return batch
+
+    async def _serve(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            if not self._waiting:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            if self._waiting_texts < self.max_batch_size:
+                # give the other concurrent calls a moment to join
+                await asyncio.sleep(self.batch_wait)
+            await self._slots.acquire()
+            loop.create_task(self._run_batch(loop, self._take_batch()))
+
+    async def _run_batch(self, loop, batch: list[_EmbeddingRequest]):
+        try:
+            texts = [text for request in batch for text in request.texts]
+            self.stats["batches"] += 1
+            self.stats["texts"] += len(texts)
+            embeddings = await loop.run_in_executor(self._executor, self.encode, texts)
+        except Exception as e:
+            for request in batch:
+                if not request.future.done():
+                    request.future.set_exception(e)
+            return
+        finally:
+            self._slots.release()
+        start = 0
+        for request in batch:
+            if not request.future.done():
+                request.future.set_result(embeddings[start : start + len(request.texts)])
+            start += len(request.texts)
+
+    async def embed(self, texts: list[str]) -> np.ndarray:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # a new event loop (e.g. another insert() call) needs its own worker
+            self._loop, self._waiting, self._waiting_texts = loop, deque(), 0
+            self._wakeup = asyncio.Event()
+            self._slots = asyncio.Semaphore(self.max_workers)
+            loop.create_task(self._serve())
+        if not texts:
+            return np.zeros((0, self.embedding_dim), dtype=np.float32)
+        self.stats["calls"] += 1
+        requests = [
+            _EmbeddingRequest(texts[i : i + self.max_batch_size], loop.create_future())
+            for i in range(0, len(texts), self.max_batch_size)
+        ]
+        self._waiting.extend(requests)
+        self._waiting_texts += len(texts)
+        self._wakeup.set()
+        return np.vstack([await request.future for request in requests])
 
 
 if __name__ == "__main__":
@@ -2,31 +2,40 @@ import sys
 import asyncio
 import json
 import re
+import time
+from dataclasses import dataclass, field
+from functools import lru_cache
 from datetime import datetime
-from typing import Union
+from typing import Any, Union
 from collections import Counter, defaultdict
-import warnings
 
+import numpy as np
 
 from .utils import (
     logger,
     clean_str,
     compute_mdhash_id,
     decode_tokens_by_tiktoken,
+    count_tokens,
     encode_string_by_tiktoken,
     is_float_regex,
     list_of_list_to_csv,
+    JsonRecordStream,
+    locate_json_string_body_from_string,
+    MinHashLSH,
+    minhash_signature,
     pack_user_ass_to_openai_messages,
+    set_tokenizer,
     split_string_by_multi_markers,
+    token_offsets,
     truncate_list_by_token_size,
-    process_combine_contexts,
-    deduplicate_by_key,
 )
 from .base import (
     BaseKVStorage,
     BaseVectorStorage,
     TextChunkSchema,
     QueryParam, BaseHypergraphStorage,
+    QueryContext,
 )
 
 from .prompt import GRAPH_FIELD_SEP, PROMPTS
@@ -55,12 +64,172 @@ def _prepare_entity_extraction_templates(global_config: dict):
         examples=example_str,
     )
 
+    if global_config.get("entity_extraction_format", "delimited") == "json":
+        context_base.update(
+            examples=_json_extraction_example(example_str, context_base),
+            extraction_format="json",
+        )
+        return dict(
+            entity_extract_prompt=PROMPTS["entity_extraction_json"],
+            batch_extract_prompt=None,
+            context_base=context_base,
+            continue_prompt=PROMPTS["entity_continue_extraction_json"],
+            if_loop_prompt=PROMPTS["entity_if_loop_extraction"],
+            llm_kwargs=dict(
+                response_format={
+                    "type": "json_schema",
+                    "json_schema": {
+                        "name": "entity_extraction",
+                        "schema": PROMPTS["entity_extraction_json_schema"],
+                    },
+                }
+            ),
+        )
+
     return dict(
         entity_extract_prompt=entity_extract_prompt,
+        batch_extract_prompt=PROMPTS["entity_extraction_batch"],
         context_base=context_base,
         continue_prompt=PROMPTS["entity_continue_extraction"],
         if_loop_prompt=PROMPTS["entity_if_loop_extraction"],
+        llm_kwargs={},
+    )
+
+
+_JSON_RECORD_SECTIONS = {
+    "entities": '"Entity"',
+    "low_order_hyperedges": '"Low-order Hyperedge"',
+    "high_order_hyperedges": '"High-order Hyperedge"',
+}
+
+
+def _json_extraction_example(example_str: str, context_base: dict) -> str:
+    # the delimited example answer rewritten as the JSON object expected back
+    head, sep, output = example_str.rpartition("Output:\n")
+    if not sep:
+        return example_str
+    answer = {section: [] for section in _JSON_RECORD_SECTIONS}
+    for attributes, _ in _iter_extraction_records(output, context_base):
+        kind = attributes[0]
+        if kind == '"Entity"' and len(attributes) >= 5:
+            answer["entities"].append(
+                dict(
+                    name=attributes[1],
+                    type=attributes[2],
+                    description=attributes[3],
+                    source_url_path=attributes[4],
+                    additional_properties=", ".join(attributes[5:]),
+                )
+            )
+        elif kind == '"Low-order Hyperedge"' and len(attributes) >= 7:
+            answer["low_order_hyperedges"].append(
+                dict(
+                    entities=attributes[1:-4],
+                    description=attributes[-4],
+                    keywords=attributes[-3],
+                    strength=float(attributes[-2]) if is_float_regex(attributes[-2]) else 0.75,
+                    source_url_paths=attributes[-1],
+                )
+            )
+        elif kind == '"High-order Hyperedge"' and len(attributes) >= 8:
+            answer["high_order_hyperedges"].append(
+                dict(
+                    entities=attributes[1:-5],
+                    description=attributes[-5],
+                    generalization=attributes[-4],
+                    keywords=attributes[-3],
+                    strength=float(attributes[-2]) if is_float_regex(attributes[-2]) else 0.75,
+                    source_url_paths=attributes[-1],
+                )
+            )
+    return f"{head}{sep}{json.dumps(answer, ensure_ascii=False)}\n"
+
+
+def _json_record_attributes(section: str, record: dict) -> Union[list[str], None]:
+    """Lay a JSON record out like the attributes of the delimited format."""
+    kind = _JSON_RECORD_SECTIONS.get(section)
+    if kind is None:
+        return None
+
+    def text(key: str, sep: str = ", ") -> str:
+        value = record.get(key)
+        if isinstance(value, dict):
+            return sep.join(f"{k}:{v}" for k, v in value.items())
+        if isinstance(value, (list, tuple)):
+            return sep.join(str(v) for v in value)
+        return "" if value is None else str(value)
+
+    if kind == '"Entity"':
+        properties = text("additional_properties")
+        return [
+            kind,
+            text("name"),
+            text("type"),
+            text("description"),
+            text("source_url_path"),
+        ] + ([properties] if properties else [])
+    entities = record.get("entities")
+    if not isinstance(entities, (list, tuple)):
+        return None
+    attributes = [kind] + [str(e) for e in entities if str(e).strip()]
+    attributes.append(text("description"))
+    if kind == '"High-order Hyperedge"':
+        attributes.append(text("generalization"))
+    attributes += [text("keywords"), text("strength"), text("source_url_paths", ";")]
+    return attributes
+
+
+_CHUNK_MARKER = re.compile(
+    re.escape(PROMPTS["DEFAULT_CHUNK_MARKER"]).replace(r"\{\}", r"\s*(\d+)\s*")
+)
+
+
+def _pack_extraction_batches(
+    ordered_chunks: list[tuple[str, TextChunkSchema]], global_config: dict
+) -> list[list[tuple[str, TextChunkSchema]]]:
+    """Group consecutive chunks into prompts of at most
+    ``entity_extract_batch_token_size`` tokens; 0 keeps one chunk per prompt,
+    as does the JSON extraction format."""
+    max_tokens = global_config.get("entity_extract_batch_token_size", 0)
+    if global_config.get("entity_extraction_format", "delimited") == "json":
+        max_tokens = 0
+    max_chunks = global_config.get("entity_extract_batch_max_chunks", 8)
+    batches, batch, batch_tokens = [], [], 0
+    for chunk_key, chunk_dp in ordered_chunks:
+        tokens = chunk_dp.get("tokens") or count_tokens(chunk_dp["content"])
+        if batch and (batch_tokens + tokens > max_tokens or len(batch) >= max_chunks):
+            batches.append(batch)
+            batch, batch_tokens = [], 0
+        batch.append((chunk_key, chunk_dp))
+        batch_tokens += tokens
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def _format_extraction_prompt(batch: list[tuple[str, TextChunkSchema]], template_data: dict) -> str:
+    context_base = template_data["context_base"]
+    if len(batch) == 1:
+        return template_data["entity_extract_prompt"].format(
+            **context_base, input_text=batch[0][1]["content"]
+        )
+    input_text = "\n\n".join(
+        f"{PROMPTS['DEFAULT_CHUNK_MARKER'].format(index)}\n{chunk_dp['content']}"
+        for index, (_, chunk_dp) in enumerate(batch, start=1)
     )
+    return template_data["batch_extract_prompt"].format(
+        **context_base, chunk_count=len(batch), input_text=input_text
+    )
+
+
+def _split_batch_response(response: str, chunk_count: int) -> dict[int, str]:
+    # records before the first marker cannot be attributed and are dropped
+    pieces = _CHUNK_MARKER.split(response)
+    parts = defaultdict(str)
+    for index, text in zip(pieces[1::2], pieces[2::2]):
+        if 1 <= int(index) <= chunk_count:
+            parts[int(index)] += text + PROMPTS["DEFAULT_RECORD_DELIMITER"]
+    return parts
 
 
 def build_entity_extraction_prompts(
@@ -70,24 +239,23 @@ def build_entity_extraction_prompts(
 
     The returned list contains the prompt alongside chunk metadata so that the
     caller can inspect what will be sent to the LLM without triggering any
-    extraction calls or hypergraph updates.
+    extraction calls or hypergraph updates. Batched prompts list their chunk
+    ids joined by ``GRAPH_FIELD_SEP``.
     """
 
     template_data = _prepare_entity_extraction_templates(global_config)
-    entity_extract_prompt = template_data["entity_extract_prompt"]
-    context_base = template_data["context_base"]
 
     prompts = []
-    for chunk_key, chunk_dp in chunks.items():
-        prompt = entity_extract_prompt.format(
-            **context_base, input_text=chunk_dp["content"]
-        )
+    for batch in _pack_extraction_batches(list(chunks.items()), global_config):
+        prompt = _format_extraction_prompt(batch, template_data)
         prompts.append(
             {
-                "chunk_id": chunk_key,
-                "full_doc_id": chunk_dp.get("full_doc_id", ""),
+                "chunk_id": GRAPH_FIELD_SEP.join(k for k, _ in batch),
+                "full_doc_id": GRAPH_FIELD_SEP.join(
+                    dict.fromkeys(dp.get("full_doc_id", "") for _, dp in batch)
+                ),
                 "prompt": prompt,
-                "chunk_content": chunk_dp["content"],
+                "chunk_content": "\n\n".join(dp["content"] for _, dp in batch),
             }
         )
 
@@ -98,45 +266,400 @@ def chunking_by_token_size(
     overlap_token_size: int = 128,
     max_token_size: int = 1024,
     tiktoken_model: str | None = None,
+    as_generator: bool = False,
 ):
     """Split *content* into overlapping chunks based on tokenizer length.
 
     The ``tiktoken_model`` argument is kept for backwards compatibility with
     earlier releases but is no longer required because tokenization is provided
     by a model-agnostic tokenizer. The argument is therefore ignored.
+
+    Chunks are slices of *content* located through the token offsets, and
+    ``char_start``/``char_end`` record where each chunk's content sits in the
+    document. With ``as_generator`` the chunks are yielded lazily.
     """
 
-    tokens = encode_string_by_tiktoken(content, model_name=tiktoken_model or "")
-    results = []
+    chunks = _iter_chunks_by_token_offsets(content, overlap_token_size, max_token_size)
+    return chunks if as_generator else list(chunks)
+
+
+def _iter_chunks_by_token_offsets(
+    content: str, overlap_token_size: int, max_token_size: int
+):
+    offsets = token_offsets(content)
+    if offsets is None:
+        yield from _iter_chunks_by_decoded_tokens(
+            content, overlap_token_size, max_token_size
+        )
+        return
+    num_tokens = len(offsets) - 1
+    for index, start in enumerate(
+        range(0, num_tokens, max_token_size - overlap_token_size)
+    ):
+        end = min(start + max_token_size, num_tokens)
+        char_start, char_end = int(offsets[start]), int(offsets[end])
+        raw = content[char_start:char_end]
+        chunk_content = raw.strip()
+        if chunk_content:
+            char_start += len(raw) - len(raw.lstrip())
+        yield {
+            "tokens": end - start,
+            "content": chunk_content,
+            "chunk_order_index": index,
+            "char_start": char_start,
+            "char_end": char_start + len(chunk_content),
+        }
+
+
+def _iter_chunks_by_decoded_tokens(
+    content: str, overlap_token_size: int, max_token_size: int
+):
+    # For tokenizers whose tokens are not substrings of the text.
+    tokens = encode_string_by_tiktoken(content)
     for index, start in enumerate(
         range(0, len(tokens), max_token_size - overlap_token_size)
     ):
-        chunk_content = decode_tokens_by_tiktoken(
-            tokens[start : start + max_token_size], model_name=tiktoken_model or ""
+        window = tokens[start : start + max_token_size]
+        yield {
+            "tokens": len(window),
+            "content": decode_tokens_by_tiktoken(window).strip(),
+            "chunk_order_index": index,
+        }
+
+_SENTENCE_BOUNDARY = re.compile(r"[.!?]+[\"'\u201d\u2019)\]]*\s+|[\u3002\uff01\uff1f]+\s*")
+_PARAGRAPH_BOUNDARY = re.compile(r"\n[ \t]*\n\s*")
+_MARKDOWN_HEADING = re.compile(r"^#{1,6}[ \t]", re.MULTILINE)
+# Structure levels as (pattern, boundary strength); fixed token windows have strength 0.
+_SENTENCE_LEVELS = [(_SENTENCE_BOUNDARY, 1)]
+_PARAGRAPH_LEVELS = [(_PARAGRAPH_BOUNDARY, 2), (_SENTENCE_BOUNDARY, 1)]
+_MARKDOWN_LEVELS = [(_MARKDOWN_HEADING, 3), (_PARAGRAPH_BOUNDARY, 2), (_SENTENCE_BOUNDARY, 1)]
+# A chunk is only cut at a stronger boundary if it is at least this full.
+_MIN_CHUNK_FILL = 0.6
+
+
+def _structure_boundaries(pattern, content: str, start: int, end: int) -> list[int]:
+    # Headings open a unit, sentence and paragraph separators close one; a
+    # heading line stays attached to the paragraph below it.
+    if pattern is _MARKDOWN_HEADING:
+        return [m.start() for m in pattern.finditer(content, start, end)]
+    bounds = []
+    for m in pattern.finditer(content, start, end):
+        line_start = content.rfind("\n", start, m.start()) + 1
+        if pattern is _PARAGRAPH_BOUNDARY and _MARKDOWN_HEADING.match(
+            content, max(line_start, start), m.start()
+        ):
+            continue
+        bounds.append(m.end())
+    return bounds
+
+
+def _iter_structured_units(content, offsets, start, end, levels, max_token_size, strength):
+    """
+    Split ``content[start:end]`` at every structure level down to sentences,
+    and sentences over ``max_token_size`` into token windows. Yields
+    ``(start, end, tokens, strength)`` where ``strength`` is that of the
+    strongest boundary the unit starts at.
+    """
+    if not levels:
+        first, last = np.searchsorted(offsets, [start, end])
+        for i in range(first, last, max_token_size):
+            j = min(i + max_token_size, last)
+            yield int(offsets[i]), int(offsets[j]), int(j - i), strength if i == first else 0
+        return
+    pattern, level_strength = levels[0]
+    bounds = [start]
+    bounds += [b for b in _structure_boundaries(pattern, content, start, end) if start < b < end]
+    bounds.append(end)
+    for i, (a, b) in enumerate(zip(bounds, bounds[1:])):
+        yield from _iter_structured_units(
+            content,
+            offsets,
+            a,
+            b,
+            levels[1:],
+            max_token_size,
+            strength if i == 0 else level_strength,
         )
-        results.append(
-            {
-                "tokens": len(tokens[start : start + max_token_size]),
-                "content": chunk_content.strip(),
-                "chunk_order_index": index,
-            }
+
+
+def _best_cut(packed: list, next_strength: int, max_token_size: int) -> int:
+    # Cut before the strongest boundary that leaves the chunk at least
+    # _MIN_CHUNK_FILL full, preferring the latest one among equals.
+    best, best_key, tokens = len(packed), (next_strength, len(packed)), 0
+    for i, unit in enumerate(packed):
+        if i and tokens >= _MIN_CHUNK_FILL * max_token_size:
+            best, best_key = max((best, best_key), (i, (unit[3], i)), key=lambda x: x[1])
+        tokens += unit[2]
+    return best
+
+
+def _pack_structured_units(content, units, overlap_token_size, max_token_size):
+    """
+    Pack consecutive units into chunks of at most ``max_token_size`` tokens,
+    cutting at the strongest nearby boundary. Chunks cut inside a paragraph
+    repeat whole trailing sentences that fit in ``overlap_token_size``; chunks
+    cut at a paragraph or heading get no overlap.
+    """
+
+    def make_chunk(index, packed):
+        # None for whitespace-only packs, which would all share one chunk id
+        char_start, char_end = packed[0][0], packed[-1][1]
+        raw = content[char_start:char_end]
+        chunk_content = raw.strip()
+        if not chunk_content:
+            return None
+        char_start += len(raw) - len(raw.lstrip())
+        return {
+            "tokens": sum(u[2] for u in packed),
+            "content": chunk_content,
+            "chunk_order_index": index,
+            "char_start": char_start,
+            "char_end": char_start + len(chunk_content),
+        }
+
+    index, packed = 0, []
+    for unit in units:
+        while packed and sum(u[2] for u in packed) + unit[2] > max_token_size:
+            cut = _best_cut(packed, unit[3], max_token_size)
+            chunk = make_chunk(index, packed[:cut])
+            if chunk is not None:
+                yield chunk
+                index += 1
+            rest = packed[cut:]
+            rest_tokens = sum(u[2] for u in rest)
+            carry, carry_tokens = [], 0
+            if (rest[0][3] if rest else unit[3]) <= 1:
+                for previous in reversed(packed[:cut]):
+                    if (
+                        carry_tokens + previous[2] > overlap_token_size
+                        or carry_tokens + previous[2] + rest_tokens + unit[2] > max_token_size
+                    ):
+                        break
+                    carry.insert(0, previous)
+                    carry_tokens += previous[2]
+            packed = carry + rest
+        packed.append(unit)
+    chunk = make_chunk(index, packed) if packed else None
+    if chunk is not None:
+        yield chunk
+
+
+def _chunking_by_structure(
+    content: str,
+    levels: list,
+    overlap_token_size: int,
+    max_token_size: int,
+    as_generator: bool,
+):
+    offsets = token_offsets(content)
+    if offsets is None:
+        return chunking_by_token_size(
+            content, overlap_token_size, max_token_size, as_generator=as_generator
+        )
+    units = _iter_structured_units(
+        content, offsets, 0, len(content), levels, max_token_size, levels[0][1]
+    )
+    chunks = _pack_structured_units(content, units, overlap_token_size, max_token_size)
+    return chunks if as_generator else list(chunks)
+
+
+def chunking_by_sentences(
+    content: str,
+    overlap_token_size: int = 128,
+    max_token_size: int = 1024,
+    tiktoken_model: str | None = None,
+    as_generator: bool = False,
+):
+    """Pack whole sentences into chunks of at most ``max_token_size`` tokens.
+
+    Overlap is limited to whole trailing sentences that fit in
+    ``overlap_token_size``. Same signature and records as
+    ``chunking_by_token_size``.
+    """
+    return _chunking_by_structure(
+        content, _SENTENCE_LEVELS, overlap_token_size, max_token_size, as_generator
+    )
+
+
+def chunking_by_paragraphs(
+    content: str,
+    overlap_token_size: int = 128,
+    max_token_size: int = 1024,
+    tiktoken_model: str | None = None,
+    as_generator: bool = False,
+):
+    """Pack blank-line separated paragraphs, splitting long ones by sentence."""
+    return _chunking_by_structure(
+        content,
+        _PARAGRAPH_LEVELS,
+        overlap_token_size,
+        max_token_size,
+        as_generator,
+    )
+
+
+def chunking_by_markdown_headings(
+    content: str,
+    overlap_token_size: int = 128,
+    max_token_size: int = 1024,
+    tiktoken_model: str | None = None,
+    as_generator: bool = False,
+):
+    """Pack markdown sections, starting chunks at headings where possible.
+
+    Suited to ``main_content`` payloads from ``format_elasticsearch_document``;
+    sections over the budget are split by paragraph, then by sentence.
+    """
+    return _chunking_by_structure(
+        content,
+        _MARKDOWN_LEVELS,
+        overlap_token_size,
+        max_token_size,
+        as_generator,
+    )
+
+
+def hash_documents(contents: list[str]) -> list[tuple[str, str]]:
+    """Strip each document and return ``(doc_id, content)`` pairs."""
+    return [
+        (compute_mdhash_id(c.strip(), prefix="doc-"), c.strip()) for c in contents
+    ]
+
+
+def chunk_document(
+    doc_key: str,
+    content: str,
+    overlap_token_size: int,
+    max_token_size: int,
+    tokenizer=None,
+    chunking_func: callable = None,
+) -> dict[str, TextChunkSchema]:
+    """
+    Chunk one document and key the chunks by content hash. Picklable so it can
+    run in a worker process, which gets the tokenizer passed in explicitly.
+    """
+    chunking_func = chunking_func or chunking_by_token_size
+    if tokenizer is not None:
+        set_tokenizer(tokenizer)
+    return {
+        compute_mdhash_id(dp["content"], prefix="chunk-"): {
+            **dp,
+            "full_doc_id": doc_key,
+        }
+        for dp in chunking_func(
+            content,
+            overlap_token_size=overlap_token_size,
+            max_token_size=max_token_size,
         )
-    return results
+    }
 
 # summarize the descriptions of the entity
+@dataclass
+class _SummaryBatcher:
+    """
+    Collects the summaries requested by concurrent merges and sends up to
+    ``max_items`` of them (``max_tokens`` of input) in one ``summarize_batch``
+    prompt. A batch is sent when full or ``max_wait`` seconds after its first
+    request; items missing from the JSON answer fall back to their own prompt.
+    """
+
+    global_config: dict
+    max_items: int = 16
+    max_tokens: int = 8000
+    max_wait: float = 0.05
+    stats: Counter = field(default_factory=Counter)
+    _pending: list = field(default_factory=list)
+    _pending_tokens: int = 0
+    _timer: Any = None
+    _running: set = field(default_factory=set)
+
+    async def summarize(self, task: str, name, texts: list[str], max_tokens: int, prompt: str) -> str:
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((task, str(name), texts, max_tokens, prompt, future))
+        self._pending_tokens += sum(count_tokens(t) for t in texts)
+        if len(self._pending) >= self.max_items or self._pending_tokens >= self.max_tokens:
+            self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.max_wait, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending, self._pending_tokens = self._pending, [], 0
+        if batch:
+            task = asyncio.ensure_future(self._run(batch))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _run(self, batch: list):
+        use_llm_func: callable = self.global_config["llm_model_func"]
+        self.stats["summary_items"] += len(batch)
+        try:
+            summaries = {}
+            if len(batch) > 1:
+                items = "\n".join(
+                    json.dumps(
+                        {"id": str(i), "task": task, "name": name, "max_tokens": max_tokens, "list": texts},
+                        ensure_ascii=False,
+                    )
+                    for i, (task, name, texts, max_tokens, _, _) in enumerate(batch, start=1)
+                )
+                self.stats["summary_llm_calls"] += 1
+                response = await use_llm_func(
+                    PROMPTS["summarize_batch"].format(items=items),
+                    max_tokens=sum(item[3] for item in batch),
+                )
+                try:
+                    summaries = json.loads(locate_json_string_body_from_string(response or "") or "{}")
+                except json.JSONDecodeError:
+                    logger.warning(f"Unparsable batched summary for {len(batch)} items")
+                if not isinstance(summaries, dict):
+                    summaries = {}
+
+            async def _resolve(index, item):
+                summary = summaries.get(str(index))
+                if not isinstance(summary, str) or not summary.strip():
+                    self.stats["summary_llm_calls"] += 1
+                    summary = await use_llm_func(item[4], max_tokens=item[3])
+                if not item[5].done():
+                    item[5].set_result(summary)
+
+            await asyncio.gather(
+                *[_resolve(i, item) for i, item in enumerate(batch, start=1)]
+            )
+        except Exception as e:
+            for item in batch:
+                if not item[5].done():
+                    item[5].set_exception(e)
+
+
+def _make_summarizer(global_config: dict, stats: Counter = None) -> _SummaryBatcher | None:
+    if global_config.get("summary_batch_size", 1) <= 1:
+        return None
+    return _SummaryBatcher(
+        global_config,
+        max_items=global_config["summary_batch_size"],
+        max_tokens=global_config.get("summary_batch_max_tokens", 8000),
+        stats=Counter() if stats is None else stats,
+    )
+
+
 async def _handle_entity_summary(
     entity_or_relation_name: str,
     description: str,
     global_config: dict,
+    summarizer: _SummaryBatcher = None,
 ) -> str:
     use_llm_func: callable = global_config["llm_model_func"]
     llm_max_tokens = global_config["llm_model_max_token_size"]
     tiktoken_model_name = global_config["tiktoken_model_name"]
     summary_max_tokens = global_config["entity_summary_to_max_tokens"] # 500
 
-    tokens = encode_string_by_tiktoken(description, model_name=tiktoken_model_name)
-    if len(tokens) < summary_max_tokens:  # No need for summary
+    if count_tokens(description) < summary_max_tokens:  # No need for summary
         return description
+    tokens = encode_string_by_tiktoken(description, model_name=tiktoken_model_name)
     prompt_template = PROMPTS["summarize_entity_descriptions"]
     use_description = decode_tokens_by_tiktoken(
         tokens[:llm_max_tokens], model_name=tiktoken_model_name
@@ -147,7 +670,16 @@ async def _handle_entity_summary(
     )
     use_prompt = prompt_template.format(**context_base)
     logger.debug(f"Trigger summary: {entity_or_relation_name}")
-    summary = await use_llm_func(use_prompt, max_tokens=summary_max_tokens)
+    if summarizer is not None:
+        summary = await summarizer.summarize(
+            "entity_description",
+            entity_or_relation_name,
+            context_base["description_list"],
+            summary_max_tokens,
+            use_prompt,
+        )
+    else:
+        summary = await use_llm_func(use_prompt, max_tokens=summary_max_tokens)
     if summary is None:
         print("entity description summary not found")
         summary = use_description
@@ -158,15 +690,16 @@ async def _handle_entity_additional_properties(
     entity_name: str,
     additional_properties: str,
     global_config: dict,
+    summarizer: _SummaryBatcher = None,
 ) -> str:
     use_llm_func: callable = global_config["llm_model_func"]
     llm_max_tokens = global_config["llm_model_max_token_size"]
     tiktoken_model_name = global_config["tiktoken_model_name"]
     summary_max_tokens = global_config["entity_additional_properties_to_max_tokens"] # 可能需要修改 entity_properties_summary_to_max_tokens
 
-    tokens = encode_string_by_tiktoken(additional_properties, model_name=tiktoken_model_name)
-    if len(tokens) < summary_max_tokens:  # No need for summary
+    if count_tokens(additional_properties) < summary_max_tokens:  # No need for summary
         return additional_properties
+    tokens = encode_string_by_tiktoken(additional_properties, model_name=tiktoken_model_name)
     prompt_template = PROMPTS["summarize_entity_additional_properties"]
     use_additional_properties = decode_tokens_by_tiktoken(
         tokens[:llm_max_tokens], model_name=tiktoken_model_name
@@ -177,7 +710,16 @@ async def _handle_entity_additional_properties(
     )
     use_prompt = prompt_template.format(**context_base)
     logger.debug(f"Trigger summary: {entity_name}")
-    summary = await use_llm_func(use_prompt, max_tokens=summary_max_tokens)
+    if summarizer is not None:
+        summary = await summarizer.summarize(
+            "entity_additional_properties",
+            entity_name,
+            context_base["additional_properties_list"],
+            summary_max_tokens,
+            use_prompt,
+        )
+    else:
+        summary = await use_llm_func(use_prompt, max_tokens=summary_max_tokens)
     if summary is None:
         print("entity additional_properties summary not found")
         summary = use_additional_properties
@@ -188,15 +730,16 @@ async def _handle_relation_summary(
     relation_name: str,
     description: str,
     global_config: dict,
+    summarizer: _SummaryBatcher = None,
 ) -> str:
     use_llm_func: callable = global_config["llm_model_func"]
     llm_max_tokens = global_config["llm_model_max_token_size"]
     tiktoken_model_name = global_config["tiktoken_model_name"]
     summary_max_tokens = global_config["relation_summary_to_max_tokens"]  # 可能需要修改  relation_summary_to_max_tokens
 
-    tokens = encode_string_by_tiktoken(description, model_name=tiktoken_model_name)
-    if len(tokens) < summary_max_tokens:  # No need for summary
+    if count_tokens(description) < summary_max_tokens:  # No need for summary
         return description
+    tokens = encode_string_by_tiktoken(description, model_name=tiktoken_model_name)
     prompt_template = PROMPTS["summarize_relation_descriptions"]
     use_description = decode_tokens_by_tiktoken(
         tokens[:llm_max_tokens], model_name=tiktoken_model_name
@@ -207,7 +750,16 @@ async def _handle_relation_summary(
     )
     use_prompt = prompt_template.format(**context_base)
     logger.debug(f"Trigger summary: {relation_name}")
-    summary = await use_llm_func(use_prompt, max_tokens=summary_max_tokens)
+    if summarizer is not None:
+        summary = await summarizer.summarize(
+            "relation_description",
+            relation_name,
+            context_base["relation_description_list"],
+            summary_max_tokens,
+            use_prompt,
+        )
+    else:
+        summary = await use_llm_func(use_prompt, max_tokens=summary_max_tokens)
     if summary is None:
         print("relation description summary not found")
         summary = use_description
@@ -218,15 +770,16 @@ async def _handle_relation_keywords_summary(
     relation_name: str,
     keywords: str,
     global_config: dict,
+    summarizer: _SummaryBatcher = None,
 ) -> str:
     use_llm_func: callable = global_config["llm_model_func"]
     llm_max_tokens = global_config["llm_model_max_token_size"]
     tiktoken_model_name = global_config["tiktoken_model_name"]
     summary_max_tokens = global_config["relation_keywords_to_max_tokens"]  # 可能需要修改relation_keywords_summary_to_max_tokens
 
-    tokens = encode_string_by_tiktoken(keywords, model_name=tiktoken_model_name)
-    if len(tokens) < summary_max_tokens:  # No need for summary
+    if count_tokens(keywords) < summary_max_tokens:  # No need for summary
         return keywords
+    tokens = encode_string_by_tiktoken(keywords, model_name=tiktoken_model_name)
     prompt_template = PROMPTS["summarize_relation_keywords"]
     use_keywords = decode_tokens_by_tiktoken(
         tokens[:llm_max_tokens], model_name=tiktoken_model_name
@@ -237,27 +790,37 @@ async def _handle_relation_keywords_summary(
     )
     use_prompt = prompt_template.format(**context_base)
     logger.debug(f"Trigger summary: {relation_name}")
-    summary = await use_llm_func(use_prompt, max_tokens=summary_max_tokens)
+    if summarizer is not None:
+        summary = await summarizer.summarize(
+            "relation_keywords",
+            relation_name,
+            context_base["keywords_list"],
+            summary_max_tokens,
+            use_prompt,
+        )
+    else:
+        summary = await use_llm_func(use_prompt, max_tokens=summary_max_tokens)
     if summary is None:
         print("relation keywords summary not found")
         summary = use_keywords
     return summary
 
-async def _handle_single_entity_extraction(
+def _handle_single_entity_extraction(
     record_attributes: list[str],
     chunk_key: str,
+    clean: callable = clean_str,
 ):
     if len(record_attributes) < 5 or record_attributes[0] != '"Entity"' :
         return None
     # add this record as a node in the G
-    entity_name = clean_str(record_attributes[1]).strip()
+    entity_name = clean(record_attributes[1]).strip()
     if not entity_name.strip():
         return None
-    entity_type = clean_str(record_attributes[2]).strip().lower()
-    entity_description = clean_str(record_attributes[3])
-    entity_url_path = clean_str(record_attributes[4]).strip()
+    entity_type = clean(record_attributes[2]).strip().lower()
+    entity_description = clean(record_attributes[3])
+    entity_url_path = clean(record_attributes[4]).strip()
     entity_source_id = chunk_key
-    entity_additional_properties = clean_str(record_attributes[5:])
+    entity_additional_properties = clean(record_attributes[5:])
 
     return dict(
         entity_name=entity_name,
@@ -269,9 +832,10 @@ async def _handle_single_entity_extraction(
     )
 
 
-async def _handle_single_relationship_extraction_low(
+def _handle_single_relationship_extraction_low(
     record_attributes: list[str],
     chunk_key: str,
+    clean: callable = clean_str,
 ):
     if len(record_attributes) < 7 or record_attributes[0] != '"Low-order Hyperedge"':
         return None
@@ -279,15 +843,15 @@ async def _handle_single_relationship_extraction_low(
     entity_num = len(record_attributes) - 4
     entities = []
     for i in range(1, entity_num):
-        entities.append(clean_str(record_attributes[i]))
-    edge_description = clean_str(record_attributes[-4])
+        entities.append(clean(record_attributes[i]))
+    edge_description = clean(record_attributes[-4])
 
-    edge_keywords = clean_str(record_attributes[-3])
+    edge_keywords = clean(record_attributes[-3])
     edge_source_id = chunk_key
     weight = (
         float(record_attributes[-2]) if is_float_regex(record_attributes[-2]) else 0.75 # 如果无权重，则默认0.75
     )
-    edge_url_paths = clean_str(record_attributes[-1]).strip() or "unknown"
+    edge_url_paths = clean(record_attributes[-1]).strip() or "unknown"
     return dict(
         entityN=entities,
         weight=weight,
@@ -298,9 +862,10 @@ async def _handle_single_relationship_extraction_low(
         level_hg="Low-order Hyperedge",
     )
 
-async def _handle_single_relationship_extraction_high(
+def _handle_single_relationship_extraction_high(
     record_attributes: list[str],
     chunk_key: str,
+    clean: callable = clean_str,
 ):
     if len(record_attributes) < 8 or record_attributes[0] != '"High-order Hyperedge"':
         return None
@@ -308,15 +873,15 @@ async def _handle_single_relationship_extraction_high(
     entity_num = len(record_attributes) - 5
     entities = []
     for i in range(1, entity_num):
-        entities.append(clean_str(record_attributes[i]))
-    edge_description = clean_str(record_attributes[-5])
-    edge_generalization = clean_str(record_attributes[-4])
-    edge_keywords = clean_str(record_attributes[-3])
+        entities.append(clean(record_attributes[i]))
+    edge_description = clean(record_attributes[-5])
+    edge_generalization = clean(record_attributes[-4])
+    edge_keywords = clean(record_attributes[-3])
     edge_source_id = chunk_key
     weight = (
         float(record_attributes[-2]) if is_float_regex(record_attributes[-2]) else 0.75
     )
-    edge_url_paths = clean_str(record_attributes[-1]).strip() or "unknown"
+    edge_url_paths = clean(record_attributes[-1]).strip() or "unknown"
     return dict(
         entityN=entities,
         weight=weight,
@@ -334,6 +899,7 @@ async def _merge_nodes_then_upsert(
     nodes_data: list[dict],
     knowledge_hypergraph_inst,
     global_config: dict,
+    summarizer: _SummaryBatcher = None,
 ):
     already_entity_types = []
     already_source_ids = []
@@ -361,8 +927,19 @@ async def _merge_nodes_then_upsert(
                     already_node["source_url_path"], [GRAPH_FIELD_SEP]
                 )
             )
-        already_description.append(already_node["description"])
-        already_additional_properties.append(already_node["additional_properties"])
+        if "summary_pending" in already_node:
+            # raw descriptions (deferred or streamed merges) are kept joined
+            already_description.extend(
+                split_string_by_multi_markers(already_node["description"], [GRAPH_FIELD_SEP])
+            )
+            already_additional_properties.extend(
+                split_string_by_multi_markers(
+                    already_node["additional_properties"], [GRAPH_FIELD_SEP]
+                )
+            )
+        else:
+            already_description.append(already_node["description"])
+            already_additional_properties.append(already_node["additional_properties"])
 
     entity_type = sorted(
         Counter(
@@ -405,19 +982,37 @@ async def _merge_nodes_then_upsert(
     ]
     existing_urls = [clean_str(url).strip() for url in already_source_url_paths if url]
     source_url_path = GRAPH_FIELD_SEP.join(sorted(set(node_urls + existing_urls))) or "unknown"
-    description = await _handle_entity_summary(
-        entity_name, description, global_config
-    )
-    additional_properties = await _handle_entity_additional_properties(  # 应该新建一个合并附属信息的函数，以及prompt
-        entity_name, additional_properties, global_config
-    )
+    summary_pending = None
+    if global_config.get("summary_mode", "eager") == "deferred":
+        # keep the raw descriptions until the vertex is first retrieved
+        summary_max_tokens = global_config["entity_summary_to_max_tokens"]
+        description_tokens = count_tokens(description)
+        summary_pending = (
+            description_tokens >= summary_max_tokens
+            or count_tokens(additional_properties)
+            >= global_config["entity_additional_properties_to_max_tokens"]
+        )
+        description_tokens = min(description_tokens, summary_max_tokens)
+    else:
+        description, additional_properties = await asyncio.gather(
+            _handle_entity_summary(entity_name, description, global_config, summarizer),
+            _handle_entity_additional_properties(  # 应该新建一个合并附属信息的函数，以及prompt
+                entity_name, additional_properties, global_config, summarizer
+            ),
+        )
+        description_tokens = count_tokens(description)
+        if already_node is not None and "summary_pending" in already_node:
+            summary_pending = False
     node_data = dict(
         entity_type=entity_type,
         description=description,
+        description_tokens=description_tokens,
         source_id=source_id,
         source_url_path=source_url_path,
         additional_properties=additional_properties,
     )
+    if summary_pending is not None:
+        node_data["summary_pending"] = summary_pending
     await knowledge_hypergraph_inst.upsert_vertex(
         entity_name,
         node_data,
@@ -431,6 +1026,7 @@ async def _merge_edges_then_upsert(
     edges_data: list[dict],
     knowledge_hypergraph_inst,
     global_config: dict,
+    summarizer: _SummaryBatcher = None,
 ):
     already_weights = []
     already_source_ids = []
@@ -439,13 +1035,19 @@ async def _merge_edges_then_upsert(
     already_keywords = []
     already_generalizations = []
 
+    already_edge = None
     if await knowledge_hypergraph_inst.has_hyperedge(id_set):
         already_edge = await knowledge_hypergraph_inst.get_hyperedge(id_set)
         already_weights.append(already_edge["weight"])
         already_source_ids.extend(
             split_string_by_multi_markers(already_edge["source_id"], [GRAPH_FIELD_SEP])
         )
-        already_description.append(already_edge.get("description", ""))
+        if "summary_pending" in already_edge:
+            already_description.extend(
+                split_string_by_multi_markers(already_edge["description"], [GRAPH_FIELD_SEP])
+            )
+        else:
+            already_description.append(already_edge.get("description", ""))
         already_keywords.extend(
             split_string_by_multi_markers(already_edge.get("keywords", ""), [GRAPH_FIELD_SEP])
         )
@@ -508,25 +1110,42 @@ async def _merge_edges_then_upsert(
                     "entity_type": "UNKNOWN",
                 },
             )
-    description = await _handle_relation_summary(  # 应该重新写一个针对超边描述进行合并的函数
-        id_set, description, global_config
-    )
-
-    filter_keywords = await _handle_relation_keywords_summary(  # 应该重新写一个针对超边的关键词进行合并的函数
-        id_set, keywords, global_config
-    )
+    summary_pending = None
+    if global_config.get("summary_mode", "eager") == "deferred":
+        # keep the raw descriptions until the hyperedge is first retrieved
+        summary_max_tokens = global_config["relation_summary_to_max_tokens"]
+        description_tokens = count_tokens(description)
+        summary_pending = (
+            description_tokens >= summary_max_tokens
+            or count_tokens(keywords) >= global_config["relation_keywords_to_max_tokens"]
+        )
+        description_tokens = min(description_tokens, summary_max_tokens)
+        filter_keywords = keywords
+    else:
+        description, filter_keywords = await asyncio.gather(
+            _handle_relation_summary(  # 应该重新写一个针对超边描述进行合并的函数
+                id_set, description, global_config, summarizer
+            ),
+            _handle_relation_keywords_summary(  # 应该重新写一个针对超边的关键词进行合并的函数
+                id_set, keywords, global_config, summarizer
+            ),
+        )
+        description_tokens = count_tokens(description)
+        if already_edge is not None and "summary_pending" in already_edge:
+            summary_pending = False
 
-    await knowledge_hypergraph_inst.upsert_hyperedge(
-        id_set,
-        dict(
-            description=description,
-            keywords=filter_keywords,
-            generalization=generalization,
-            source_id=source_id,
-            source_url_path=source_url_path,
-            weight=weight
-        ),
+    edge_record = dict(
+        description=description,
+        description_tokens=description_tokens,
+        keywords=filter_keywords,
+        generalization=generalization,
+        source_id=source_id,
+        source_url_path=source_url_path,
+        weight=weight
     )
+    if summary_pending is not None:
+        edge_record["summary_pending"] = summary_pending
+    await knowledge_hypergraph_inst.upsert_hyperedge(id_set, edge_record)
 
     edge_data = dict(
         id_set=id_set,
@@ -539,23 +1158,524 @@ async def _merge_edges_then_upsert(
     return edge_data
 
 
+@dataclass
+class _StreamingMerger:
+    """
+    Merges extracted records into the hypergraph while extraction is still
+    running. Records that arrive during a merge round wait for the next one.
+    A hyperedge waits until all of its entities were merged in this run, so
+    it does not create placeholder vertices for entities extracted later.
+    The rounds keep descriptions raw, as ``summary_mode="deferred"`` does;
+    in eager mode every touched record is summarized once on ``close``
+    instead of again in each round that merges into it.
+    """
+
+    knowledge_hypergraph_inst: BaseHypergraphStorage
+    global_config: dict
+    summarizer: _SummaryBatcher = None
+    nodes: dict = field(default_factory=dict)
+    edges: dict = field(default_factory=dict)
+    _pending_nodes: dict = field(default_factory=lambda: defaultdict(list))
+    _pending_edges: dict = field(default_factory=lambda: defaultdict(list))
+    _wakeup: asyncio.Event = None
+    _task: asyncio.Task = None
+    _closed: bool = False
+
+    def __post_init__(self):
+        self._eager = self.global_config.get("summary_mode", "eager") != "deferred"
+        self._round_config = {**self.global_config, "summary_mode": "deferred"}
+
+    def add(self, maybe_nodes: dict, maybe_edges: dict):
+        for k, v in maybe_nodes.items():
+            self._pending_nodes[k].extend(v)
+        for k, v in maybe_edges.items():
+            self._pending_edges[tuple(sorted(k))].extend(v)
+        if not (maybe_nodes or maybe_edges):
+            return
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.ensure_future(self._run())
+        self._wakeup.set()
+
+    async def _run(self):
+        while not self._closed:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            await self._merge_round()
+
+    async def _merge_round(self, final: bool = False):
+        nodes, self._pending_nodes = self._pending_nodes, defaultdict(list)
+        merged = await asyncio.gather(
+            *[
+                _merge_nodes_then_upsert(
+                    k, v, self.knowledge_hypergraph_inst, self._round_config, self.summarizer
+                )
+                for k, v in nodes.items()
+            ]
+        )
+        self.nodes.update((dp["entity_name"], dp) for dp in merged)
+        ready = [
+            k for k in self._pending_edges if final or all(v in self.nodes for v in k)
+        ]
+        merged = await asyncio.gather(
+            *[
+                _merge_edges_then_upsert(
+                    k,
+                    self._pending_edges.pop(k),
+                    self.knowledge_hypergraph_inst,
+                    self._round_config,
+                    self.summarizer,
+                )
+                for k in ready
+            ]
+        )
+        self.edges.update((dp["id_set"], dp) for dp in merged)
+
+    async def close(self):
+        self._closed = True
+        if self._task is not None:
+            self._wakeup.set()
+            await self._task
+        await self._merge_round(final=True)
+        if not self._eager:
+            return
+        await summarize_pending_records(
+            self.knowledge_hypergraph_inst,
+            self.global_config,
+            list(self.nodes),
+            list(self.edges),
+            self.summarizer,
+        )
+        for name, dp in self.nodes.items():
+            if dp.get("summary_pending"):
+                data = await self.knowledge_hypergraph_inst.get_vertex(name)
+                for key in ("description", "description_tokens", "additional_properties"):
+                    dp[key] = data[key]
+                dp["summary_pending"] = False
+        for id_set, dp in self.edges.items():
+            data = await self.knowledge_hypergraph_inst.get_hyperedge(id_set)
+            dp["description"], dp["keywords"] = data["description"], data["keywords"]
+
+
+# summaries in flight per (storage, kind, record), shared by every caller
+_PENDING_SUMMARIES: dict = {}
+_PENDING_SUMMARY_ROUNDS = 3
+
+
+async def summarize_pending_records(
+    knowledge_hypergraph_inst: BaseHypergraphStorage,
+    global_config: dict,
+    vertex_ids: list = None,
+    hyperedge_ids: list = None,
+    summarizer: _SummaryBatcher = None,
+) -> int:
+    """
+    Summarize the descriptions that ``summary_mode="deferred"`` left raw and
+    write them back. All pending vertices and hyperedges are handled when the
+    ids are omitted. Returns the number of records summarized.
+
+    A record is summarized by one task at a time and the summary is only
+    written if no merge touched the record meanwhile; otherwise the fresh
+    descriptions are summarized again, and after a few lost rounds the record
+    stays pending for the next pass.
+    """
+    if vertex_ids is None:
+        vertex_ids = list(await knowledge_hypergraph_inst.get_all_vertices())
+    if hyperedge_ids is None:
+        hyperedge_ids = list(await knowledge_hypergraph_inst.get_all_hyperedges())
+    if summarizer is None:
+        summarizer = _make_summarizer(global_config)
+
+    async def _summarize_vertex(v_id) -> int:
+        for _ in range(_PENDING_SUMMARY_ROUNDS):
+            data = await knowledge_hypergraph_inst.get_vertex(v_id)
+            if not data or not data.get("summary_pending"):
+                return 0
+            raw = (data["description"], data["additional_properties"])
+            description, additional_properties = await asyncio.gather(
+                _handle_entity_summary(v_id, raw[0], global_config, summarizer),
+                _handle_entity_additional_properties(
+                    v_id, raw[1], global_config, summarizer
+                ),
+            )
+            data = await knowledge_hypergraph_inst.get_vertex(v_id)
+            if not data or not data.get("summary_pending"):
+                return 0
+            if (data["description"], data["additional_properties"]) != raw:
+                continue
+            await knowledge_hypergraph_inst.upsert_vertex(
+                v_id,
+                dict(
+                    description=description,
+                    description_tokens=count_tokens(description),
+                    additional_properties=additional_properties,
+                    summary_pending=False,
+                ),
+            )
+            return 1
+        return 0
+
+    async def _summarize_hyperedge(e_tuple) -> int:
+        id_set = tuple(sorted(e_tuple))
+        for _ in range(_PENDING_SUMMARY_ROUNDS):
+            data = await knowledge_hypergraph_inst.get_hyperedge(e_tuple)
+            if not data or not data.get("summary_pending"):
+                return 0
+            raw = (data["description"], data["keywords"])
+            description, keywords = await asyncio.gather(
+                _handle_relation_summary(id_set, raw[0], global_config, summarizer),
+                _handle_relation_keywords_summary(
+                    id_set, raw[1], global_config, summarizer
+                ),
+            )
+            data = await knowledge_hypergraph_inst.get_hyperedge(e_tuple)
+            if not data or not data.get("summary_pending"):
+                return 0
+            if (data["description"], data["keywords"]) != raw:
+                continue
+            await knowledge_hypergraph_inst.upsert_hyperedge(
+                e_tuple,
+                dict(
+                    description=description,
+                    description_tokens=count_tokens(description),
+                    keywords=keywords,
+                    summary_pending=False,
+                ),
+            )
+            return 1
+        return 0
+
+    async def _once(key, summarize) -> int:
+        key = (id(knowledge_hypergraph_inst), *key)
+        task = _PENDING_SUMMARIES.get(key)
+        if task is None:
+            task = asyncio.ensure_future(summarize())
+            _PENDING_SUMMARIES[key] = task
+            task.add_done_callback(lambda _: _PENDING_SUMMARIES.pop(key, None))
+        # a cancelled caller must not cancel the summary other callers share
+        return await asyncio.shield(task)
+
+    counts = await asyncio.gather(
+        *[
+            _once(("vertex", v_id), lambda v_id=v_id: _summarize_vertex(v_id))
+            for v_id in vertex_ids
+        ],
+        *[
+            _once(
+                ("hyperedge", tuple(sorted(e_tuple))),
+                lambda e_tuple=e_tuple: _summarize_hyperedge(e_tuple),
+            )
+            for e_tuple in hyperedge_ids
+        ],
+    )
+    return sum(counts)
+
+
+async def _summarize_pending_context(
+    context: QueryContext, knowledge_hypergraph_inst: BaseHypergraphStorage, global_config: dict
+) -> QueryContext:
+    # deferred summaries are produced the first time a record reaches a context
+    if global_config.get("summary_mode", "eager") != "deferred" or context is None:
+        return context
+    if not await summarize_pending_records(
+        knowledge_hypergraph_inst,
+        global_config,
+        [n["entity_name"] for n in context.entities],
+        [e["entity_set"] for e in context.hyperedges],
+    ):
+        return context
+    for entity in context.entities:
+        data = await knowledge_hypergraph_inst.get_vertex(entity["entity_name"]) or {}
+        entity["description"] = data.get("description", entity["description"])
+        entity["additional_properties"] = data.get(
+            "additional_properties", entity["additional_properties"]
+        )
+    for hyperedge in context.hyperedges:
+        data = await knowledge_hypergraph_inst.get_hyperedge(hyperedge["entity_set"]) or {}
+        hyperedge["description"] = data.get("description", hyperedge["description"])
+        hyperedge["keywords"] = data.get("keywords", hyperedge["keywords"])
+    return context
+
+
+_RECORD_BODY = re.compile(r"\((.*)\)")
+_RECORD_HANDLERS = {
+    '"Entity"': _handle_single_entity_extraction,
+    '"Low-order Hyperedge"': _handle_single_relationship_extraction_low,
+    '"High-order Hyperedge"': _handle_single_relationship_extraction_high,
+}
+
+
+@lru_cache(maxsize=16)
+def _extraction_delimiter_patterns(
+    tuple_delimiter: str, record_delimiter: str, completion_delimiter: str
+) -> tuple[re.Pattern, re.Pattern]:
+    return (
+        re.compile(f"{re.escape(record_delimiter)}|{re.escape(completion_delimiter)}"),
+        re.compile(re.escape(tuple_delimiter)),
+    )
+
+
+_NEEDS_CLEANING = re.compile(r"[&\x00-\x1f\x7f-\x9f]")
+
+
+def _keep(value):
+    return value
+
+
+def _iter_extraction_records(result: str, context_base: dict):
+    """
+    Yield the stripped, non-empty attributes of every ``(...)`` record with
+    the function that cleans them: ``clean_str``, or a no-op when the record
+    has no HTML escapes or control characters. JSON answers are laid out
+    the same way, record by record.
+    """
+    if context_base.get("extraction_format") == "json":
+        for section, record in JsonRecordStream().feed(result):
+            attributes = _json_record_attributes(section, record)
+            if attributes is not None:
+                yield attributes, clean_str
+        return
+    record_pattern, tuple_pattern = _extraction_delimiter_patterns(
+        context_base["tuple_delimiter"],
+        context_base["record_delimiter"],
+        context_base["completion_delimiter"],
+    )
+    search = _RECORD_BODY.search
+    split = tuple_pattern.split
+    needs_cleaning = _NEEDS_CLEANING.search
+    for record in record_pattern.split(result):
+        body = search(record)
+        if body is not None:
+            body = body.group(1)
+            yield (
+                [a for a in map(str.strip, split(body)) if a],
+                clean_str if needs_cleaning(body) else _keep,
+            )
+
+
+class _ExtractionRecordStream:
+    """
+    Splits an extraction answer into records while it streams in. ``feed``
+    returns the records whose text is complete; ``complete`` turns true once
+    the completion delimiter arrives, after which the rest can be dropped.
+    """
+
+    def __init__(self, context_base: dict):
+        self._context_base = context_base
+        self._json = (
+            JsonRecordStream() if context_base.get("extraction_format") == "json" else None
+        )
+        self._buffer = ""
+        self.complete = False
+
+    def feed(self, delta: str) -> list:
+        if self._json is not None:
+            return [
+                (attributes, clean_str)
+                for attributes in (
+                    _json_record_attributes(section, record)
+                    for section, record in self._json.feed(delta)
+                )
+                if attributes is not None
+            ]
+        self._buffer += delta
+        end = self._buffer.find(self._context_base["completion_delimiter"])
+        if end >= 0:
+            self.complete = True
+            text, self._buffer = self._buffer[:end], ""
+        else:
+            end = self._buffer.rfind(self._context_base["record_delimiter"])
+            if end < 0:
+                return []
+            text, self._buffer = self._buffer[:end], self._buffer[end:]
+        return list(_iter_extraction_records(text, self._context_base))
+
+    def close(self) -> list:
+        text, self._buffer = self._buffer, ""
+        if not text or self._json is not None:
+            return []
+        return list(_iter_extraction_records(text, self._context_base))
+
+
+# deltas read after the completion delimiter before the stream is cut off
+_STREAM_DRAIN_DELTAS = 32
+
+
+async def _read_extraction_stream(response, context_base: dict, on_records) -> str:
+    """
+    Read a streamed (or plain string) extraction answer, passing records to
+    ``on_records`` as their text completes. After the completion delimiter
+    the stream is read on to its end, so that the LLM function caches the
+    answer, unless the model keeps generating; then reading stops, which
+    cuts the generation off (and leaves the answer uncached).
+    """
+    records = _ExtractionRecordStream(context_base)
+    if isinstance(response, str):
+        on_records(records.feed(response) + records.close())
+        return response
+    contents = []
+    answer_deltas = None
+    try:
+        async for delta in response:
+            if answer_deltas is None:
+                contents.append(delta)
+                on_records(records.feed(delta))
+                if records.complete:
+                    answer_deltas = len(contents)
+            elif len(contents) - answer_deltas >= _STREAM_DRAIN_DELTAS:
+                break
+            else:
+                contents.append(delta)
+    finally:
+        close = getattr(response, "aclose", None)
+        if close is not None:
+            await close()
+    on_records(records.close())
+    return "".join(contents[:answer_deltas])
+
+
+def _parse_extraction_result(result: str, chunk_key: str, context_base: dict):
+    """
+    Parse one extraction answer in a single pass into entities, all
+    hyperedges, low-order and high-order hyperedges, keyed like the merges.
+    """
+    return _parse_extraction_records(_iter_extraction_records(result, context_base), chunk_key)
+
+
+def _parse_extraction_records(records, chunk_key: str):
+    maybe_nodes = defaultdict(list)
+    maybe_edges = defaultdict(list)
+    maybe_edges_low = defaultdict(list)
+    maybe_edges_high = defaultdict(list)
+    for record_attributes, clean in records:
+        handler = _RECORD_HANDLERS.get(record_attributes[0]) if record_attributes else None
+        if handler is None:
+            continue
+        parsed = handler(record_attributes, chunk_key, clean)
+        if parsed is None:
+            continue
+        if handler is _handle_single_entity_extraction:
+            maybe_nodes[parsed["entity_name"]].append(parsed)
+            continue
+        key = tuple(parsed["entityN"])
+        maybe_edges[key].append(parsed)
+        if handler is _handle_single_relationship_extraction_low:
+            maybe_edges_low[key].append(parsed)
+        else:
+            maybe_edges_high[key].append(parsed)
+    return maybe_nodes, maybe_edges, maybe_edges_low, maybe_edges_high
+
+
+def _extracted_entity_names(result: str, context_base: dict) -> set[str]:
+    names = set()
+    for attributes, clean in _iter_extraction_records(result, context_base):
+        if len(attributes) >= 5 and attributes[0] == '"Entity"':
+            names.add(clean(attributes[1]).strip())
+    return names - {""}
+
+
+@dataclass
+class _AdaptiveGleaning:
+    """
+    Decides per chunk whether another gleaning round is worth its LLM call.
+    A chunk is gleaned when it has at least ``min_tokens`` tokens and the
+    expected number of new entities reaches ``min_yield``. The expectation is
+    the decayed average gain per gleaning round of this insert, with a prior
+    of one round that gained ``min_yield``, scaled up for chunks whose first
+    pass found fewer entities per token than the insert's average. The first
+    ``warmup`` rounds always run so the average has data, and every
+    ``explore_every``-th skipped chunk is gleaned anyway so that an average
+    that dropped below ``min_yield`` can recover. Totals go to ``stats``.
+    """
+
+    min_tokens: int = 100
+    min_yield: float = 0.5
+    warmup: int = 4
+    explore_every: int = 8
+    decay: float = 0.9
+    stats: Counter = field(default_factory=Counter)
+    _gain: float = 0.0
+    _rounds: float = 0.0
+    _observed: int = 0
+    _skipped: int = 0
+    _first_pass_tokens: int = 0
+    _first_pass_entities: int = 0
+
+    def record_first_pass(self, tokens: int, entities: int):
+        self.stats["first_pass_tokens"] += tokens
+        self.stats["first_pass_entities"] += entities
+        self._first_pass_tokens += tokens
+        self._first_pass_entities += entities
+
+    def record_round(self, new_entities: int):
+        self.stats["gleaning_rounds"] += 1
+        self.stats["gleaned_entities"] += new_entities
+        self._gain = self.decay * self._gain + new_entities
+        self._rounds = self.decay * self._rounds + 1
+        self._observed += 1
+
+    def should_glean(self, tokens: int, entities: int) -> bool:
+        if tokens < self.min_tokens:
+            return False
+        if self._observed < self.warmup:
+            return True
+        expected = (self._gain + self.min_yield) / (self._rounds + 1)
+        run_density = self._first_pass_entities / max(self._first_pass_tokens, 1)
+        density = entities / max(tokens, 1)
+        if density < run_density:
+            expected *= (run_density / max(density, 1e-9)) ** 0.5
+        if expected >= self.min_yield:
+            return True
+        self._skipped += 1
+        return self._skipped % self.explore_every == 0
+
+
 async def extract_entities(
     chunks: dict[str, TextChunkSchema],
     knowledge_hypergraph_inst: BaseHypergraphStorage,
     entity_vdb: BaseVectorStorage,
     relationships_vdb: BaseVectorStorage,
     global_config: dict,
+    chunk_signatures: BaseKVStorage = None,
+    near_duplicate_index: MinHashLSH = None,
+    stats: Counter = None,
 ) -> BaseHypergraphStorage | None:
+    """
+    When ``chunk_signatures`` and ``near_duplicate_index`` are given, chunks
+    whose MinHash signature matches an already extracted chunk reuse its raw
+    extraction output instead of calling the LLM; the records are still
+    attributed to the new chunk. Counts go to ``stats``.
+
+    With ``entity_extract_streaming`` the answers are requested with
+    ``stream=True``, their records are parsed as they arrive and merged into
+    the hypergraph while other chunks are still being extracted.
+    """
     use_llm_func: callable = global_config["llm_model_func"]
     entity_extract_max_gleaning = global_config["entity_extract_max_gleaning"]
+    streaming = global_config.get("entity_extract_streaming", False)
 
     ordered_chunks = list(chunks.items())
 
     template_data = _prepare_entity_extraction_templates(global_config)
-    entity_extract_prompt = template_data["entity_extract_prompt"]
     context_base = template_data["context_base"]
     continue_prompt = template_data["continue_prompt"]
     if_loop_prompt = template_data["if_loop_prompt"]
+    llm_kwargs = template_data["llm_kwargs"]
+
+    gleaning = None
+    if global_config.get("entity_extract_gleaning_policy", "always") == "adaptive":
+        gleaning = _AdaptiveGleaning(
+            min_tokens=global_config.get("entity_extract_gleaning_min_tokens", 100),
+            min_yield=global_config.get("entity_extract_gleaning_min_yield", 0.5),
+            stats=Counter() if stats is None else stats,
+        )
+
+    summarizer = _make_summarizer(global_config, stats)
+    merger = (
+        _StreamingMerger(knowledge_hypergraph_inst, global_config, summarizer)
+        if streaming
+        else None
+    )
 
     already_processed = 0
     already_entities = 0
@@ -563,80 +1683,158 @@ async def extract_entities(
     already_relations_low = 0
     already_relations_high = 0
 
-    async def _process_single_content(chunk_key_dp: tuple[str, TextChunkSchema]):
-        nonlocal already_processed, already_entities, already_relations, already_relations_low, already_relations_high
-        chunk_key = chunk_key_dp[0]
-        chunk_dp = chunk_key_dp[1]
-        content = chunk_dp["content"]
-        hint_prompt = entity_extract_prompt.format(**context_base, input_text=content)
-
-        final_result = await use_llm_func(hint_prompt)
+    async def _complete(prompt: str, on_records, **kwargs) -> str:
+        if not streaming:
+            return await use_llm_func(prompt, **kwargs)
+        response = await use_llm_func(prompt, stream=True, **kwargs)
+        if response is None:
+            return None
+        return await _read_extraction_stream(response, context_base, on_records)
+
+    async def _run_extraction(batch: list[tuple[str, TextChunkSchema]]) -> dict:
+        hint_prompt = _format_extraction_prompt(batch, template_data)
+        parsed = None
+        if streaming and len(batch) == 1:
+            # records of batched prompts are attributed once the answer is complete
+            parsed = tuple(defaultdict(list) for _ in range(4))
+
+        def on_records(records):
+            if parsed is None:
+                return
+            new = _parse_extraction_records(records, batch[0][0])
+            for collected, part in zip(parsed, new):
+                for k, v in part.items():
+                    collected[k].extend(v)
+            merger.add(new[0], new[1])
+
+        final_result = await _complete(hint_prompt, on_records, **llm_kwargs)
+        llm_calls = 1
         if final_result is None:
-            return None,None,None,None
+            return {chunk_key: (None, llm_calls / len(batch), None) for chunk_key, _ in batch}
 
+        responses = [final_result]
         history = pack_user_ass_to_openai_messages(hint_prompt, final_result)
+        if gleaning is not None:
+            tokens = sum(dp.get("tokens") or count_tokens(dp["content"]) for _, dp in batch)
+            entity_names = _extracted_entity_names(final_result, context_base)
+            gleaning.record_first_pass(tokens, len(entity_names))
         for now_glean_index in range(entity_extract_max_gleaning):
-            glean_result = await use_llm_func(continue_prompt, history_messages=history)
+            if gleaning is not None and not gleaning.should_glean(tokens, len(entity_names)):
+                break
+            glean_result = await _complete(
+                continue_prompt, on_records, history_messages=history, **llm_kwargs
+            )
+            llm_calls += 1
             if glean_result is None:
                 break
 
             history += pack_user_ass_to_openai_messages(continue_prompt, glean_result)
+            responses.append(glean_result)
             final_result += glean_result
+            if gleaning is not None:
+                new_names = _extracted_entity_names(glean_result, context_base) - entity_names
+                entity_names |= new_names
+                gleaning.record_round(len(new_names))
             if now_glean_index == entity_extract_max_gleaning - 1:
                 break
 
+            if gleaning is not None:
+                # a round that found nothing new replaces the if-loop question
+                if not new_names:
+                    break
+                continue
+
             if_loop_result: str = await use_llm_func(
                 if_loop_prompt, history_messages=history
             )
+            llm_calls += 1
             if_loop_result = if_loop_result.strip().strip('"').strip("'").lower()
             if if_loop_result != "yes":
                 break
+        if gleaning is not None and entity_extract_max_gleaning:
+            # against the fixed policy's maximum of a continue call per round
+            # and an if-loop call between rounds
+            gleaning.stats["gleaning_calls_saved"] += 2 * entity_extract_max_gleaning - llm_calls
+        if len(batch) == 1:
+            return {batch[0][0]: (final_result, llm_calls, parsed)}
+        parts = defaultdict(str)
+        for response in responses:
+            for index, text in _split_batch_response(response, len(batch)).items():
+                parts[index] += text
+        results = {
+            chunk_key: (parts[index], llm_calls / len(batch), None)
+            for index, (chunk_key, _) in enumerate(batch, start=1)
+            if index in parts
+        }
+        missing = [item for index, item in enumerate(batch, start=1) if index not in parts]
+        if missing:
+            # the answer lost or garbled the markers of these chunks
+            logger.warning(
+                f"No chunk marker for {len(missing)} of {len(batch)} batched chunks, "
+                "extracting them one by one"
+            )
+            for retried in await asyncio.gather(*[_run_extraction([item]) for item in missing]):
+                for chunk_key, (result, calls, chunk_parsed) in retried.items():
+                    results[chunk_key] = (result, calls + llm_calls / len(batch), chunk_parsed)
+        return {chunk_key: results[chunk_key] for chunk_key, _ in batch}
 
-        records = split_string_by_multi_markers(
-            final_result,
-            [context_base["record_delimiter"], context_base["completion_delimiter"]],
+    # ----------------------------------------------------------------------------
+    # near-duplicate chunks reuse the extraction of an earlier chunk
+    signatures, duplicate_of, reused = {}, {}, {}
+    if chunk_signatures is not None and near_duplicate_index is not None:
+        batch_index = MinHashLSH(
+            bands=near_duplicate_index.bands, threshold=near_duplicate_index.threshold
         )
+        for chunk_key, chunk_dp in ordered_chunks:
+            signatures[chunk_key] = minhash_signature(chunk_dp["content"])
+            matches = [
+                m
+                for m in (
+                    near_duplicate_index.query(signatures[chunk_key]),
+                    batch_index.query(signatures[chunk_key]),
+                )
+                if m is not None and m[0] != chunk_key
+            ]
+            if matches:
+                duplicate_of[chunk_key] = max(matches, key=lambda m: m[1])[0]
+            else:
+                batch_index.insert(chunk_key, signatures[chunk_key])
+        source_keys = list(set(duplicate_of.values()))
+        for key, record in zip(source_keys, await chunk_signatures.get_by_ids(source_keys)):
+            if record is not None and record.get("extraction") is not None:
+                reused[key] = (record["extraction"], record.get("llm_calls", 1))
+        duplicate_of = {
+            k: v
+            for k, v in duplicate_of.items()
+            if v in reused or (v in chunks and v not in duplicate_of)
+        }
 
-        maybe_nodes = defaultdict(list)
-        maybe_edges = defaultdict(list)
-        maybe_edges_low = defaultdict(list)
-        maybe_edges_high = defaultdict(list)
-        for record in records:
-            record = re.search(r"\((.*)\)", record)
-            if record is None:
-                continue
-            record = record.group(1)
-            record_attributes = split_string_by_multi_markers(
-                record, [context_base["tuple_delimiter"]]
-            )
-            if_entities = await _handle_single_entity_extraction(
-                record_attributes, chunk_key
-            )
-            if if_entities is not None:
-                maybe_nodes[if_entities["entity_name"]].append(if_entities)
-                continue
+    extractions = {}
+    for batch in _pack_extraction_batches(
+        [c for c in ordered_chunks if c[0] not in duplicate_of], global_config
+    ):
+        task = asyncio.ensure_future(_run_extraction(batch))
+        extractions.update((chunk_key, task) for chunk_key, _ in batch)
+    raw_results = {}
 
-            if_relation = await _handle_single_relationship_extraction_low(
-                record_attributes, chunk_key
-            )
-            if if_relation is not None:
-                maybe_edges[tuple((if_relation["entityN"]))].append(
-                    if_relation
-                )
-                maybe_edges_low[tuple((if_relation["entityN"]))].append(
-                    if_relation
-                )
+    async def _process_single_content(chunk_key_dp: tuple[str, TextChunkSchema]):
+        nonlocal already_processed, already_entities, already_relations, already_relations_low, already_relations_high
+        chunk_key = chunk_key_dp[0]
+        source_key = duplicate_of.get(chunk_key, chunk_key)
+        parsed = None
+        if source_key in reused:
+            final_result, llm_calls = reused[source_key]
+        else:
+            final_result, llm_calls, parsed = (await extractions[source_key])[source_key]
+        raw_results[chunk_key] = (final_result, llm_calls)
+        if final_result is None:
+            return None,None,None,None
 
-            if_relation = await _handle_single_relationship_extraction_high(
-                record_attributes, chunk_key
-            )
-            if if_relation is not None:
-                maybe_edges[tuple((if_relation["entityN"]))].append(
-                    if_relation
-                )
-                maybe_edges_high[tuple((if_relation["entityN"]))].append(
-                    if_relation
-                )
+        if parsed is None or source_key != chunk_key:
+            parsed = _parse_extraction_result(final_result, chunk_key, context_base)
+            if merger is not None:
+                merger.add(parsed[0], parsed[1])
+        maybe_nodes, maybe_edges, maybe_edges_low, maybe_edges_high = parsed
 
         already_processed += 1
         already_entities += len(maybe_nodes)
@@ -669,6 +1867,29 @@ async def extract_entities(
     results = await asyncio.gather(
         *[_process_single_content(c) for c in ordered_chunks ]
     )
+
+    if signatures:
+        await chunk_signatures.upsert(
+            {
+                chunk_key: {
+                    "signature": signatures[chunk_key],
+                    "extraction": final_result,
+                    "llm_calls": llm_calls,
+                }
+                for chunk_key, (final_result, llm_calls) in raw_results.items()
+            }
+        )
+        for chunk_key in raw_results:
+            near_duplicate_index.insert(chunk_key, signatures[chunk_key])
+        llm_calls_saved = round(sum(raw_results[k][1] for k in duplicate_of))
+        if stats is not None:
+            stats["chunks"] += len(ordered_chunks)
+            stats["near_duplicate_chunks"] += len(duplicate_of)
+            stats["llm_calls_saved"] += llm_calls_saved
+        logger.info(
+            f"[Near Duplicates] {len(duplicate_of)} of {len(ordered_chunks)} chunks "
+            f"reused an earlier extraction, {llm_calls_saved} LLM calls saved"
+        )
     
     # print()  # clear the progress bar
     maybe_nodes = defaultdict(list)
@@ -694,19 +1915,29 @@ async def extract_entities(
     """
         update the hypergraph database
     """
-    all_entities_data = await asyncio.gather(
-        *[
-            _merge_nodes_then_upsert(k, v, knowledge_hypergraph_inst, global_config)
-            for k, v in maybe_nodes.items()
-        ]
-    )
+    if merger is not None:
+        # the records were merged while extraction was running
+        await merger.close()
+        all_entities_data = list(merger.nodes.values())
+        all_relationships_data = list(merger.edges.values())
+    else:
+        all_entities_data = await asyncio.gather(
+            *[
+                _merge_nodes_then_upsert(
+                    k, v, knowledge_hypergraph_inst, global_config, summarizer
+                )
+                for k, v in maybe_nodes.items()
+            ]
+        )
 
-    all_relationships_data = await asyncio.gather(
-        *[
-            _merge_edges_then_upsert(k, v, knowledge_hypergraph_inst, global_config)
-            for k, v in maybe_edges.items()
-        ]
-    )
+        all_relationships_data = await asyncio.gather(
+            *[
+                _merge_edges_then_upsert(
+                    k, v, knowledge_hypergraph_inst, global_config, summarizer
+                )
+                for k, v in maybe_edges.items()
+            ]
+        )
     if not len(all_entities_data):
         logger.warning("Didn't extract any entities, maybe your LLM is not working")
         return None
@@ -741,81 +1972,244 @@ async def extract_entities(
     return knowledge_hypergraph_inst
 
 
-async def _build_entity_query_context(
-    query,
+def _label_propagation(arrays: dict, max_iterations: int = 10) -> list[int]:
+    """
+    Weighted label propagation over the vertex-hyperedge incidence. Every vertex
+    adopts the label with the largest vote from its hyperedges, a hyperedge voting
+    for the labels of its other members with its weight spread across them.
+
+    Works on a snapshot of ``HypergraphIncidenceIndex.arrays()`` only, so that it
+    can run in a worker thread while inserts and queries go on.
+    """
+    num_v, num_e = len(arrays["v_degree"]), len(arrays["e_degree"])
+    members = [[] for _ in range(num_e)]
+    incident = [[] for _ in range(num_v)]
+    for v_pos, e_pos in zip(arrays["inc_v"].tolist(), arrays["inc_e"].tolist()):
+        members[e_pos].append(v_pos)
+        incident[v_pos].append(e_pos)
+    edge_weight = arrays["edge_weight"].tolist()
+
+    labels = list(range(num_v))
+    for _ in range(max_iterations):
+        changed = 0
+        for v_pos in range(num_v):
+            votes = defaultdict(float)
+            for e_pos in incident[v_pos]:
+                share = edge_weight[e_pos] / max(len(members[e_pos]) - 1, 1)
+                for u_pos in members[e_pos]:
+                    if u_pos != v_pos:
+                        votes[labels[u_pos]] += share
+            if not votes:
+                continue
+            best = max(votes.items(), key=lambda x: (x[1], -x[0]))[0]
+            if best != labels[v_pos]:
+                labels[v_pos] = best
+                changed += 1
+        if not changed:
+            break
+    return labels
+
+
+async def build_communities(
     knowledge_hypergraph_inst: BaseHypergraphStorage,
-    entities_vdb: BaseVectorStorage,
-    text_chunks_db: BaseKVStorage[TextChunkSchema],
-    query_param: QueryParam,
+    community_reports: BaseKVStorage,
+    communities_vdb: BaseVectorStorage,
+    global_config: dict,
 ):
-    results = await entities_vdb.query(query, top_k=query_param.top_k)
-    if not len(results):
-        return None
-    node_datas = await asyncio.gather(
-        *[knowledge_hypergraph_inst.get_vertex(r["entity_name"]) for r in results]
-    )
+    """
+    Partition the hypergraph into communities and store an LLM-written report for
+    each of them. Reports are keyed by the community content, so only communities
+    that changed since the last run are summarised again, several per prompt when
+    ``summary_batch_size`` > 1.
+    """
+    use_llm_func: callable = global_config["llm_model_func"]
+    llm_max_tokens = global_config["llm_model_max_token_size"]
+    summary_max_tokens = global_config["community_report_max_tokens"]
+
+    index = await knowledge_hypergraph_inst.get_incidence_index()
+    arrays = index.arrays()
+    vertex_ids = index.vertex_ids[: len(arrays["v_degree"])]
+    edge_ids = index.edge_ids[: len(arrays["e_degree"])]
+    # pure-Python and whole-graph: keep it off the event loop so queries go on
+    labels = await asyncio.get_running_loop().run_in_executor(
+        None, _label_propagation, arrays, global_config["community_max_iterations"]
+    )
+
+    groups = defaultdict(list)
+    for v_pos, label in enumerate(labels):
+        groups[label].append(vertex_ids[v_pos])
+    community_of = {v_id: label for v_id, label in zip(vertex_ids, labels)}
+    group_edges = defaultdict(list)
+    for e_tuple in edge_ids:
+        e_labels = {community_of[v_id] for v_id in e_tuple}
+        if len(e_labels) == 1:
+            group_edges[e_labels.pop()].append(e_tuple)
+
+    communities = {}
+    for label, v_ids in groups.items():
+        if len(v_ids) < global_config["community_min_size"]:
+            continue
+        v_ids = sorted(v_ids)
+        e_tuples = sorted(group_edges[label])
+        communities[
+            compute_mdhash_id(str((v_ids, e_tuples)), prefix="community-")
+        ] = dict(entities=v_ids, hyperedges=[list(e) for e in e_tuples])
+
+    # reports of superseded communities would still take top_k slots in queries
+    stale = set(await community_reports.all_keys()) - set(communities)
+    if stale:
+        await communities_vdb.delete(list(stale))
+
+    if not communities:
+        logger.warning("No community is large enough to summarise")
+        await community_reports.drop()
+        return
+
+    existing = dict(
+        zip(communities, await community_reports.get_by_ids(list(communities)))
+    )
+    new_keys = [k for k, v in existing.items() if v is None]
+    logger.info(
+        f"[Communities] {len(communities)} communities, {len(new_keys)} to summarise"
+    )
+
+    # the entity and hyperedge lists share what the prompt and the report leave free
+    list_max_tokens = max(
+        llm_max_tokens
+        - count_tokens(PROMPTS["summarize_community"])
+        - summary_max_tokens,
+        0,
+    ) // 2
+    summarizer = _make_summarizer(global_config)
+
+    async def _summarize_community(k: str) -> str:
+        community = communities[k]
+        vertex_datas = await asyncio.gather(
+            *[knowledge_hypergraph_inst.get_vertex(v_id) for v_id in community["entities"]]
+        )
+        edge_datas = await asyncio.gather(
+            *[knowledge_hypergraph_inst.get_hyperedge(e) for e in community["hyperedges"]]
+        )
+        entities = truncate_list_by_token_size(
+            [
+                f"{v_id}: {(v or {}).get('description', 'UNKNOWN')}"
+                for v_id, v in zip(community["entities"], vertex_datas)
+            ],
+            key=lambda x: x,
+            max_token_size=list_max_tokens,
+        )
+        hyperedges = truncate_list_by_token_size(
+            [
+                f"{tuple(e)}: {(d or {}).get('description', 'UNKNOWN')}"
+                for e, d in zip(community["hyperedges"], edge_datas)
+            ],
+            key=lambda x: x,
+            max_token_size=list_max_tokens,
+        )
+        use_prompt = PROMPTS["summarize_community"].format(
+            entities="\n".join(entities), hyperedges="\n".join(hyperedges)
+        )
+        if summarizer is not None:
+            return await summarizer.summarize(
+                "community_report",
+                k,
+                ["Entities:\n" + "\n".join(entities), "Hyperedges:\n" + "\n".join(hyperedges)],
+                summary_max_tokens,
+                use_prompt,
+            )
+        return await use_llm_func(use_prompt, max_tokens=summary_max_tokens)
+
+    reports = await asyncio.gather(*[_summarize_community(k) for k in new_keys])
+    for k, report in zip(new_keys, reports):
+        report = (report or "").strip()
+        existing[k] = dict(
+            **communities[k],
+            title=report.split("\n", 1)[0].strip(),
+            report=report,
+        )
 
-    if not all([n is not None for n in node_datas]):
-        logger.warning("Some nodes are missing, maybe the storage is damaged")
-    node_degrees = await asyncio.gather(
-        *[knowledge_hypergraph_inst.vertex_degree(r["entity_name"]) for r in results]
-    )
+    await community_reports.drop()
+    await community_reports.upsert(existing)
+    if new_keys:
+        await communities_vdb.upsert(
+            {
+                k: dict(
+                    content=existing[k]["report"],
+                    title=existing[k]["title"],
+                )
+                for k in new_keys
+            }
+        )
 
-    node_datas = [
-        {**n, "entity_name": k["entity_name"], "rank": d}
-        for k, n, d in zip(results, node_datas, node_degrees)
-        if n is not None
-    ]
 
-    use_text_units = await _find_most_related_text_unit_from_entities(
-        node_datas, query_param, text_chunks_db, knowledge_hypergraph_inst
+def _make_query_context(
+    node_datas: list[dict],
+    edge_datas: list[dict],
+    text_units: list[TextChunkSchema],
+    edge_key: str,
+) -> QueryContext:
+    return QueryContext(
+        entities=[
+            {
+                "entity_name": n["entity_name"],
+                "entity_type": n.get("entity_type", "UNKNOWN"),
+                "description": n.get("description", "UNKNOWN"),
+                "additional_properties": n.get("additional_properties", "UNKNOWN"),
+                "rank": n["rank"],
+            }
+            for n in node_datas
+        ],
+        hyperedges=[
+            {
+                "entity_set": tuple(sorted(e[edge_key])),
+                "description": e["description"],
+                "keywords": e["keywords"],
+                "weight": e["weight"],
+                "rank": e["rank"],
+            }
+            for e in edge_datas
+        ],
+        text_units=[{"content": t["content"]} for t in text_units],
     )
 
-    use_relations = await _find_most_related_edges_from_entities(
-        node_datas, query_param, knowledge_hypergraph_inst
-    )
 
-    logger.info(
-        f"entity query uses {len(node_datas)} entites, {len(use_relations)} relations, {len(use_text_units)} text units"
-    )
+def _render_query_context(context: QueryContext) -> str:
     entities_section_list = [["id", "entity", "type", "description", "additional properties", "rank"]]
-    for i, n in enumerate(node_datas):
+    for i, n in enumerate(context.entities):
         entities_section_list.append(
             [
                 i,
                 n["entity_name"],
-                n.get("entity_type", "UNKNOWN"),
-                n.get("description", "UNKNOWN"),
-                n.get("additional_properties", "UNKNOWN"),
+                n["entity_type"],
+                n["description"],
+                n["additional_properties"],
                 n["rank"],
             ]
         )
-
     entities_context = list_of_list_to_csv(entities_section_list)
 
     relations_section_list = [
         ["id", "entity set", "description", "keywords", "weight", "rank"]
     ]
-    for i, e in enumerate(use_relations):
+    for i, e in enumerate(context.hyperedges):
         relations_section_list.append(
             [
                 i,
-                e["src_tgt"],
+                e["entity_set"],
                 e["description"],
                 e["keywords"],
                 e["weight"],
                 e["rank"],
             ]
         )
-
     relations_context = list_of_list_to_csv(relations_section_list)
 
     text_units_section_list = [["id", "content"]]
-    for i, t in enumerate(use_text_units):
+    for i, t in enumerate(context.text_units):
         text_units_section_list.append([i, t["content"]])
     text_units_context = list_of_list_to_csv(text_units_section_list)
 
-    context_string = f"""
+    return f"""
 -----Entities-----
 ```csv
 {entities_context}
@@ -829,45 +2223,200 @@ async def _build_entity_query_context(
 {text_units_context}
 ```
 """
-    
-    # 返回包含上下文字符串和结构化数据的字典
-    return {
-        "context": context_string,
-        "entities": [
-            {
-                "id": i,
-                "entity_name": n["entity_name"],
-                "entity_type": n.get("entity_type", "UNKNOWN"),
-                "description": n.get("description", "UNKNOWN"),
-                "additional_properties": n.get("additional_properties", "UNKNOWN"),
-                "rank": n["rank"]
-            }
-            for i, n in enumerate(node_datas)
-        ],
-        "hyperedges": [
-            {
-                "id": i,
-                "entity_set": e["src_tgt"],
-                "description": e["description"],
-                "keywords": e["keywords"],
-                "weight": e["weight"],
-                "rank": e["rank"]
-            }
-            for i, e in enumerate(use_relations)
-        ],
-        "text_units": [
-            {
-                "id": i,
-                "content": t["content"]
-            }
-            for i, t in enumerate(use_text_units)
-        ]
-    }
 
 
+async def _build_entity_query_context(
+    query,
+    knowledge_hypergraph_inst: BaseHypergraphStorage,
+    entities_vdb: BaseVectorStorage,
+    text_chunks_db: BaseKVStorage[TextChunkSchema],
+    query_param: QueryParam,
+    query_embedding=None,
+):
+    if query_embedding is None:
+        results = await entities_vdb.query(query, top_k=query_param.top_k)
+    else:
+        results = await entities_vdb.query_by_embedding(
+            query_embedding, top_k=query_param.top_k
+        )
+    if not len(results):
+        return None
+    node_datas = await asyncio.gather(
+        *[knowledge_hypergraph_inst.get_vertex(r["entity_name"]) for r in results]
+    )
+
+    if not all([n is not None for n in node_datas]):
+        logger.warning("Some nodes are missing, maybe the storage is damaged")
+    node_degrees = await asyncio.gather(
+        *[knowledge_hypergraph_inst.vertex_degree(r["entity_name"]) for r in results]
+    )
+
+    node_datas = [
+        {**n, "entity_name": k["entity_name"], "rank": d}
+        for k, n, d in zip(results, node_datas, node_degrees)
+        if n is not None
+    ]
+
+    if query_param.max_hops > 1:
+        # hop entities only fill what the direct hits leave of the entity budget
+        node_datas = truncate_list_by_token_size(
+            node_datas
+            + await _find_multi_hop_entities(
+                {r["entity_name"]: r.get("distance", 1.0) for r in results},
+                query_param,
+                knowledge_hypergraph_inst,
+            ),
+            key=lambda x: x.get("description", ""),
+            count_key=lambda x: x.get("description_tokens"),
+            max_token_size=query_param.max_token_for_entity_context,
+        )
+
+    scorer = None
+    if query_param.ranking == "ppr":
+        scorer = await _personalized_pagerank_scorer(
+            query_param,
+            knowledge_hypergraph_inst,
+            vertex_seeds={r["entity_name"]: r.get("distance", 1.0) for r in results},
+        )
+        node_datas = sorted(
+            [{**n, "rank": scorer.vertex_score(n["entity_name"])} for n in node_datas],
+            key=lambda x: x["rank"],
+            reverse=True,
+        )
+
+    nbr_edges = await _get_nbr_edges_of_entities(
+        node_datas, query_param, knowledge_hypergraph_inst
+    )
+
+    use_text_units = await _find_most_related_text_unit_from_entities(
+        node_datas, nbr_edges, query_param, text_chunks_db, knowledge_hypergraph_inst
+    )
+
+    use_relations = await _find_most_related_edges_from_entities(
+        node_datas, nbr_edges, query_param, knowledge_hypergraph_inst, scorer
+    )
+
+    logger.info(
+        f"entity query uses {len(node_datas)} entites, {len(use_relations)} relations, {len(use_text_units)} text units"
+    )
+    return _make_query_context(node_datas, use_relations, use_text_units, "src_tgt")
+
+
+@dataclass
+class _PersonalizedPageRankScorer:
+    index: Any
+    vertex_scores: np.ndarray
+    edge_scores: np.ndarray
+
+    def vertex_score(self, v_id) -> float:
+        pos = self.index.vertex_pos.get(v_id)
+        return 0.0 if pos is None else round(float(self.vertex_scores[pos]), 6)
+
+    def edge_score(self, e_tuple) -> float:
+        pos = self.index.edge_pos.get(tuple(sorted(e_tuple)))
+        return 0.0 if pos is None else round(float(self.edge_scores[pos]), 6)
+
+
+async def _personalized_pagerank_scorer(
+    query_param: QueryParam,
+    knowledge_hypergraph_inst: BaseHypergraphStorage,
+    vertex_seeds: dict = None,
+    edge_seeds: dict = None,
+) -> _PersonalizedPageRankScorer:
+    """
+    Rank vertices and hyperedges by a random walk with restart seeded by the
+    vector hits, replacing the raw degree as ``rank``.
+    """
+    index = await knowledge_hypergraph_inst.get_incidence_index()
+    vertex_scores, edge_scores = index.personalized_pagerank(
+        {
+            index.vertex_pos[k]: v
+            for k, v in (vertex_seeds or {}).items()
+            if k in index.vertex_pos
+        },
+        {
+            index.edge_pos[tuple(sorted(k))]: v
+            for k, v in (edge_seeds or {}).items()
+            if tuple(sorted(k)) in index.edge_pos
+        },
+        alpha=query_param.ppr_alpha,
+        max_iter=query_param.ppr_max_iter,
+    )
+    return _PersonalizedPageRankScorer(index, vertex_scores, edge_scores)
+
+
+async def _find_multi_hop_entities(
+    seed_scores: dict[str, float],
+    query_param: QueryParam,
+    knowledge_hypergraph_inst: BaseHypergraphStorage,
+):
+    """
+    Expand the matched vertices for ``max_hops - 1`` further hops over the
+    incidence index. Each hop is one vertex -> hyperedge -> vertex propagation,
+    the frontier is pruned to ``hop_budget`` vertices and scores decay by
+    ``hop_decay`` per hop, so the cost stays linear in the number of incidences.
+    Returns the reached vertices in descending score order, untruncated.
+    """
+    index = await knowledge_hypergraph_inst.get_incidence_index()
+    if not index.num_v:
+        return []
+    x = np.zeros(index.num_v)
+    for v_id, score in seed_scores.items():
+        if v_id in index.vertex_pos:
+            x[index.vertex_pos[v_id]] = max(score, 1e-6)
+    visited = x > 0
+    total = np.zeros(index.num_v)
+    for hop in range(1, query_param.max_hops):
+        x = index.hyperedge_to_vertex(index.vertex_to_hyperedge(x))
+        x[visited] = 0.0
+        if query_param.hop_budget < np.count_nonzero(x):
+            x[np.argpartition(-x, query_param.hop_budget)[query_param.hop_budget :]] = 0.0
+        if not x.any():
+            break
+        x = x / x.max() * query_param.hop_decay**hop
+        total += x
+        visited |= x > 0
+
+    reached = np.flatnonzero(total)
+    hop_positions = reached[np.argsort(-total[reached], kind="stable")].tolist()
+    hop_names = [index.vertex_ids[i] for i in hop_positions]
+    hop_datas = await asyncio.gather(
+        *[knowledge_hypergraph_inst.get_vertex(v_id) for v_id in hop_names]
+    )
+    hop_degrees = await asyncio.gather(
+        *[knowledge_hypergraph_inst.vertex_degree(v_id) for v_id in hop_names]
+    )
+    return [
+        {**n, "entity_name": k, "rank": d}
+        for k, n, d in zip(hop_names, hop_datas, hop_degrees)
+        if n is not None
+    ]
+
+
+async def _get_nbr_edges_of_entities(
+    node_datas: list[dict],
+    query_param: QueryParam,
+    knowledge_hypergraph_inst: BaseHypergraphStorage,
+):
+    """
+    Fetch the incident hyperedges of every vertex, capped per vertex so that hub
+    entities with thousands of hyperedges do not dominate the query latency.
+    """
+    return await asyncio.gather(
+        *[
+            knowledge_hypergraph_inst.get_nbr_e_of_vertex_sampled(
+                dp["entity_name"],
+                query_param.max_hyperedges_per_vertex,
+                query_param.hyperedge_sampling,
+            )
+            for dp in node_datas
+        ]
+    )
+
 
 async def _find_most_related_text_unit_from_entities(
     node_datas: list[dict],
+    nbr_edges: list[list],
     query_param: QueryParam,
     text_chunks_db: BaseKVStorage[TextChunkSchema],
     knowledge_hypergraph_inst: BaseHypergraphStorage,
@@ -877,89 +2426,71 @@ async def _find_most_related_text_unit_from_entities(
         for dp in node_datas
     ]
 
-    edges = await asyncio.gather(
-        *[knowledge_hypergraph_inst.get_nbr_e_of_vertex(dp['entity_name']) for dp in node_datas]
+    all_one_hop_edges = list(
+        {tuple(sorted(e)) for this_edges in nbr_edges if this_edges for e in this_edges}
     )
-
-    all_one_hop_nodes = set()
-    for this_edges in edges:
-        if not this_edges:
-            continue
-        all_one_hop_nodes.update([e for e in this_edges])
-
-    all_one_hop_nodes = list(all_one_hop_nodes)
-    all_one_hop_nodes_data = await asyncio.gather(
-        *[knowledge_hypergraph_inst.get_vertex(e) for e in all_one_hop_nodes]
+    all_one_hop_edges_data = await asyncio.gather(
+        *[knowledge_hypergraph_inst.get_hyperedge(e) for e in all_one_hop_edges]
     )
-    
-    # Add null check for node data
     all_one_hop_text_units_lookup = {
         k: set(split_string_by_multi_markers(v["source_id"], [GRAPH_FIELD_SEP]))
-        for k, v in zip(all_one_hop_nodes, all_one_hop_nodes_data)
-        if v is not None and "source_id" in v  # Add source_id check
+        for k, v in zip(all_one_hop_edges, all_one_hop_edges_data)
+        if v is not None and "source_id" in v
     }
 
+    # rank candidate chunks first, fetch them lazily until the token budget is used up
     all_text_units_lookup = {}
-    for index, (this_text_units, this_edges) in enumerate(zip(text_units, edges)):
+    for index, (this_text_units, this_edges) in enumerate(zip(text_units, nbr_edges)):
+        relation_counts = Counter()
+        for e in this_edges or []:
+            relation_counts.update(all_one_hop_text_units_lookup.get(tuple(sorted(e)), ()))
         for c_id in this_text_units:
             if c_id in all_text_units_lookup:
                 continue
-            relation_counts = 0
-            if this_edges:  # Add check for None edges
-                for e in this_edges:
-                    if (
-                        e in all_one_hop_text_units_lookup
-                        and c_id in all_one_hop_text_units_lookup[e]
-                    ):
-                        relation_counts += 1
-            
-            chunk_data = await text_chunks_db.get_by_id(c_id)
-            if chunk_data is not None and "content" in chunk_data:  # Add content check
-                all_text_units_lookup[c_id] = {
-                    "data": chunk_data,
-                    "order": index,
-                    "relation_counts": relation_counts,
-                }
-
-    # Filter out None values and ensure data has content
-    all_text_units = [
-        {"id": k, **v} 
-        for k, v in all_text_units_lookup.items() 
-        if v is not None and v.get("data") is not None and "content" in v["data"]
-    ]
-
-    if not all_text_units:
-        logger.warning("No valid text units found")
-        return []
+            all_text_units_lookup[c_id] = {
+                "order": index,
+                "relation_counts": relation_counts[c_id],
+            }
 
     all_text_units = sorted(
-        all_text_units, 
-        key=lambda x: (x["order"], -x["relation_counts"])
+        all_text_units_lookup.items(),
+        key=lambda x: (x[1]["order"], -x[1]["relation_counts"])
     )
 
-    all_text_units = truncate_list_by_token_size(
-        all_text_units,
-        key=lambda x: x["data"]["content"],
-        max_token_size=query_param.max_token_for_text_unit,
-    )
+    use_text_units = []
+    tokens = 0
+    batch_size = 32
+    for start in range(0, len(all_text_units), batch_size):
+        batch_ids = [k for k, _ in all_text_units[start : start + batch_size]]
+        for chunk_data in await text_chunks_db.get_by_ids(batch_ids):
+            if chunk_data is None or "content" not in chunk_data:
+                continue
+            chunk_tokens = chunk_data.get("tokens")
+            tokens += (
+                chunk_tokens
+                if chunk_tokens is not None
+                else count_tokens(chunk_data["content"])
+            )
+            if tokens > query_param.max_token_for_text_unit:
+                return use_text_units
+            use_text_units.append(chunk_data)
 
-    all_text_units = [t["data"] for t in all_text_units]
-    return all_text_units
+    if not use_text_units:
+        logger.warning("No valid text units found")
+    return use_text_units
 
 
 async def _find_most_related_edges_from_entities(
     node_datas: list[dict],
+    nbr_edges: list[list],
     query_param: QueryParam,
     knowledge_hypergraph_inst: BaseHypergraphStorage,
+    scorer: _PersonalizedPageRankScorer = None,
 ):
-    all_related_edges = await asyncio.gather(
-        *[knowledge_hypergraph_inst.get_nbr_e_of_vertex(dp['entity_name']) for dp in node_datas]
-    )
-
     all_edges = set()
-    for this_edges in all_related_edges:
+    for this_edges in nbr_edges:
         all_edges.update([tuple(sorted(e)) for e in this_edges])
-    all_edges = list(all_edges)
+    all_edges = sorted(all_edges)
     all_edges_pack = await asyncio.gather(
         *[knowledge_hypergraph_inst.get_hyperedge(e) for e in all_edges]
     )
@@ -972,6 +2503,10 @@ async def _find_most_related_edges_from_entities(
         for k, v, d in zip(all_edges, all_edges_pack, all_edges_degree)
         if v !=[]
     ]
+    if scorer is not None:
+        all_edges_data = [
+            {**e, "rank": scorer.edge_score(e["src_tgt"])} for e in all_edges_data
+        ]
 
     all_edges_data = sorted(
         all_edges_data, key=lambda x: (x["rank"], x["weight"]), reverse=True
@@ -979,6 +2514,7 @@ async def _find_most_related_edges_from_entities(
     all_edges_data = truncate_list_by_token_size(
         all_edges_data,
         key=lambda x: x["description"],
+        count_key=lambda x: x.get("description_tokens"),
         max_token_size=query_param.max_token_for_relation_context,
     )
     return all_edges_data
@@ -991,8 +2527,14 @@ async def _build_relation_query_context(
     relationships_vdb: BaseVectorStorage,
     text_chunks_db: BaseKVStorage[TextChunkSchema],
     query_param: QueryParam,
+    query_embedding=None,
 ):
-    results = await relationships_vdb.query(keywords, top_k=query_param.top_k)
+    if query_embedding is None:
+        results = await relationships_vdb.query(keywords, top_k=query_param.top_k)
+    else:
+        results = await relationships_vdb.query_by_embedding(
+            query_embedding, top_k=query_param.top_k
+        )
 
     if not len(results):
         return None
@@ -1012,17 +2554,28 @@ async def _build_relation_query_context(
         for k, v, d in zip(results, edge_datas, edge_degree)
         if v is not None
     ]
+    scorer = None
+    if query_param.ranking == "ppr":
+        scorer = await _personalized_pagerank_scorer(
+            query_param,
+            knowledge_hypergraph_inst,
+            edge_seeds={tuple(r["id_set"]): r.get("distance", 1.0) for r in results},
+        )
+        edge_datas = [
+            {**e, "rank": scorer.edge_score(e["id_set"])} for e in edge_datas
+        ]
     edge_datas = sorted(
         edge_datas, key=lambda x: (x["rank"], x["weight"]), reverse=True
     )
     edge_datas = truncate_list_by_token_size(
         edge_datas,
         key=lambda x: x["description"],
+        count_key=lambda x: x.get("description_tokens"),
         max_token_size=query_param.max_token_for_relation_context,
     )
 
     use_entities = await _find_most_related_entities_from_relationships(
-        edge_datas, query_param, knowledge_hypergraph_inst
+        edge_datas, query_param, knowledge_hypergraph_inst, scorer
     )
     use_text_units = await _find_related_text_unit_from_relationships(
         edge_datas, query_param, text_chunks_db, knowledge_hypergraph_inst
@@ -1030,100 +2583,20 @@ async def _build_relation_query_context(
     logger.info(
         f"relation query uses {len(use_entities)} entites, {len(edge_datas)} relations, {len(use_text_units)} text units"
     )
-    relations_section_list = [
-        ["id", "entity set", "description", "keywords", "weight", "rank"]
-    ]
-    for i, e in enumerate(edge_datas):
-        relations_section_list.append(
-            [
-                i,
-                e["id_set"],
-                e["description"],
-                e["keywords"],
-                e["weight"],
-                e["rank"],
-            ]
-        )
-    relations_context = list_of_list_to_csv(relations_section_list)
-
-    entites_section_list = [["id", "entity", "type", "description", "additional properties", "rank"]]
-    for i, n in enumerate(use_entities):
-        entites_section_list.append(
-            [
-                i,
-                n["entity_name"],
-                n.get("entity_type", "UNKNOWN"),
-                n.get("description", "UNKNOWN"),
-                n.get("additional properties", "UNKNOWN"),
-                n["rank"],
-            ]
-        )
-    entities_context = list_of_list_to_csv(entites_section_list)
-
-    text_units_section_list = [["id", "content"]]
-    for i, t in enumerate(use_text_units):
-        text_units_section_list.append([i, t["content"]])
-    text_units_context = list_of_list_to_csv(text_units_section_list)
-
-    context_string = f"""
------Entities-----
-```csv
-{entities_context}
-```
------Relationships-----
-```csv
-{relations_context}
-```
------Sources-----
-```csv
-{text_units_context}
-```
-"""
+    return _make_query_context(use_entities, edge_datas, use_text_units, "id_set")
 
-    # 返回包含上下文字符串和结构化数据的字典
-    return {
-        "context": context_string,
-        "entities": [
-            {
-                "id": i,
-                "entity_name": n["entity_name"],
-                "entity_type": n.get("entity_type", "UNKNOWN"),
-                "description": n.get("description", "UNKNOWN"),
-                "additional_properties": n.get("additional properties", "UNKNOWN"),
-                "rank": n["rank"]
-            }
-            for i, n in enumerate(use_entities)
-        ],
-        "hyperedges": [
-            {
-                "id": i,
-                "entity_set": e["id_set"],
-                "description": e["description"],
-                "keywords": e["keywords"],
-                "weight": e["weight"],
-                "rank": e["rank"]
-            }
-            for i, e in enumerate(edge_datas)
-        ],
-        "text_units": [
-            {
-                "id": i,
-                "content": t["content"]
-            }
-            for i, t in enumerate(use_text_units)
-        ]
-    }
 
 async def _find_most_related_entities_from_relationships(
     edge_datas: list[dict],
     query_param: QueryParam,
     knowledge_hypergraph_inst: BaseHypergraphStorage,
+    scorer: _PersonalizedPageRankScorer = None,
 ):
-    entity_names = set()
+    entity_names = {}  # insertion-ordered set
     for e in edge_datas:
         for f in e["id_set"]:
             if await knowledge_hypergraph_inst.has_vertex(f):
-                entity_names.add(f)
+                entity_names[f] = None
 
     node_datas = await asyncio.gather(
         *[knowledge_hypergraph_inst.get_vertex(entity_name) for entity_name in entity_names]
@@ -1137,10 +2610,17 @@ async def _find_most_related_entities_from_relationships(
         {**n, "entity_name": k, "rank": d}
         for k, n, d in zip(entity_names, node_datas, node_degrees)
     ]
+    if scorer is not None:
+        node_datas = sorted(
+            [{**n, "rank": scorer.vertex_score(n["entity_name"])} for n in node_datas],
+            key=lambda x: x["rank"],
+            reverse=True,
+        )
 
     node_datas = truncate_list_by_token_size(
         node_datas,
         key=lambda x: x["description"],
+        count_key=lambda x: x.get("description_tokens"),
         max_token_size=query_param.max_token_for_entity_context,
     )
 
@@ -1177,6 +2657,7 @@ async def _find_related_text_unit_from_relationships(
     all_text_units = truncate_list_by_token_size(
         all_text_units,
         key=lambda x: x["data"]["content"],
+        count_key=lambda x: x["data"].get("tokens"),
         max_token_size=query_param.max_token_for_text_unit,
     )
     all_text_units: list[TextChunkSchema] = [t["data"] for t in all_text_units]
@@ -1184,30 +2665,74 @@ async def _find_related_text_unit_from_relationships(
     return all_text_units
 
 
-async def hyper_query(
-    query,
-    knowledge_hypergraph_inst: BaseHypergraphStorage,
-    entities_vdb: BaseVectorStorage,
-    relationships_vdb: BaseVectorStorage,
-    text_chunks_db: BaseKVStorage[TextChunkSchema],
-    query_param: QueryParam,
-    global_config: dict,
-):
-    entity_context = None
-    relation_context = None
-    use_model_func = global_config["llm_model_func"]
+class _MemoizedHypergraphStorage:
+    """
+    Per-query view of a hypergraph storage that memoises record and degree
+    lookups, so concurrent retrieval stages fetch each vertex or hyperedge once.
+    Other storage methods are passed through unchanged.
+    """
+
+    def __init__(self, knowledge_hypergraph_inst: BaseHypergraphStorage):
+        self._inst = knowledge_hypergraph_inst
+        self._memo = {}
+
+    def __getattr__(self, name):
+        return getattr(self._inst, name)
+
+    async def _cached(self, method: str, key):
+        # the in-flight task is memoised, so concurrent callers share one fetch
+        memo_key = (method, key)
+        task = self._memo.get(memo_key)
+        if task is None:
+            task = asyncio.ensure_future(getattr(self._inst, method)(key))
+            self._memo[memo_key] = task
+        try:
+            return await asyncio.shield(task)
+        except Exception:
+            if self._memo.get(memo_key) is task:
+                del self._memo[memo_key]
+            raise
+
+    async def has_vertex(self, v_id):
+        return await self._cached("has_vertex", v_id)
+
+    async def get_vertex(self, v_id, default=None):
+        data = await self._cached("get_vertex", v_id)
+        return default if data is None else data
+
+    async def vertex_degree(self, v_id):
+        return await self._cached("vertex_degree", v_id)
+
+    async def get_hyperedge(self, e_tuple, default=None):
+        data = await self._cached("get_hyperedge", tuple(sorted(e_tuple)))
+        return default if data is None else data
+
+    async def hyperedge_degree(self, e_tuple):
+        return await self._cached("hyperedge_degree", tuple(sorted(e_tuple)))
+
+
+async def _timed(timings: dict, stage: str, coro):
+    start = time.perf_counter()
+    result = await coro
+    timings[stage] = round(time.perf_counter() - start, 4)
+    return result
+
 
+async def _extract_query_keywords(query, global_config: dict, timings: dict = None):
+    """
+    Ask the LLM for the low- and high-level keywords of the query. Returns the
+    two comma-joined keyword strings, or ``None`` when the answer is not JSON.
+    """
+    use_model_func = global_config["llm_model_func"]
     kw_prompt_temp = PROMPTS["keywords_extraction"]
     kw_prompt = kw_prompt_temp.format(query=query)
 
-    result = await use_model_func(kw_prompt)
+    result = await _timed(
+        timings if timings is not None else {}, "keywords", use_model_func(kw_prompt)
+    )
 
     try:
         keywords_data = json.loads(result)
-        entity_keywords = keywords_data.get("low_level_keywords", [])
-        relation_keywords = keywords_data.get("high_level_keywords", [])
-        entity_keywords = ", ".join(entity_keywords)
-        relation_keywords = ", ".join(relation_keywords)
     except json.JSONDecodeError:
         try:
             result = (
@@ -1218,74 +2743,207 @@ async def hyper_query(
             )
             result = "{" + result.split("{")[1].split("}")[0] + "}"
             keywords_data = json.loads(result)
-            relation_keywords = keywords_data.get("high_level_keywords", [])
-            entity_keywords = keywords_data.get("low_level_keywords", [])
-            relation_keywords = ", ".join(relation_keywords)
-            entity_keywords = ", ".join(entity_keywords)
         # Handle parsing error
-        except json.JSONDecodeError as e:
+        except (json.JSONDecodeError, IndexError) as e:
             print(f"JSON parsing error: {e}")
-            return PROMPTS["fail_response"]
+            return None
+    entity_keywords = ", ".join(keywords_data.get("low_level_keywords", []))
+    relation_keywords = ", ".join(keywords_data.get("high_level_keywords", []))
+    return entity_keywords, relation_keywords
+
+
+_KEYWORD_STOPWORDS = frozenset(
+    """a about above after again against all am an and any are as at be because
+    been before being below between both but by can could did do does doing down
+    during each few for from further had has have having he her here hers how i if
+    in into is it its itself just me more most my no nor not of off on once only or
+    other our ours out over own same she should so some such than that the their
+    theirs them then there these they this those through to too under until up
+    very was we were what when where which while who whom why will with would you
+    your yours tell explain describe give show list please know""".split()
+)
+_KEYWORD_SPLIT = re.compile(r"[^\w\s-]+|\s+-\s+")
+_KEYWORD_WORD = re.compile(r"[\w-]+")
+
+
+def _lexical_key_phrases(query: str, max_phrases: int) -> list[str]:
     """
-        Perform different actions based on keywords:
-            ll_keywords: Find information based on low-level keywords.
-            hl_keywords: Define topic information based on high-level keywords.
+    RAKE-style key phrases: runs of non-stopwords between punctuation, scored by
+    the degree/frequency ratio of their words.
     """
-    if entity_keywords:
-        """
-        low_level_context: Retrieves vertices and their first-order neighbor hyperedges.
-        high_level_context: Retrieves hyperedges and their first-order neighbor vertices.
-        """
-        entity_context = await _build_entity_query_context(
-            entity_keywords,
-            knowledge_hypergraph_inst,
-            entities_vdb,
-            text_chunks_db,
-            query_param,
-        )
-
-    if relation_keywords:
-        relation_context = await _build_relation_query_context(
-            relation_keywords,
-            knowledge_hypergraph_inst,
-            entities_vdb,
-            relationships_vdb,
-            text_chunks_db,
-            query_param,
-        )
+    phrases = []
+    for fragment in _KEYWORD_SPLIT.split(query):
+        phrase = []
+        for word in _KEYWORD_WORD.findall(fragment):
+            if word.lower() in _KEYWORD_STOPWORDS or word.isdigit():
+                if phrase:
+                    phrases.append(phrase)
+                phrase = []
+            else:
+                phrase.append(word)
+        if phrase:
+            phrases.append(phrase)
+
+    frequency, degree = Counter(), Counter()
+    for phrase in phrases:
+        for word in phrase:
+            frequency[word.lower()] += 1
+            degree[word.lower()] += len(phrase)
+    scored = {}
+    for phrase in phrases:
+        text = " ".join(phrase)
+        score = sum(degree[w.lower()] / frequency[w.lower()] for w in phrase)
+        scored[text] = max(score, scored.get(text, 0))
+    return sorted(scored, key=lambda p: -scored[p])[:max_phrases]
+
+
+async def extract_lexical_keywords(
+    query,
+    entities_vdb: BaseVectorStorage,
+    max_phrases: int = 10,
+    max_entity_names: int = 5,
+):
     """
-        combine the information from the local_query and global_query,
-        so that we can have the final retrieval information.
+    Local replacement for the keyword LLM call. Low-level keywords are the key
+    phrases of the query plus the names of the closest entities in the vector
+    store; the high-level keywords are the query's content words.
     """
-    context = combine_contexts(relation_context.get("context"), entity_context.get("context"))
+    phrases = _lexical_key_phrases(query, max_phrases)
+    entity_names = []
+    if max_entity_names:
+        results = await entities_vdb.query(query, top_k=max_entity_names)
+        entity_names = [r["entity_name"] for r in results if r.get("entity_name")]
+    low_level = list(dict.fromkeys(phrases + entity_names))
+    content_words = [w for p in phrases for w in p.split()]
+    high_level = [" ".join(dict.fromkeys(content_words))] if content_words else []
+    return ", ".join(low_level), ", ".join(high_level)
 
-    contextJson = {
-        "entities": deduplicate_by_key(entity_context.get("entities", []) + relation_context.get("entities", []), "entity_name"),
-        "hyperedges": deduplicate_by_key(entity_context.get("hyperedges", []) + relation_context.get("hyperedges", []), "entity_set"),
-        "text_units": deduplicate_by_key(entity_context.get("text_units", []) + relation_context.get("text_units", []), "content")
-    }
 
-    if query_param.only_need_context:
-        return context
+# share of the LLM keyword words the lexical keywords must cover to keep the speculative context
+_KEYWORD_REUSE_OVERLAP = 0.6
+
+
+def _keyword_overlap(fast_keywords, llm_keywords) -> float:
+    """Fraction of the words in the LLM keywords that the lexical keywords contain."""
+    def _words(keywords):
+        return {w.lower() for k in keywords for w in _KEYWORD_WORD.findall(k)}
+
+    llm_words = _words(llm_keywords)
+    if not llm_words:
+        return 1.0
+    return len(llm_words & _words(fast_keywords)) / len(llm_words)
+
+
+async def _retrieve_with_keywords(
+    query,
+    build_context,
+    entities_vdb: BaseVectorStorage,
+    query_param: QueryParam,
+    global_config: dict,
+    timings: dict = None,
+):
+    """
+    Obtain keywords with the extractor chosen by ``query_param.keyword_extractor``
+    and run ``build_context(entity_keywords, relation_keywords)`` on them.
+
+    In speculative mode the lexical keywords are retrieved while the LLM keyword
+    call is in flight. The speculative context is kept when the LLM keywords
+    mostly overlap the lexical ones, arrive after ``keyword_timeout``, fail or
+    cannot be parsed; otherwise retrieval is redone on the LLM keywords, reusing
+    the records fetched so far.
+    Returns ``(entity_keywords, relation_keywords, context)`` or ``None``.
+    """
+    timings = timings if timings is not None else {}
+    extractor = query_param.keyword_extractor
+    if extractor == "llm":
+        keywords = await _extract_query_keywords(query, global_config, timings)
+        if keywords is None:
+            return None
+        context = await build_context(*keywords)
+        return None if context is None else (*keywords, context)
+    if extractor == "lexical":
+        keywords = await _timed(
+            timings, "keywords", extract_lexical_keywords(query, entities_vdb)
+        )
+        context = await build_context(*keywords)
+        return None if context is None else (*keywords, context)
+    if extractor != "speculative":
+        raise ValueError(f"Unknown keyword extractor {extractor}")
+
+    llm_keywords_task = asyncio.ensure_future(
+        _extract_query_keywords(query, global_config, timings)
+    )
+    try:
+        fast_keywords = await _timed(
+            timings, "lexical_keywords", extract_lexical_keywords(query, entities_vdb)
+        )
+        fast_context = await _timed(
+            timings, "speculative_retrieval", build_context(*fast_keywords)
+        )
+        try:
+            keywords = await asyncio.wait_for(
+                asyncio.shield(llm_keywords_task), timeout=query_param.keyword_timeout
+            )
+        except asyncio.TimeoutError:
+            logger.info("Keyword LLM call timed out, keeping the speculative context")
+            keywords = None
+        except Exception as e:
+            logger.warning(f"Keyword LLM call failed, keeping the speculative context: {e}")
+            keywords = None
+    finally:
+        if not llm_keywords_task.done():
+            llm_keywords_task.cancel()
+    if (
+        keywords is None
+        or _keyword_overlap(fast_keywords, keywords) >= _KEYWORD_REUSE_OVERLAP
+    ):
+        return None if fast_context is None else (*fast_keywords, fast_context)
+    context = await build_context(*keywords)
     if context is None:
-        return PROMPTS["fail_response"]
+        return None if fast_context is None else (*fast_keywords, fast_context)
+    return (*keywords, context)
+
+
+def _build_retrieval(
+    query,
+    context: str,
+    query_param: QueryParam,
+    context_json: dict = None,
+    entity_keywords: str = "",
+    relation_keywords: str = "",
+    prompt_key: str = "rag_response",
+) -> dict:
+    """
+    Package what generation needs from a retrieval run: the rendered context,
+    the system prompt, the keyword qualifiers appended to the question and the
+    structured context for JSON responses.
+    """
     define_str = ""
     if entity_keywords or relation_keywords:
         """
         High-level keywords serve as qualifiers to the topic information
         """
-        entity_keywords = entity_keywords if entity_keywords else ""
-        relation_keywords = relation_keywords if relation_keywords else ""
         define_str = PROMPTS["rag_define"]
-        define_str = define_str.format(ll_keywords=entity_keywords,hl_keywords=relation_keywords)
-    sys_prompt_temp = PROMPTS["rag_response"]
-    sys_prompt = sys_prompt_temp.format(
-        context_data=context, response_type=query_param.response_type
-    )
-    response = await use_model_func(
-        query + define_str,
+        define_str = define_str.format(
+            ll_keywords=entity_keywords or "", hl_keywords=relation_keywords or ""
+        )
+    if prompt_key == "naive_rag_response":
+        sys_prompt = PROMPTS[prompt_key].format(
+            content_data=context, response_type=query_param.response_type
+        )
+    else:
+        sys_prompt = PROMPTS[prompt_key].format(
+            context_data=context, response_type=query_param.response_type
+        )
+    return dict(
+        context=context,
         system_prompt=sys_prompt,
+        keywords_prompt=define_str,
+        context_json=context_json or {},
     )
+
+
+def _clean_response(response: str, query, sys_prompt: str) -> str:
     if len(response) > len(sys_prompt):
         response = (
             response.replace(sys_prompt, "")
@@ -1296,108 +2954,250 @@ async def hyper_query(
             .replace("</system>", "")
             .strip()
         )
-    if query_param.return_type == "json":
-        contextJson["response"] = response
-        response = contextJson
-    return response 
+    return response
 
 
-async def hyper_query_lite(
+async def generate_response(
     query,
-    knowledge_hypergraph_inst: BaseHypergraphStorage,
-    entities_vdb: BaseVectorStorage,
-    text_chunks_db: BaseKVStorage[TextChunkSchema],
+    retrieval: dict,
     query_param: QueryParam,
     global_config: dict,
-) -> str:
+):
+    """Answer the query from the output of one of the ``*_retrieve`` functions."""
+    use_model_func = global_config["llm_model_func"]
+    timings = dict(retrieval["context_json"].get("timings", {}))
+    response = await _timed(
+        timings,
+        "generation",
+        use_model_func(
+            query + retrieval["keywords_prompt"],
+            system_prompt=retrieval["system_prompt"],
+        ),
+    )
+    response = _clean_response(response, query, retrieval["system_prompt"])
+    if query_param.return_type == "json":
+        response = {**retrieval["context_json"], "response": response}
+        if "timings" in response:
+            response["timings"] = timings
+    return response
 
-    entity_context = None
+
+async def generate_response_stream(
+    query,
+    retrieval: dict,
+    query_param: QueryParam,
+    global_config: dict,
+):
+    """
+    Streaming counterpart of ``generate_response``: yields the answer text as
+    the LLM produces it. Model functions that do not support ``stream=True``
+    and return a plain string yield the whole cleaned answer at once.
+    """
     use_model_func = global_config["llm_model_func"]
+    response = await use_model_func(
+        query + retrieval["keywords_prompt"],
+        system_prompt=retrieval["system_prompt"],
+        stream=True,
+    )
+    if isinstance(response, str):
+        yield _clean_response(response, query, retrieval["system_prompt"])
+        return
+    async for delta in response:
+        yield delta
 
-    kw_prompt_temp = PROMPTS["keywords_extraction"]
-    kw_prompt = kw_prompt_temp.format(query=query)
 
-    result = await use_model_func(kw_prompt)
+async def _answer(query, retrieval, query_param: QueryParam, global_config: dict):
+    if retrieval is None:
+        return PROMPTS["fail_response"]
+    if query_param.only_need_context:
+        return retrieval["context"]
+    return await generate_response(query, retrieval, query_param, global_config)
 
-    try:
-        keywords_data = json.loads(result)
-        entity_keywords = keywords_data.get("low_level_keywords", [])
-        entity_keywords = ", ".join(entity_keywords)
-    except json.JSONDecodeError:
-        try:
-            result = (
-                result.replace(kw_prompt[:-1], "")
-                .replace("user", "")
-                .replace("model", "")
-                .strip()
+
+async def hyper_retrieve(
+    query,
+    knowledge_hypergraph_inst: BaseHypergraphStorage,
+    entities_vdb: BaseVectorStorage,
+    relationships_vdb: BaseVectorStorage,
+    text_chunks_db: BaseKVStorage[TextChunkSchema],
+    query_param: QueryParam,
+    global_config: dict,
+):
+    timings = {}
+    memo_hypergraph_inst = _MemoizedHypergraphStorage(knowledge_hypergraph_inst)
+
+    async def build_context(entity_keywords, relation_keywords):
+        """
+            low_level_context: Retrieves vertices and their first-order neighbor hyperedges.
+            high_level_context: Retrieves hyperedges and their first-order neighbor vertices.
+            Both are independent, so they run concurrently on one batched embedding
+            call and share the fetched records through a per-query memo.
+        """
+        keyword_strings = list(dict.fromkeys(k for k in (entity_keywords, relation_keywords) if k))
+        query_embeddings = {}
+        if keyword_strings:
+            embeddings = await _timed(
+                timings, "embedding", entities_vdb.embedding_func(keyword_strings)
             )
-            result = "{" + result.split("{")[1].split("}")[0] + "}"
-            keywords_data = json.loads(result)
-            entity_keywords = keywords_data.get("low_level_keywords", [])
-            entity_keywords = ", ".join(entity_keywords)
-        # Handle parsing error
-        except json.JSONDecodeError as e:
-            print(f"JSON parsing error: {e}")
-            return PROMPTS["fail_response"]
+            query_embeddings = dict(zip(keyword_strings, embeddings))
+
+        entity_context, relation_context = await _timed(
+            timings,
+            "retrieval",
+            asyncio.gather(
+                _timed(
+                    timings,
+                    "entity_context",
+                    _build_entity_query_context(
+                        entity_keywords,
+                        memo_hypergraph_inst,
+                        entities_vdb,
+                        text_chunks_db,
+                        query_param,
+                        query_embedding=query_embeddings[entity_keywords],
+                    ),
+                )
+                if entity_keywords
+                else asyncio.sleep(0, result=None),
+                _timed(
+                    timings,
+                    "relation_context",
+                    _build_relation_query_context(
+                        relation_keywords,
+                        memo_hypergraph_inst,
+                        entities_vdb,
+                        relationships_vdb,
+                        text_chunks_db,
+                        query_param,
+                        query_embedding=query_embeddings[relation_keywords],
+                    ),
+                )
+                if relation_keywords
+                else asyncio.sleep(0, result=None),
+            ),
+        )
+        """
+            combine the information from the local_query and global_query,
+            so that we can have the final retrieval information.
+        """
+        query_context = (entity_context or QueryContext()).merge(
+            relation_context or QueryContext()
+        )
+        return None if query_context.is_empty() else query_context
+
     """
         Perform different actions based on keywords:
             ll_keywords: Find information based on low-level keywords.
+            hl_keywords: Define topic information based on high-level keywords.
     """
-    if entity_keywords:
+    result = await _retrieve_with_keywords(
+        query, build_context, entities_vdb, query_param, global_config, timings
+    )
+    logger.info(f"hyper query stage timings: {timings}")
+    if result is None:
+        return None
+    entity_keywords, relation_keywords, query_context = result
+    query_context = await _summarize_pending_context(
+        query_context, knowledge_hypergraph_inst, global_config
+    )
+    return _build_retrieval(
+        query,
+        _render_query_context(query_context),
+        query_param,
+        context_json={**query_context.to_dict(), "timings": timings},
+        entity_keywords=entity_keywords,
+        relation_keywords=relation_keywords,
+    )
+
+
+async def hyper_query(
+    query,
+    knowledge_hypergraph_inst: BaseHypergraphStorage,
+    entities_vdb: BaseVectorStorage,
+    relationships_vdb: BaseVectorStorage,
+    text_chunks_db: BaseKVStorage[TextChunkSchema],
+    query_param: QueryParam,
+    global_config: dict,
+):
+    retrieval = await hyper_retrieve(
+        query,
+        knowledge_hypergraph_inst,
+        entities_vdb,
+        relationships_vdb,
+        text_chunks_db,
+        query_param,
+        global_config,
+    )
+    return await _answer(query, retrieval, query_param, global_config)
+
+
+async def hyper_lite_retrieve(
+    query,
+    knowledge_hypergraph_inst: BaseHypergraphStorage,
+    entities_vdb: BaseVectorStorage,
+    text_chunks_db: BaseKVStorage[TextChunkSchema],
+    query_param: QueryParam,
+    global_config: dict,
+):
+    memo_hypergraph_inst = _MemoizedHypergraphStorage(knowledge_hypergraph_inst)
+
+    async def build_context(entity_keywords, relation_keywords):
         """
         low_level_context: Retrieves vertices and their first-order neighbor hyperedges.
-        high_level_context: Retrieves hyperedges and their first-order neighbor vertices.
         """
-        entity_context = await _build_entity_query_context(
+        if not entity_keywords:
+            return None
+        return await _build_entity_query_context(
             entity_keywords,
-            knowledge_hypergraph_inst,
+            memo_hypergraph_inst,
             entities_vdb,
             text_chunks_db,
             query_param,
         )
+
     """
-        combine the information from the local_query and global_query,
-        so that we can have the final retrieval information.
+        Perform different actions based on keywords:
+            ll_keywords: Find information based on low-level keywords.
     """
-    context = entity_context.get("context")
-
-    if query_param.only_need_context:
-        return context
-    if context is None:
-        return PROMPTS["fail_response"]
-    define_str = ""
-    if entity_keywords:
-        """
-        High-level keywords serve as qualifiers to the topic information
-        """
-        entity_keywords = entity_keywords if entity_keywords else ""
-        define_str = PROMPTS["rag_define"]
-        define_str = define_str.format(ll_keywords=entity_keywords, hl_keywords="")
-    sys_prompt_temp = PROMPTS["rag_response"]
-    sys_prompt = sys_prompt_temp.format(
-        context_data=context, response_type=query_param.response_type
+    result = await _retrieve_with_keywords(
+        query, build_context, entities_vdb, query_param, global_config
     )
-    response = await use_model_func(
-        query + define_str,
-        system_prompt=sys_prompt,
+    if result is None:
+        return None
+    entity_keywords, _, entity_context = result
+    entity_context = await _summarize_pending_context(
+        entity_context, knowledge_hypergraph_inst, global_config
+    )
+    context = _render_query_context(entity_context)
+    return _build_retrieval(
+        query,
+        context,
+        query_param,
+        context_json={"context": context, **entity_context.to_dict()},
+        entity_keywords=entity_keywords,
     )
-    if len(response) > len(sys_prompt):
-        response = (
-            response.replace(sys_prompt, "")
-            .replace("user", "")
-            .replace("model", "")
-            .replace(query, "")
-            .replace("<system>", "")
-            .replace("</system>", "")
-            .strip()
-        )
-    if query_param.return_type == "json":
-        entity_context["response"] = response
-        response = entity_context
-    return response
 
 
-async def graph_query(
+async def hyper_query_lite(
+    query,
+    knowledge_hypergraph_inst: BaseHypergraphStorage,
+    entities_vdb: BaseVectorStorage,
+    text_chunks_db: BaseKVStorage[TextChunkSchema],
+    query_param: QueryParam,
+    global_config: dict,
+) -> str:
+    retrieval = await hyper_lite_retrieve(
+        query,
+        knowledge_hypergraph_inst,
+        entities_vdb,
+        text_chunks_db,
+        query_param,
+        global_config,
+    )
+    return await _answer(query, retrieval, query_param, global_config)
+
+
+async def graph_retrieve(
     query,
     knowledge_hypergraph_inst: BaseHypergraphStorage,
     entities_vdb: BaseVectorStorage,
@@ -1409,49 +3209,24 @@ async def graph_query(
     """
     检索和返回 hypergraph db 中的成对关系
     """
-    use_model_func = global_config["llm_model_func"]
-    kw_prompt_temp = PROMPTS["keywords_extraction"]
-    kw_prompt = kw_prompt_temp.format(query=query)
-    result = await use_model_func(kw_prompt)
-    try:
-        keywords_data = json.loads(result)
-        entity_keywords = keywords_data.get("low_level_keywords", [])
-        relation_keywords = keywords_data.get("high_level_keywords", [])
-        entity_keywords = ", ".join(entity_keywords)
-        relation_keywords = ", ".join(relation_keywords)
-    except json.JSONDecodeError:
-        try:
-            result = (
-                result.replace(kw_prompt[:-1], "")
-                .replace("user", "")
-                .replace("model", "")
-                .strip()
-            )
-            result = "{" + result.split("{")[1].split("}")[0] + "}"
-            keywords_data = json.loads(result)
-            relation_keywords = keywords_data.get("high_level_keywords", [])
-            entity_keywords = keywords_data.get("low_level_keywords", [])
-            relation_keywords = ", ".join(relation_keywords)
-            entity_keywords = ", ".join(entity_keywords)
-        except json.JSONDecodeError as e:
-            print(f"JSON parsing error: {e}")
-            return PROMPTS["fail_response"]
+    memo_hypergraph_inst = _MemoizedHypergraphStorage(knowledge_hypergraph_inst)
 
     # 只处理二元关系
     def filter_pairwise_edges(edges):
         return [e for e in edges if isinstance(e.get("id_set"), (list, tuple)) and len(e["id_set"]) == 2]
 
-    # 获取所有相关的二元关系
-    relation_context = None
-    if relation_keywords:
+    async def build_context(entity_keywords, relation_keywords):
+        if not relation_keywords:
+            return None
+        # 获取所有相关的二元关系
         results = await relationships_vdb.query(relation_keywords, top_k=query_param.top_k)
         if not len(results):
-            return PROMPTS["fail_response"]
+            return None
         edge_datas = await asyncio.gather(
-            *[knowledge_hypergraph_inst.get_hyperedge(r['id_set']) for r in results]
+            *[memo_hypergraph_inst.get_hyperedge(r['id_set']) for r in results]
         )
         edge_degree = await asyncio.gather(
-            *[knowledge_hypergraph_inst.hyperedge_degree(e['id_set']) for e in results]
+            *[memo_hypergraph_inst.hyperedge_degree(e['id_set']) for e in results]
         )
         edge_datas = [
             {"id_set": k["id_set"], "rank": d, **v}
@@ -1466,19 +3241,20 @@ async def graph_query(
         edge_datas = truncate_list_by_token_size(
             edge_datas,
             key=lambda x: x["description"],
+            count_key=lambda x: x.get("description_tokens"),
             max_token_size=query_param.max_token_for_relation_context,
         )
         # 相关实体
-        entity_names = set()
+        entity_names = {}  # insertion-ordered set
         for e in edge_datas:
             for f in e["id_set"]:
-                if await knowledge_hypergraph_inst.has_vertex(f):
-                    entity_names.add(f)
+                if await memo_hypergraph_inst.has_vertex(f):
+                    entity_names[f] = None
         node_datas = await asyncio.gather(
-            *[knowledge_hypergraph_inst.get_vertex(entity_name) for entity_name in entity_names]
+            *[memo_hypergraph_inst.get_vertex(entity_name) for entity_name in entity_names]
         )
         node_degrees = await asyncio.gather(
-            *[knowledge_hypergraph_inst.vertex_degree(entity_name) for entity_name in entity_names]
+            *[memo_hypergraph_inst.vertex_degree(entity_name) for entity_name in entity_names]
         )
         node_datas = [
             {**n, "entity_name": k, "rank": d}
@@ -1488,6 +3264,7 @@ async def graph_query(
         node_datas = truncate_list_by_token_size(
             node_datas,
             key=lambda x: x["description"],
+            count_key=lambda x: x.get("description_tokens"),
             max_token_size=query_param.max_token_for_entity_context,
         )
         # 相关文本
@@ -1510,188 +3287,55 @@ async def graph_query(
         all_text_units = truncate_list_by_token_size(
             all_text_units,
             key=lambda x: x["data"]["content"],
+            count_key=lambda x: x["data"].get("tokens"),
             max_token_size=query_param.max_token_for_text_unit,
         )
         all_text_units = [t["data"] for t in all_text_units]
         # 格式化 context
-        relations_section_list = [
-            ["id", "entity set", "description", "keywords", "weight", "rank"]
-        ]
-        for i, e in enumerate(edge_datas):
-            relations_section_list.append(
-                [
-                    i,
-                    e["id_set"],
-                    e["description"],
-                    e["keywords"],
-                    e["weight"],
-                    e["rank"],
-                ]
-            )
-        relations_context = list_of_list_to_csv(relations_section_list)
-        entites_section_list = [["id", "entity", "type", "description", "additional properties", "rank"]]
-        for i, n in enumerate(node_datas):
-            entites_section_list.append(
-                [
-                    i,
-                    n["entity_name"],
-                    n.get("entity_type", "UNKNOWN"),
-                    n.get("description", "UNKNOWN"),
-                    n.get("additional_properties", "UNKNOWN"),
-                    n["rank"],
-                ]
-            )
-        entities_context = list_of_list_to_csv(entites_section_list)
-        text_units_section_list = [["id", "content"]]
-        for i, t in enumerate(all_text_units):
-            text_units_section_list.append([i, t["content"]])
-        text_units_context = list_of_list_to_csv(text_units_section_list)
-        context_string = f"""
------Entities-----
-```csv
-{entities_context}
-```
------Relationships-----
-```csv
-{relations_context}
-```
------Sources-----
-```csv
-{text_units_context}
-```
-"""
-        contextJson = {
-            "context": context_string,
-            "entities": [
-                {
-                    "id": i,
-                    "entity_name": n["entity_name"],
-                    "entity_type": n.get("entity_type", "UNKNOWN"),
-                    "description": n.get("description", "UNKNOWN"),
-                    "additional_properties": n.get("additional_properties", "UNKNOWN"),
-                    "rank": n["rank"]
-                }
-                for i, n in enumerate(node_datas)
-            ],
-            "hyperedges": [
-                {
-                    "id": i,
-                    "entity_set": e["id_set"],
-                    "description": e["description"],
-                    "keywords": e["keywords"],
-                    "weight": e["weight"],
-                    "rank": e["rank"]
-                }
-                for i, e in enumerate(edge_datas)
-            ],
-            "text_units": [
-                {
-                    "id": i,
-                    "content": t["content"]
-                }
-                for i, t in enumerate(all_text_units)
-            ]
-        }
-        if query_param.only_need_context:
-            return context_string
-        if context_string is None:
-            return PROMPTS["fail_response"]
-        define_str = ""
-        if entity_keywords or relation_keywords:
-            entity_keywords = entity_keywords if entity_keywords else ""
-            relation_keywords = relation_keywords if relation_keywords else ""
-            define_str = PROMPTS["rag_define"]
-            define_str = define_str.format(ll_keywords=entity_keywords,hl_keywords=relation_keywords)
-        sys_prompt_temp = PROMPTS["rag_response"]
-        sys_prompt = sys_prompt_temp.format(
-            context_data=context_string, response_type=query_param.response_type
-        )
-        response = await use_model_func(
-            query + define_str,
-            system_prompt=sys_prompt,
-        )
-        if len(response) > len(sys_prompt):
-            response = (
-                response.replace(sys_prompt, "")
-                .replace("user", "")
-                .replace("model", "")
-                .replace(query, "")
-                .replace("<system>", "")
-                .replace("</system>", "")
-                .strip()
-            )
-        if query_param.return_type == "json":
-            contextJson["response"] = response
-            response = contextJson
-        return response
-    else:
-        return PROMPTS["fail_response"]
-
-
-def combine_contexts(relation_context, entity_context):
-    # Function to extract entities, relationships, and sources from context strings
-
-    def extract_sections(context):
-        entities_match = re.search(
-            r"-----Entities-----\s*```csv\s*(.*?)\s*```", context, re.DOTALL
-        )
-        relationships_match = re.search(
-            r"-----Relationships-----\s*```csv\s*(.*?)\s*```", context, re.DOTALL
-        )
-        sources_match = re.search(
-            r"-----Sources-----\s*```csv\s*(.*?)\s*```", context, re.DOTALL
-        )
-
-        entities = entities_match.group(1) if entities_match else ""
-        relationships = relationships_match.group(1) if relationships_match else ""
-        sources = sources_match.group(1) if sources_match else ""
-
-        return entities, relationships, sources
-
-    # Extract sections from both contexts
-
-    if relation_context is None:
-        warnings.warn(
-            "High Level context is None. Return empty High_Level entity/relationship/source"
+        return _make_query_context(
+            node_datas, edge_datas, all_text_units, "id_set"
         )
-        hl_entities, hl_relationships, hl_sources = "", "", ""
-    else:
-        hl_entities, hl_relationships, hl_sources = extract_sections(relation_context)
 
-    if entity_context is None:
-        warnings.warn(
-            "Low Level context is None. Return empty Low_Level entity/relationship/source"
-        )
-        ll_entities, ll_relationships, ll_sources = "", "", ""
-    else:
-        ll_entities, ll_relationships, ll_sources = extract_sections(entity_context)
+    result = await _retrieve_with_keywords(
+        query, build_context, entities_vdb, query_param, global_config
+    )
+    if result is None:
+        return None
+    entity_keywords, relation_keywords, query_context = result
+    query_context = await _summarize_pending_context(
+        query_context, knowledge_hypergraph_inst, global_config
+    )
+    context_string = _render_query_context(query_context)
+    return _build_retrieval(
+        query,
+        context_string,
+        query_param,
+        context_json={"context": context_string, **query_context.to_dict()},
+        entity_keywords=entity_keywords,
+        relation_keywords=relation_keywords,
+    )
 
-    # Combine and deduplicate the entities
-    combined_entities = process_combine_contexts(hl_entities, ll_entities)
 
-    # Combine and deduplicate the relationships
-    combined_relationships = process_combine_contexts(
-        hl_relationships, ll_relationships
+async def graph_query(
+    query,
+    knowledge_hypergraph_inst: BaseHypergraphStorage,
+    entities_vdb: BaseVectorStorage,
+    relationships_vdb: BaseVectorStorage,
+    text_chunks_db: BaseKVStorage[TextChunkSchema],
+    query_param: QueryParam,
+    global_config: dict,
+):
+    retrieval = await graph_retrieve(
+        query,
+        knowledge_hypergraph_inst,
+        entities_vdb,
+        relationships_vdb,
+        text_chunks_db,
+        query_param,
+        global_config,
     )
+    return await _answer(query, retrieval, query_param, global_config)
 
-    # Combine and deduplicate the sources
-    combined_sources = process_combine_contexts(hl_sources, ll_sources)
-
-    # Format the combined context
-    return f"""
------Entities-----
-```csv
-{combined_entities}
-```
------Relationships-----
-```csv
-{combined_relationships}
-```
------Sources-----
-```csv
-{combined_sources}
-```
-"""
 
 def remove_after_sources(input_string: str) -> str:
     """
@@ -1703,87 +3347,139 @@ def remove_after_sources(input_string: str) -> str:
         return input_string[:index]  # 返回该位置之前的内容
     return input_string  # 如果没有找到，返回原始字符串
 
-async def naive_query(
+
+async def naive_retrieve(
     query,
     chunks_vdb: BaseVectorStorage,
     text_chunks_db: BaseKVStorage[TextChunkSchema],
     query_param: QueryParam,
     global_config: dict,
 ):
-    use_model_func = global_config["llm_model_func"]
     results = await chunks_vdb.query(query, top_k=query_param.top_k)
     if not len(results):
-        return PROMPTS["fail_response"]
+        return None
     chunks_ids = [r["id"] for r in results]
     chunks = await text_chunks_db.get_by_ids(chunks_ids)
+    chunks = [c for c in chunks if c is not None]
 
     maybe_trun_chunks = truncate_list_by_token_size(
         chunks,
         key=lambda x: x["content"],
+        count_key=lambda x: x.get("tokens"),
         max_token_size=query_param.max_token_for_text_unit,
     )
     logger.info(f"Truncate {len(chunks)} to {len(maybe_trun_chunks)} chunks")
     section = "--New Chunk--\n".join([c["content"] for c in maybe_trun_chunks])
-    if query_param.only_need_context:
-        return section
-    sys_prompt_temp = PROMPTS["naive_rag_response"]
-    sys_prompt = sys_prompt_temp.format(
-        content_data=section, response_type=query_param.response_type
-    )
-    response = await use_model_func(
-        query,
-        system_prompt=sys_prompt,
+    return _build_retrieval(
+        query, section, query_param, prompt_key="naive_rag_response"
     )
 
-    if len(response) > len(sys_prompt):
-        response = (
-            response[len(sys_prompt) :]
-            .replace(sys_prompt, "")
-            .replace("user", "")
-            .replace("model", "")
-            .replace(query, "")
-            .replace("<system>", "")
-            .replace("</system>", "")
-            .strip()
-        )
-    if query_param.return_type == "json":
-        response = {
-            "response": response,
-        }
-    return response
 
+async def naive_query(
+    query,
+    chunks_vdb: BaseVectorStorage,
+    text_chunks_db: BaseKVStorage[TextChunkSchema],
+    query_param: QueryParam,
+    global_config: dict,
+):
+    retrieval = await naive_retrieve(
+        query, chunks_vdb, text_chunks_db, query_param, global_config
+    )
+    return await _answer(query, retrieval, query_param, global_config)
 
-async def llm_query(
+
+async def community_retrieve(
     query,
+    communities_vdb: BaseVectorStorage,
+    community_reports: BaseKVStorage,
     query_param: QueryParam,
     global_config: dict,
 ):
     """
-    只调用 LLM，不进行任何数据查询。
+    Retrieve the precomputed community reports matching the query. Returns
+    ``None`` when no report matches, or community summaries are disabled, so
+    the caller can fall back to hypergraph retrieval.
     """
-    use_model_func = global_config["llm_model_func"]
-    sys_prompt_temp = PROMPTS["rag_response"]
-    sys_prompt = sys_prompt_temp.format(
-        context_data="", response_type=query_param.response_type
+    if communities_vdb is None:
+        return None
+    results = await communities_vdb.query(query, top_k=query_param.top_k)
+    if not len(results):
+        return None
+    reports = await community_reports.get_by_ids([r["id"] for r in results])
+    reports = [
+        {"id": r["id"], **c} for r, c in zip(results, reports) if c is not None
+    ]
+    if not reports:
+        return None
+    reports = truncate_list_by_token_size(
+        reports,
+        key=lambda x: x["report"],
+        max_token_size=query_param.max_token_for_relation_context,
     )
-    response = await use_model_func(
+    communities_section_list = [["id", "title", "report", "size"]]
+    for i, c in enumerate(reports):
+        communities_section_list.append(
+            [i, c["title"], c["report"], len(c["entities"])]
+        )
+    communities_context = list_of_list_to_csv(communities_section_list)
+    context = f"""
+-----Communities-----
+```csv
+{communities_context}
+```
+"""
+    return _build_retrieval(
         query,
-        system_prompt=sys_prompt,
+        context,
+        query_param,
+        context_json={
+            "communities": [
+                {
+                    "id": i,
+                    "title": c["title"],
+                    "report": c["report"],
+                    "entities": c["entities"],
+                }
+                for i, c in enumerate(reports)
+            ]
+        },
     )
-    if len(response) > len(sys_prompt):
-        response = (
-            response.replace(sys_prompt, "")
-            .replace("user", "")
-            .replace("model", "")
-            .replace(query, "")
-            .replace("<system>", "")
-            .replace("</system>", "")
-            .strip()
-        )
-    if query_param.return_type == "json":
-        response = {
-            "response": response,
-        }
-    return response
 
 
+async def community_query(
+    query,
+    communities_vdb: BaseVectorStorage,
+    community_reports: BaseKVStorage,
+    query_param: QueryParam,
+    global_config: dict,
+):
+    """
+    Answer from the precomputed community reports. Returns ``None`` when no
+    report matches so the caller can fall back to hypergraph retrieval.
+    """
+    retrieval = await community_retrieve(
+        query, communities_vdb, community_reports, query_param, global_config
+    )
+    if retrieval is None:
+        return None
+    return await _answer(query, retrieval, query_param, global_config)
+
+
+async def llm_retrieve(
+    query,
+    query_param: QueryParam,
+    global_config: dict,
+):
+    return _build_retrieval(query, "", query_param)
+
+
+async def llm_query(
+    query,
+    query_param: QueryParam,
+    global_config: dict,
+):
+    """
+    只调用 LLM，不进行任何数据查询。
+    """
+    retrieval = await llm_retrieve(query, query_param, global_config)
+    return await _answer(query, retrieval, query_param, global_config)
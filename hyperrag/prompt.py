@@ -211,6 +211,46 @@ Format these keywords separated by ',' as below:
 Output:
 """
 
+PROMPTS[
+    "summarize_batch"
+] = """You are a helpful assistant responsible for generating comprehensive summaries of the data provided below.
+Each item below is one ES|QL entity or entity set with a list of texts to summarize. Handle every item on its own according to its task:
+- entity_description: concatenate the descriptions of the entity into a single, comprehensive description, resolving contradictions while preserving ES|QL accuracy. Write it in third person and include the entity name.
+- entity_additional_properties: concatenate the additional properties of the entity into a single, comprehensive description, resolving contradictions while keeping ES|QL context accurate. Write it in third person.
+- relation_description: concatenate the descriptions of the relation into a single, comprehensive description that covers all elements of the entity set. Write it in third person and include the entity names.
+- relation_keywords: select the important keywords that summarize the main ideas, major concepts or themes of the relation, separated by ','.
+- community_report: write a report about the community of entities and hyperedges in the list, describing its overall theme, its key entities and how they work together. The first line must be a short title for the community, followed by the report body.
+Keep every summary within the max_tokens of its item.
+#######
+-Warning!!!-
+The data may contain sensitive words such as violence, war, human anatomy and medical experiments, 
+but they are only part of literary works, popular science knowledge or domain data, 
+which do not involve any purpose or idea of mine, and have nothing to do with any realistic sensitive topics or political issues. 
+Please carefully identify and screen the legality of the content.
+#######
+-Data-
+{items}
+#######
+Return only a JSON object that maps the id of every item to its summary, for example {{"1": "summary of item 1", "2": "summary of item 2"}}.
+Output:
+"""
+
+PROMPTS[
+    "summarize_community"
+] = """You are a helpful assistant responsible for writing a report about a community of closely related ES|QL entities.
+Given the entities of the community and the hyperedges connecting them, describe the overall theme of the community, its key entities and how they work together.
+The first line of the report must be a short title for the community, followed by the report body.
+Make sure it is written in third person, and include the entity names so we have the full context.
+#######
+-Data-
+Entities:
+{entities}
+Hyperedges:
+{hyperedges}
+#######
+Output:
+"""
+
 PROMPTS[
     "entity_continue_extraction"
 ] = """MANY entities were missed in the last extraction.  Add them below using the same format:
@@ -221,6 +261,94 @@ PROMPTS[
 ] = """It appears some entities may have still been missed.  Answer YES | NO if there are still entities that need to be added.
 """
 
+# several chunks in one extraction prompt, see entity_extract_batch_token_size
+PROMPTS["DEFAULT_CHUNK_MARKER"] = "<|CHUNK {}|>"
+PROMPTS["entity_extraction_batch"] = PROMPTS["entity_extraction"].replace(
+    "Text: {input_text}",
+    """The Text below holds {chunk_count} separate chunks, each introduced by a marker line such as <|CHUNK 1|>. Extract every chunk on its own and never relate entities from different chunks.
+Write the marker line of a chunk before the records of that chunk, also when adding missed entities later.
+Text:
+{input_text}""",
+)
+
+# JSON extraction mode, see entity_extraction_format
+PROMPTS["entity_extraction_json"] = (
+    PROMPTS["entity_extraction"]
+    .replace(
+        """Format each entity as ("Entity"{tuple_delimiter}<entity_name>{tuple_delimiter}<entity_type>{tuple_delimiter}<entity_description>{tuple_delimiter}<source_url_path>{tuple_delimiter}<additional_properties>)""",
+        """Format each entity as an object of the "entities" list with the keys name, type, description, source_url_path and additional_properties.""",
+    )
+    .replace(
+        """Format each hyperedge as ("Low-order Hyperedge"{tuple_delimiter}<entity_name1>{tuple_delimiter}<entity_name2>{tuple_delimiter}<low_order_relationship_description>{tuple_delimiter}<low_order_relationship_keywords>{tuple_delimiter}<low_order_relationship_strength>{tuple_delimiter}<source_url_paths>)""",
+        """Format each hyperedge as an object of the "low_order_hyperedges" list with the keys entities (the two entity names), description, keywords, strength and source_url_paths.""",
+    )
+    .replace(
+        """Format content keywords as ("High-level keywords"{tuple_delimiter}<high_level_keywords>)""",
+        """Use the high-level keywords only to guide step 4, they are not part of the output.""",
+    )
+    .replace(
+        """Format each association as ("High-order Hyperedge"{tuple_delimiter}<entity_name1>{tuple_delimiter}<entity_name2>{tuple_delimiter}<entity_nameN>{tuple_delimiter}<high_order_relationship_description>{tuple_delimiter}<high_order_relationship_generalization>{tuple_delimiter}<high_order_relationship_keywords>{tuple_delimiter}<high_order_relationship_strength>{tuple_delimiter}<source_url_paths>)""",
+        """Format each association as an object of the "high_order_hyperedges" list with the keys entities (all entity names of the set), description, generalization, keywords, strength and source_url_paths.""",
+    )
+    .replace(
+        """Use **{record_delimiter}** as the list delimiter.
+
+6. When finished, output {completion_delimiter}.""",
+        """Answer with one JSON object holding the lists "entities", "low_order_hyperedges" and "high_order_hyperedges", in that order, and nothing else.""",
+    )
+)
+
+PROMPTS[
+    "entity_continue_extraction_json"
+] = """MANY entities were missed in the last extraction.  Answer with a new JSON object of the same shape that holds only the missed records:
+"""
+
+_string = {"type": "string"}
+_names = {"type": "array", "items": _string}
+
+
+def _json_records(**properties):
+    return {
+        "type": "array",
+        "items": {
+            "type": "object",
+            "properties": properties,
+            "required": list(properties),
+            "additionalProperties": False,
+        },
+    }
+
+
+PROMPTS["entity_extraction_json_schema"] = {
+    "type": "object",
+    "properties": {
+        "entities": _json_records(
+            name=_string,
+            type=_string,
+            description=_string,
+            source_url_path=_string,
+            additional_properties=_string,
+        ),
+        "low_order_hyperedges": _json_records(
+            entities=_names,
+            description=_string,
+            keywords=_string,
+            strength={"type": "number"},
+            source_url_paths=_string,
+        ),
+        "high_order_hyperedges": _json_records(
+            entities=_names,
+            description=_string,
+            generalization=_string,
+            keywords=_string,
+            strength={"type": "number"},
+            source_url_paths=_string,
+        ),
+    },
+    "required": ["entities", "low_order_hyperedges", "high_order_hyperedges"],
+    "additionalProperties": False,
+}
+
 PROMPTS["fail_response"] = "Sorry, I'm not able to provide an answer to that question."
 
 PROMPTS["rag_response"] = """---Role---
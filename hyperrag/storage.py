@@ -1,7 +1,10 @@
 import asyncio
+import heapq
 import html
+import math
 import os
-from dataclasses import dataclass
+import random
+from dataclasses import dataclass, field
 from typing import Any, Union, cast, List, Set, Tuple, Optional, Dict
 import numpy as np
 from nano_vectordb import NanoVectorDB
@@ -97,9 +100,15 @@ class NanoVectorDBStorage(BaseVectorStorage):
         results = self._client.upsert(datas=list_data)
         return results
 
+    async def delete(self, ids: list[str]):
+        logger.info(f"Deleting {len(ids)} vectors from {self.namespace}")
+        self._client.delete(list(ids))
+
     async def query(self, query: str, top_k=5):
         embedding = await self.embedding_func([query])
-        embedding = embedding[0]
+        return await self.query_by_embedding(embedding[0], top_k=top_k)
+
+    async def query_by_embedding(self, embedding, top_k=5):
         results = self._client.query(
             query=embedding,
             top_k=top_k,
@@ -114,6 +123,210 @@ class NanoVectorDBStorage(BaseVectorStorage):
         self._client.save()
 
 
+def _pad(array: np.ndarray, size: int) -> np.ndarray:
+    return np.concatenate([array, np.zeros(size - len(array), dtype=array.dtype)])
+
+
+@dataclass
+class HypergraphIncidenceIndex:
+    """
+        Compact integer index over the vertex-hyperedge incidence of a hypergraph.
+
+        Incidences are kept as COO position arrays so that vertex -> hyperedge and
+        hyperedge -> vertex propagation are single ``np.bincount`` calls. New
+        vertices and hyperedges are appended in place; removals require a rebuild.
+    """
+
+    vertex_ids: list = field(default_factory=list)
+    vertex_pos: dict = field(default_factory=dict)
+    edge_ids: list = field(default_factory=list)
+    edge_pos: dict = field(default_factory=dict)
+    edge_weight: list = field(default_factory=list)
+    inc_v: list = field(default_factory=list)
+    inc_e: list = field(default_factory=list)
+    version: int = 0
+
+    def __post_init__(self):
+        self._arrays = None
+        self._arrays_version = -1
+        self._reweighted = set()
+
+    @property
+    def num_v(self) -> int:
+        return len(self.vertex_ids)
+
+    @property
+    def num_e(self) -> int:
+        return len(self.edge_ids)
+
+    def add_vertex(self, v_id: Any) -> int:
+        if v_id not in self.vertex_pos:
+            self.vertex_pos[v_id] = len(self.vertex_ids)
+            self.vertex_ids.append(v_id)
+            self._touch()
+        return self.vertex_pos[v_id]
+
+    def add_hyperedge(self, e_tuple: Tuple, weight: float = 1.0) -> int:
+        if e_tuple in self.edge_pos:
+            e_pos = self.edge_pos[e_tuple]
+            if self.edge_weight[e_pos] == float(weight):
+                # e.g. a summary write-back: nothing the walk depends on changed
+                return e_pos
+            self.edge_weight[e_pos] = float(weight)
+            self._reweighted.add(e_pos)
+        else:
+            e_pos = len(self.edge_ids)
+            self.edge_pos[e_tuple] = e_pos
+            self.edge_ids.append(e_tuple)
+            self.edge_weight.append(float(weight))
+            for v_id in e_tuple:
+                self.inc_v.append(self.add_vertex(v_id))
+                self.inc_e.append(e_pos)
+        self._touch()
+        return e_pos
+
+    def _touch(self):
+        self.version += 1
+
+    def arrays(self) -> dict:
+        """
+            Return the numpy views of the index. After changes, the cached arrays
+            are extended by the appended incidences and reweighted hyperedges
+            instead of being converted from the lists again.
+        """
+        if self._arrays is None:
+            self._arrays = self._build_arrays()
+        elif self._arrays_version != self.version:
+            self._arrays = self._extend_arrays(self._arrays)
+        self._arrays_version = self.version
+        self._reweighted.clear()
+        return self._arrays
+
+    def _build_arrays(self) -> dict:
+        inc_v = np.asarray(self.inc_v, dtype=np.int64)
+        inc_e = np.asarray(self.inc_e, dtype=np.int64)
+        edge_weight = np.maximum(np.asarray(self.edge_weight, dtype=np.float64), 1e-6)
+        return self._with_probabilities(
+            dict(
+                inc_v=inc_v,
+                inc_e=inc_e,
+                edge_weight=edge_weight,
+                v_degree=np.bincount(inc_v, minlength=self.num_v).astype(np.float64),
+                e_degree=np.bincount(inc_e, minlength=self.num_e).astype(np.float64),
+                v_weight=np.bincount(inc_v, weights=edge_weight[inc_e], minlength=self.num_v),
+            )
+        )
+
+    def _extend_arrays(self, a: dict) -> dict:
+        known = len(a["inc_v"])
+        new_v = np.asarray(self.inc_v[known:], dtype=np.int64)
+        new_e = np.asarray(self.inc_e[known:], dtype=np.int64)
+        old_weight = a["edge_weight"]
+        edge_weight = np.concatenate(
+            [
+                old_weight,
+                np.maximum(
+                    np.asarray(self.edge_weight[len(old_weight) :], dtype=np.float64), 1e-6
+                ),
+            ]
+        )
+        v_weight = _pad(a["v_weight"], self.num_v)
+        reweighted = np.fromiter(
+            (e for e in self._reweighted if e < len(old_weight)), dtype=np.int64
+        )
+        if reweighted.size:
+            delta = np.zeros(len(old_weight))
+            delta[reweighted] = (
+                np.maximum([self.edge_weight[e] for e in reweighted], 1e-6)
+                - old_weight[reweighted]
+            )
+            edge_weight[reweighted] += delta[reweighted]
+            v_weight += np.bincount(
+                a["inc_v"], weights=delta[a["inc_e"]], minlength=self.num_v
+            )
+        v_weight += np.bincount(new_v, weights=edge_weight[new_e], minlength=self.num_v)
+        return self._with_probabilities(
+            dict(
+                inc_v=np.concatenate([a["inc_v"], new_v]),
+                inc_e=np.concatenate([a["inc_e"], new_e]),
+                edge_weight=edge_weight,
+                v_degree=_pad(a["v_degree"], self.num_v)
+                + np.bincount(new_v, minlength=self.num_v),
+                e_degree=_pad(a["e_degree"], self.num_e)
+                + np.bincount(new_e, minlength=self.num_e),
+                v_weight=v_weight,
+            )
+        )
+
+    @staticmethod
+    def _with_probabilities(a: dict) -> dict:
+        # transition probabilities of the bipartite random walk, per incidence
+        a["v_to_e_prob"] = a["edge_weight"][a["inc_e"]] / np.maximum(
+            a["v_weight"][a["inc_v"]], 1e-12
+        )
+        a["e_to_v_prob"] = 1.0 / np.maximum(a["e_degree"][a["inc_e"]], 1.0)
+        return a
+
+    def vertex_to_hyperedge(self, x: np.ndarray) -> np.ndarray:
+        """Weighted mean of the vertex scores inside each hyperedge."""
+        a = self.arrays()
+        y = np.bincount(a["inc_e"], weights=x[a["inc_v"]], minlength=self.num_e)
+        return y * a["edge_weight"] / np.maximum(a["e_degree"], 1.0)
+
+    def hyperedge_to_vertex(self, y: np.ndarray) -> np.ndarray:
+        """Mean of the incident hyperedge scores of each vertex."""
+        a = self.arrays()
+        x = np.bincount(a["inc_v"], weights=y[a["inc_e"]], minlength=self.num_v)
+        return x / np.maximum(a["v_degree"], 1.0)
+
+    def personalized_pagerank(
+        self,
+        vertex_seeds: Dict[int, float],
+        edge_seeds: Dict[int, float],
+        alpha: float = 0.15,
+        max_iter: int = 30,
+        tol: float = 1e-6,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+            Random walk with restart on the vertex-hyperedge bipartite graph.
+
+            A vertex moves to an incident hyperedge proportionally to its weight,
+            a hyperedge moves to one of its vertices uniformly, and with
+            probability ``alpha`` the walk restarts at the seeds. Mass lost at
+            isolated vertices is returned to the seeds.
+        """
+        a = self.arrays()
+        s_v = np.zeros(self.num_v)
+        s_e = np.zeros(self.num_e)
+        for pos, score in vertex_seeds.items():
+            s_v[pos] += max(score, 0.0)
+        for pos, score in edge_seeds.items():
+            s_e[pos] += max(score, 0.0)
+        total = s_v.sum() + s_e.sum()
+        if total <= 0:
+            return s_v, s_e
+        s_v /= total
+        s_e /= total
+        p_v, p_e = s_v.copy(), s_e.copy()
+        for _ in range(max_iter):
+            n_e = np.bincount(
+                a["inc_e"], weights=p_v[a["inc_v"]] * a["v_to_e_prob"], minlength=self.num_e
+            )
+            n_v = np.bincount(
+                a["inc_v"], weights=p_e[a["inc_e"]] * a["e_to_v_prob"], minlength=self.num_v
+            )
+            n_v = (1 - alpha) * n_v + alpha * s_v
+            n_e = (1 - alpha) * n_e + alpha * s_e
+            leaked = 1.0 - n_v.sum() - n_e.sum()
+            n_v += leaked * s_v
+            n_e += leaked * s_e
+            delta = np.abs(n_v - p_v).sum() + np.abs(n_e - p_e).sum()
+            p_v, p_e = n_v, n_e
+            if delta < tol:
+                break
+        return p_v, p_e
+
+
 @dataclass
 class HypergraphStorage(BaseHypergraphStorage):
 
@@ -142,6 +355,8 @@ class HypergraphStorage(BaseHypergraphStorage):
                 f"Loaded hypergraph from {self._hgdb_file} with {preloaded_hypergraph.num_v} vertices, {preloaded_hypergraph.num_e} hyperedges"
             )
         self._hg = preloaded_hypergraph or HypergraphDB()
+        self._incidence_index = None
+        self._version = 0
 
     async def index_done_callback(self):
         HypergraphStorage.write_hypergraph(self._hg, self._hgdb_file)
@@ -171,17 +386,51 @@ class HypergraphStorage(BaseHypergraphStorage):
         return self._hg.num_e
 
     async def upsert_vertex(self, v_id: Any, v_data: Optional[Dict] = None) :
-        return self._hg.add_v(v_id, v_data)
+        result = self._hg.add_v(v_id, v_data)
+        self._version += 1
+        if self._incidence_index is not None:
+            self._incidence_index.add_vertex(v_id)
+        return result
 
     async def upsert_hyperedge(self, e_tuple: Union[List, Set, Tuple], e_data: Optional[Dict] = None) :
-        return self._hg.add_e(e_tuple, e_data)
+        result = self._hg.add_e(e_tuple, e_data)
+        self._version += 1
+        if self._incidence_index is not None:
+            e_key = tuple(sorted(set(e_tuple)))
+            self._incidence_index.add_hyperedge(
+                e_key, (self._hg.e(e_key) or {}).get("weight", 1.0)
+            )
+        return result
 
     async def remove_vertex(self, v_id: Any) :
+        self._incidence_index = None
+        self._version += 1
         return self._hg.remove_v(v_id)
 
     async def remove_hyperedge(self, e_tuple: Union[List, Set, Tuple]) :
+        self._incidence_index = None
+        self._version += 1
         return self._hg.remove_e(e_tuple)
 
+    async def get_version(self) -> int:
+        return self._version
+
+    async def get_incidence_index(self) -> HypergraphIncidenceIndex:
+        """
+            Return the compact incidence index, built on first use and kept in
+            sync with later upserts.
+        """
+        if self._incidence_index is None:
+            index = HypergraphIncidenceIndex()
+            for v_id in sorted(self._hg.all_v):
+                index.add_vertex(v_id)
+            for e_tuple in sorted(self._hg.all_e):
+                index.add_hyperedge(
+                    e_tuple, (self._hg.e(e_tuple) or {}).get("weight", 1.0)
+                )
+            self._incidence_index = index
+        return self._incidence_index
+
     async def vertex_degree(self, v_id: Any) -> int:
         return self._hg.degree_v(v_id)
 
@@ -194,6 +443,43 @@ class HypergraphStorage(BaseHypergraphStorage):
         """
         return self._hg.nbr_e_of_v(e_tuple)
 
+    async def get_nbr_e_of_vertex_sampled(
+        self, v_id: Any, max_num: int, strategy: str = "top_weight"
+    ) -> list:
+        """
+            Return at most ``max_num`` incident hyperedges of the vertex.
+
+            ``top_weight`` keeps the heaviest hyperedges, ``degree_normalized``
+            divides the weight by the degree of the other member vertices so
+            hyperedges leading into further hubs rank lower, and
+            ``weighted_reservoir`` draws a weighted sample (Efraimidis-Spirakis)
+            seeded by the vertex id so repeated queries see the same sample.
+        """
+        nbr_e = self._hg.nbr_e_of_v(v_id)
+        if max_num <= 0 or len(nbr_e) <= max_num:
+            return list(nbr_e)
+
+        def weight(e_tuple) -> float:
+            e_data = self._hg.e(e_tuple) or {}
+            return max(float(e_data.get("weight", 1.0) or 0.0), 1e-6)
+
+        if strategy == "top_weight":
+            return heapq.nlargest(max_num, nbr_e, key=weight)
+        if strategy == "degree_normalized":
+            def score(e_tuple) -> float:
+                nbr_degree = sum(self._hg.degree_v(u) for u in e_tuple if u != v_id)
+                return weight(e_tuple) / math.sqrt(1 + nbr_degree)
+
+            return heapq.nlargest(max_num, nbr_e, key=score)
+        if strategy == "weighted_reservoir":
+            rng = random.Random(str(v_id))
+            keyed = [
+                (rng.random() ** (1.0 / weight(e_tuple)), e_tuple)
+                for e_tuple in sorted(nbr_e)
+            ]
+            return [e_tuple for _, e_tuple in heapq.nlargest(max_num, keyed)]
+        raise ValueError(f"Unknown hyperedge sampling strategy {strategy}")
+
     async def get_nbr_v_of_hyperedge(self, v_id: Any, exclude_self=True) -> list:
         """
             Return the incident vertices of the hyperedge.
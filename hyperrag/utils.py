@@ -6,11 +6,14 @@ import json
 import logging
 import os
 import re
+import sys
+from collections import Counter, OrderedDict
 from collections.abc import Mapping, Sequence
-from dataclasses import dataclass
-from functools import wraps
+from dataclasses import dataclass, field
+from functools import lru_cache, wraps
 from hashlib import md5
 from typing import Any, Protocol, Union, List
+import zlib
 import xml.etree.ElementTree as ET
 
 import numpy as np
@@ -27,6 +30,19 @@ class Tokenizer(Protocol):
     def decode(self, tokens: list[str]) -> str:
         """Reconstruct a string from the provided tokens."""
 
+    def count_tokens(self, text: str) -> int:
+        """Return ``len(self.encode(text))``, ideally without building the list.
+
+        Optional: tokenizers without it are counted through ``encode``.
+        """
+
+    def token_offsets(self, text: str):
+        """Return the character offset of every token followed by ``len(text)``.
+
+        Optional: derived from ``encode`` when the tokens concatenate back to
+        the text.
+        """
+
 
 class RegexTokenizer:
     """A lightweight regex-based tokenizer compatible with generic LLMs.
@@ -48,6 +64,50 @@ class RegexTokenizer:
             return ""
         return "".join(tokens)
 
+    def count_tokens(self, text: str) -> int:
+        # Tokens alternate between whitespace and non-whitespace runs, so the
+        # count follows from the number of words and the two ends of the text.
+        if not text:
+            return 0
+        words = len(text.split())
+        if not words:
+            return 1
+        return 2 * words - 1 + text[0].isspace() + text[-1].isspace()
+
+    def token_offsets(self, text: str, block_size: int = 1 << 22) -> np.ndarray:
+        # A token starts wherever the text switches between whitespace and
+        # non-whitespace; find the switches on code point arrays block by block.
+        dtype = np.int32 if len(text) < 2**31 else np.int64
+        if not text:
+            return np.zeros(1, dtype=dtype)
+        whitespace = _unicode_whitespace_table()
+        parts = [np.zeros(1, dtype=dtype)]
+        previous = None
+        for start in range(0, len(text), block_size):
+            # surrogatepass keeps lone surrogates (e.g. from bad PDF text) encodable
+            codes = np.frombuffer(
+                text[start : start + block_size].encode("utf-32-le", "surrogatepass"),
+                dtype=np.uint32,
+            )
+            is_space = whitespace[np.minimum(codes, len(whitespace) - 1)]
+            if previous is not None and is_space[0] != previous:
+                parts.append(np.array([start], dtype=dtype))
+            switches = np.flatnonzero(is_space[1:] != is_space[:-1]) + 1 + start
+            parts.append(switches.astype(dtype, copy=False))
+            previous = is_space[-1]
+        parts.append(np.array([len(text)], dtype=dtype))
+        return np.concatenate(parts)
+
+
+@lru_cache(maxsize=1)
+def _unicode_whitespace_table() -> np.ndarray:
+    # table[c] tells whether code point c is whitespace; the extra last entry
+    # (False) stands for every code point above the largest whitespace one.
+    spaces = [c for c in range(sys.maxunicode + 1) if chr(c).isspace()]
+    table = np.zeros(max(spaces) + 2, dtype=bool)
+    table[spaces] = True
+    return table
+
 
 _TOKENIZER: Tokenizer = RegexTokenizer()
 
@@ -57,6 +117,7 @@ def set_tokenizer(tokenizer: Tokenizer):
 
     global _TOKENIZER
     _TOKENIZER = tokenizer
+    _count_tokens_cached.cache_clear()
 
 
 def get_tokenizer() -> Tokenizer:
@@ -108,6 +169,92 @@ def convert_response_to_json(response: str) -> dict:
         raise e from None
 
 
+_JSON_STRUCTURE = re.compile(r'[{}\[\]":]')
+_JSON_STRING_END = re.compile(r'["\\]')
+
+
+class JsonRecordStream:
+    """
+    Incremental parser for answers shaped like ``{"section": [{...}, ...]}``.
+
+    ``feed`` takes the text as it arrives and returns the ``(section, record)``
+    pairs whose objects were completed by it. Text around the top-level
+    objects (code fences, a second object appended by gleaning) is skipped,
+    and a truncated answer keeps every record completed before the cut.
+    """
+
+    def __init__(self):
+        self._text = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._string_start = None
+        self._last_string = None
+        self._section = None
+        self._record_start = None
+
+    def feed(self, text: str) -> list[tuple[str, dict]]:
+        self._text += text
+        text, pos, records = self._text, self._pos, []
+        while True:
+            if self._in_string:
+                match = _JSON_STRING_END.search(text, pos)
+                if match is None:
+                    pos = len(text)
+                    break
+                if match.group() == "\\":
+                    if match.end() == len(text):
+                        # the escaped character has not arrived yet
+                        pos = match.start()
+                        break
+                    pos = match.end() + 1
+                    continue
+                self._in_string = False
+                pos = match.end()
+                if self._depth == 1:
+                    self._last_string = text[self._string_start : pos]
+                continue
+            match = _JSON_STRUCTURE.search(text, pos)
+            if match is None:
+                pos = len(text)
+                break
+            char, pos = match.group(), match.end()
+            if char == '"':
+                if self._depth:
+                    self._in_string = True
+                    self._string_start = match.start()
+            elif char in "{[":
+                self._depth += 1
+                if self._depth == 3 and char == "{":
+                    self._record_start = match.start()
+            elif char in "}]":
+                if self._depth == 3 and self._record_start is not None:
+                    try:
+                        record = json.loads(text[self._record_start : pos])
+                    except ValueError:
+                        record = None
+                    if isinstance(record, dict):
+                        records.append((self._section, record))
+                    self._record_start = None
+                self._depth = max(self._depth - 1, 0)
+            elif self._depth == 1 and self._last_string is not None:
+                self._section = json.loads(self._last_string)
+                self._last_string = None
+        # keep only the text of an unfinished record or key
+        keep = [pos]
+        if self._record_start is not None:
+            keep.append(self._record_start)
+        if self._in_string and self._depth == 1:
+            keep.append(self._string_start)
+        cut = min(keep)
+        self._text, self._pos = text[cut:], pos - cut
+        if self._record_start is not None:
+            self._record_start -= cut
+        if self._string_start is not None:
+            self._string_start -= cut
+        return records
+
+
 def compute_args_hash(*args):
     return md5(str(args).encode()).hexdigest()
 
@@ -123,6 +270,16 @@ def limit_async_func_call(max_size: int, waitting_time: float = 0.0001):
         """Not using async.Semaphore to aovid use nest-asyncio"""
         __current_size = 0
 
+        async def hold_while_streaming(stream):
+            # a streamed answer keeps its slot until it is read or closed
+            nonlocal __current_size
+            try:
+                async for item in stream:
+                    yield item
+            finally:
+                __current_size -= 1
+                await stream.aclose()
+
         @wraps(func)
         async def wait_func(*args, **kwargs):
             nonlocal __current_size
@@ -130,6 +287,8 @@ def limit_async_func_call(max_size: int, waitting_time: float = 0.0001):
                 await asyncio.sleep(waitting_time)
             __current_size += 1
             result = await func(*args, **kwargs)
+            if hasattr(result, "aclose"):
+                return hold_while_streaming(result)
             __current_size -= 1
             return result
 
@@ -138,6 +297,180 @@ def limit_async_func_call(max_size: int, waitting_time: float = 0.0001):
     return final_decro
 
 
+@dataclass
+class LRUCache:
+    """Bounded least-recently-used mapping with hit/miss counters."""
+
+    max_size: int = 128
+    hits: int = 0
+    misses: int = 0
+    _data: OrderedDict = field(default_factory=OrderedDict, repr=False)
+
+    def get(self, key, default=None):
+        if key not in self._data:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._data.move_to_end(key)
+        return self._data[key]
+
+    def put(self, key, value):
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+@dataclass
+class SemanticCache:
+    """
+    Small in-memory vector index of past questions. A lookup returns the value
+    stored for the most similar question of the same scope when the cosine
+    similarity reaches ``threshold``; the least recently used entry is evicted
+    once ``max_size`` is exceeded. Hits and misses are counted per label.
+    """
+
+    max_size: int = 256
+    threshold: float = 0.95
+    hits: Counter = field(default_factory=Counter)
+    misses: Counter = field(default_factory=Counter)
+    _data: OrderedDict = field(default_factory=OrderedDict, repr=False)
+    _next_id: int = field(default=0, repr=False)
+
+    @staticmethod
+    def _normalize(embedding) -> np.ndarray:
+        embedding = np.asarray(embedding, dtype=np.float32).ravel()
+        norm = np.linalg.norm(embedding)
+        return embedding / norm if norm > 0 else embedding
+
+    def get(self, scope, embedding, label=None):
+        candidates = [k for k, (s, _, _) in self._data.items() if s == scope]
+        if candidates:
+            matrix = np.stack([self._data[k][1] for k in candidates])
+            scores = matrix @ self._normalize(embedding)
+            best = int(np.argmax(scores))
+            if scores[best] >= self.threshold:
+                self.hits[label] += 1
+                self._data.move_to_end(candidates[best])
+                return self._data[candidates[best]][2]
+        self.misses[label] += 1
+        return None
+
+    def put(self, scope, embedding, value):
+        self._data[self._next_id] = (scope, self._normalize(embedding), value)
+        self._next_id += 1
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self) -> dict:
+        return {
+            label: {
+                "hits": self.hits[label],
+                "misses": self.misses[label],
+                "hit_rate": round(
+                    self.hits[label] / max(self.hits[label] + self.misses[label], 1), 4
+                ),
+            }
+            for label in sorted(set(self.hits) | set(self.misses), key=str)
+        }
+
+    def __len__(self):
+        return len(self._data)
+
+
+def normalize_query(query: str) -> str:
+    return " ".join(query.split()).casefold()
+
+
+_MINHASH_WORD = re.compile(r"[^\W\u3040-\u30ff\u4e00-\u9fff]+|[\u3040-\u30ff\u4e00-\u9fff]")
+
+
+def _mix64(x: np.ndarray) -> np.ndarray:
+    # splitmix64 finalizer; uint64 arithmetic wraps around
+    x = x ^ (x >> np.uint64(30))
+    x = x * np.uint64(0xBF58476D1CE4E5B9)
+    x = x ^ (x >> np.uint64(27))
+    x = x * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+@lru_cache(maxsize=8)
+def _minhash_seeds(num_perm: int) -> np.ndarray:
+    return np.random.RandomState(1).randint(0, 1 << 63, size=(num_perm, 1), dtype=np.uint64)
+
+
+def minhash_signature(text: str, num_perm: int = 128, shingle_size: int = 4) -> list[int]:
+    """
+    MinHash signature of the word ``shingle_size``-grams of ``text`` (CJK
+    characters count as words). Deterministic across processes so that
+    signatures can be persisted.
+    """
+    words = [zlib.crc32(w.encode("utf-8")) for w in _MINHASH_WORD.findall(text.casefold())]
+    if not words:
+        return [0] * num_perm
+    words = np.asarray(words, dtype=np.uint64)
+    count = len(words) - min(shingle_size, len(words)) + 1
+    shingles = np.zeros(count, dtype=np.uint64)
+    for i in range(min(shingle_size, len(words))):
+        shingles = _mix64(shingles ^ words[i : count + i])
+    minima = _mix64(shingles[None, :] ^ _minhash_seeds(num_perm)).min(axis=1)
+    return (minima >> np.uint64(32)).tolist()
+
+
+@dataclass
+class MinHashLSH:
+    """
+    Banded locality-sensitive hash over MinHash signatures. ``query`` returns
+    the stored key with the highest estimated Jaccard similarity if it reaches
+    ``threshold``.
+    """
+
+    bands: int = 16
+    threshold: float = 0.9
+    _buckets: dict = field(default_factory=dict, repr=False)
+    _signatures: dict = field(default_factory=dict, repr=False)
+
+    def _band_keys(self, signature: np.ndarray):
+        rows = len(signature) // self.bands
+        for band in range(self.bands):
+            yield band, signature[band * rows : (band + 1) * rows].tobytes()
+
+    def insert(self, key, signature):
+        signature = np.asarray(signature, dtype=np.uint64)
+        self._signatures[key] = signature
+        for band_key in self._band_keys(signature):
+            self._buckets.setdefault(band_key, []).append(key)
+
+    def query(self, signature):
+        signature = np.asarray(signature, dtype=np.uint64)
+        candidates = {
+            key
+            for band_key in self._band_keys(signature)
+            for key in self._buckets.get(band_key, ())
+        }
+        best, best_score = None, self.threshold
+        for key in candidates:
+            score = float(np.mean(self._signatures[key] == signature))
+            if score >= best_score:
+                best, best_score = key, score
+        return (best, best_score) if best is not None else None
+
+    def __contains__(self, key):
+        return key in self._signatures
+
+    def __len__(self):
+        return len(self._signatures)
+
+
 def wrap_embedding_func_with_attrs(**kwargs):
     """Wrap a function with attributes"""
 
@@ -171,6 +504,51 @@ def encode_string_by_tiktoken(content: str, model_name: str = ""):
     return get_tokenizer().encode(content)
 
 
+# Only short strings (descriptions, keywords, entity names) are memoised, so
+# the cache holds at most about 16M characters instead of pinning chunk texts.
+_COUNT_TOKENS_CACHE_MAX_CHARS = 1024
+
+
+def _count_tokens_uncached(content: str) -> int:
+    tokenizer = get_tokenizer()
+    if hasattr(tokenizer, "count_tokens"):
+        return tokenizer.count_tokens(content)
+    return len(tokenizer.encode(content))
+
+
+_count_tokens_cached = lru_cache(maxsize=16384)(_count_tokens_uncached)
+
+
+def count_tokens(content: str) -> int:
+    """Number of tokens of *content* under the global tokenizer, memoised for short strings."""
+
+    if not content:
+        return 0
+    if len(content) > _COUNT_TOKENS_CACHE_MAX_CHARS:
+        return _count_tokens_uncached(content)
+    return _count_tokens_cached(content)
+
+
+def token_offsets(content: str) -> Union[np.ndarray, None]:
+    """Character offsets of the tokens of *content* followed by ``len(content)``.
+
+    Returns ``None`` when the global tokenizer's tokens are not substrings of
+    the text (e.g. integer ids), so callers can fall back to ``decode``.
+    """
+
+    tokenizer = get_tokenizer()
+    if hasattr(tokenizer, "token_offsets"):
+        return tokenizer.token_offsets(content)
+    tokens = tokenizer.encode(content)
+    if tokens and not isinstance(tokens[0], str):
+        return None
+    offsets = np.zeros(len(tokens) + 1, dtype=np.int64)
+    np.cumsum(np.fromiter(map(len, tokens), dtype=np.int64, count=len(tokens)), out=offsets[1:])
+    if offsets[-1] != len(content):
+        return None
+    return offsets
+
+
 def decode_tokens_by_tiktoken(tokens: list[str], model_name: str = ""):
     """Reconstruct text from the provided tokens using the global tokenizer."""
 
@@ -184,12 +562,17 @@ def pack_user_ass_to_openai_messages(*args: str):
     ]
 
 
+@lru_cache(maxsize=64)
+def _markers_pattern(markers: tuple[str, ...]) -> re.Pattern:
+    return re.compile("|".join(re.escape(marker) for marker in markers))
+
+
 def split_string_by_multi_markers(content: str, markers: list[str]) -> list[str]:
     """Split a string by multiple markers"""
     if not markers:
         return [content]
-    results = re.split("|".join(re.escape(marker) for marker in markers), content)
-    return [r.strip() for r in results if r.strip()]
+    results = _markers_pattern(tuple(markers)).split(content)
+    return [r for r in map(str.strip, results) if r]
 
 
 # Refer the utils functions of the official GraphRAG implementation:
@@ -202,20 +585,31 @@ def clean_str(input: Any) -> str:
 
     result = html.unescape(input.strip())
     # https://stackoverflow.com/questions/4324790/removing-control-characters-from-a-string-in-python
-    return re.sub(r"[\x00-\x1f\x7f-\x9f]", "", result)
+    return _CONTROL_CHARACTERS.sub("", result)
+
+
+_CONTROL_CHARACTERS = re.compile(r"[\x00-\x1f\x7f-\x9f]")
+_FLOAT = re.compile(r"^[-+]?[0-9]*\.?[0-9]+$")
 
 
 def is_float_regex(value):
-    return bool(re.match(r"^[-+]?[0-9]*\.?[0-9]+$", value))
+    return bool(_FLOAT.match(value))
 
 
-def truncate_list_by_token_size(list_data: list, key: callable, max_token_size: int):
-    """Truncate a list of data by token size"""
+def truncate_list_by_token_size(
+    list_data: list, key: callable, max_token_size: int, count_key: callable = None
+):
+    """Truncate a list of data by token size
+
+    ``count_key`` may return a token count stored with the item (e.g. the
+    ``tokens`` of a chunk); items without one are counted from ``key``.
+    """
     if max_token_size <= 0:
         return []
     tokens = 0
     for i, data in enumerate(list_data):
-        tokens += len(encode_string_by_tiktoken(key(data)))
+        n_tokens = count_key(data) if count_key is not None else None
+        tokens += n_tokens if n_tokens is not None else count_tokens(key(data))
         if tokens > max_token_size:
             return list_data[:i]
     return list_data
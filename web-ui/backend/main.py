@@ -1,5 +1,6 @@
 from fastapi import FastAPI, UploadFile, File, HTTPException, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from db import get_hypergraph, getFrequentVertices, get_vertices, get_hyperedges, get_vertice, get_vertice_neighbor, get_hyperedge_neighbor_server, add_vertex, add_hyperedge, delete_vertex, delete_hyperedge, update_vertex, update_hyperedge, get_hyperedge_detail, db_manager
 from file_manager import file_manager
 import json
@@ -450,7 +451,10 @@ async def get_hyperrag_llm_func(prompt, system_prompt=None, history_messages=[],
             **kwargs,
         )
         
-        main_logger.info(f"LLM调用完成，响应长度: {len(response)} 字符")
+        if isinstance(response, str):
+            main_logger.info(f"LLM调用完成，响应长度: {len(response)} 字符")
+        else:
+            main_logger.info("LLM流式调用已开始")
         return response
         
     except Exception as e:
@@ -601,6 +605,18 @@ async def insert_document(doc: DocumentModel):
     except Exception as e:
         return {"success": False, "message": f"Failed to insert document: {str(e)}"}
 
+def build_query_param(query: QueryModel, return_type: str = 'json') -> QueryParam:
+    return QueryParam(
+        mode=query.mode,
+        top_k=query.top_k,
+        max_token_for_text_unit=query.max_token_for_text_unit,
+        max_token_for_entity_context=query.max_token_for_entity_context,
+        max_token_for_relation_context=query.max_token_for_relation_context,
+        only_need_context=query.only_need_context,
+        response_type=query.response_type,
+        return_type=return_type
+    )
+
 @app.post("/hyperrag/query")
 async def query_hyperrag(query: QueryModel):
     """
@@ -613,16 +629,7 @@ async def query_hyperrag(query: QueryModel):
         rag = get_or_create_hyperrag(query.database)
         
         # 创建查询参数
-        param = QueryParam(
-            mode=query.mode,
-            top_k=query.top_k,
-            max_token_for_text_unit=query.max_token_for_text_unit,
-            max_token_for_entity_context=query.max_token_for_entity_context,
-            max_token_for_relation_context=query.max_token_for_relation_context,
-            only_need_context=query.only_need_context,
-            response_type=query.response_type,
-            return_type='json'
-        )
+        param = build_query_param(query)
         
         # 执行查询
         result = await rag.aquery(query.question, param)
@@ -642,6 +649,72 @@ async def query_hyperrag(query: QueryModel):
     except Exception as e:
         return {"success": False, "message": f"Query failed: {str(e)}"}
 
+async def stream_query_events(query: QueryModel):
+    """
+    依次产生流式问答事件：先是检索元数据 (metadata)，然后是回答片段 (token)，最后是 done
+    """
+    rag = get_or_create_hyperrag(query.database)
+    param = build_query_param(query)
+    first = True
+    async for item in rag.aquery_stream(query.question, param):
+        if first:
+            first = False
+            yield "metadata", {
+                "entities": item.get("entities", []),
+                "hyperedges": item.get("hyperedges", []),
+                "text_units": item.get("text_units", []),
+                "mode": query.mode,
+                "question": query.question,
+                "database": query.database or "default"
+            }
+        else:
+            yield "token", item
+    yield "done", {}
+
+@app.post("/hyperrag/query/stream")
+async def query_hyperrag_stream(query: QueryModel):
+    """
+    使用 Server-Sent Events 流式返回问答结果，缩短首字延迟
+    """
+    if not HYPERRAG_AVAILABLE:
+        return {"success": False, "message": "HyperRAG is not available"}
+
+    async def event_source():
+        try:
+            async for event, data in stream_query_events(query):
+                yield f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+        except Exception as e:
+            main_logger.error(f"流式查询失败: {str(e)}")
+            yield f"event: error\ndata: {json.dumps({'message': f'Query failed: {str(e)}'}, ensure_ascii=False)}\n\n"
+
+    return StreamingResponse(
+        event_source(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.websocket("/ws/hyperrag/query")
+async def query_hyperrag_websocket(websocket: WebSocket):
+    """
+    WebSocket 流式问答：客户端发送 QueryModel 的 JSON，服务端逐条返回 {"event", "data"} 消息
+    """
+    await websocket.accept()
+    try:
+        while True:
+            query = QueryModel(**json.loads(await websocket.receive_text()))
+            if not HYPERRAG_AVAILABLE:
+                await websocket.send_json({"event": "error", "data": {"message": "HyperRAG is not available"}})
+                continue
+            try:
+                async for event, data in stream_query_events(query):
+                    await websocket.send_json({"event": event, "data": data})
+            except WebSocketDisconnect:
+                raise
+            except Exception as e:
+                await websocket.send_json({"event": "error", "data": {"message": f"Query failed: {str(e)}"}})
+    except WebSocketDisconnect:
+        pass
+
 @app.get("/hyperrag/status")
 async def get_hyperrag_status(database: str = None):
     """